@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+"""
+Socket adapters: the .j5 files in mega866/adapt compiled to dense pin tables.
+
+An adapter maps package pins ("01", "D13", ...) to Mega866 GPIO pins, which are
+mega pin numbers. load_adapter() validates the map against pin2Tl866_map and
+compiles it to tables indexed by package pin position: the mega pin, TL866
+instance and bit, and ready made masks. Compiled adapters, tables included,
+are cached on disk keyed by the file's hash, so scripts skip parsing,
+validation and building the tables after the first run.
+
+    pga68 = load_adapter("zsm-ic-pga68_r1")
+    controller.io_w(pga68.pins(1, 2, 3))
+"""
+
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Tuple, Union
+
+from bus import load_j5
+from gpio_controller import Tl866Instance, pin2Tl866_map, pin_translator
+
+ADAPTER_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "adapt")
+# Bump when the compiled format changes so stale cache entries are ignored
+_CACHE_VERSION = 2
+
+PackagePin = Union[int, str]
+
+
+def adapter_cache_dir() -> str:
+    if "MEGA866_CACHE_DIR" in os.environ:
+        return os.environ["MEGA866_CACHE_DIR"]
+    base = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(base, "mega866", "adapters")
+
+
+class Adapter:
+    def __init__(
+        self,
+        name: str,
+        package_pins: List[str],
+        mega_pins: List[int],
+    ) -> None:
+        """package_pins and mega_pins are parallel lists, in .j5 file order"""
+        self.name = name
+        self.package_pins: Tuple[str, ...] = tuple(package_pins)
+        self.mega_pins: Tuple[int, ...] = tuple(mega_pins)
+        self.npins = len(self.package_pins)
+        self.instances: Tuple[Tl866Instance, ...] = tuple(
+            pin2Tl866_map[p].instance for p in self.mega_pins
+        )
+        # 0 based bit of each package pin in its TL866 instance's 40 bit mask
+        self.tl866_bits: Tuple[int, ...] = tuple(
+            pin2Tl866_map[p].pin - 1 for p in self.mega_pins
+        )
+        self.masks: Tuple[int, ...] = tuple(1 << (p - 1) for p in self.mega_pins)
+        self.all_mask = 0
+        for mask in self.masks:
+            self.all_mask |= mask
+        self.instance_masks: Tuple[int, ...] = pin_translator.split(self.all_mask)
+
+        # Package pin name -> position in the tables above. Numeric names can
+        # also be given as ints, "07" as 7.
+        self.index: Dict[PackagePin, int] = {}
+        for i, package_pin in enumerate(self.package_pins):
+            self.index[package_pin] = i
+            if package_pin.isdigit():
+                self.index[int(package_pin)] = i
+
+    def __repr__(self) -> str:
+        return f"Adapter({self.name!r}, {self.npins} pins)"
+
+    def __len__(self) -> int:
+        return self.npins
+
+    def __getitem__(self, package_pin: PackagePin) -> int:
+        """Returns the mega pin a package pin is wired to"""
+        return self.mega_pins[self.index[package_pin]]
+
+    def pin(self, package_pin: PackagePin) -> int:
+        return self.masks[self.index[package_pin]]
+
+    def pins(self, *package_pins: PackagePin) -> int:
+        res = 0
+        for package_pin in package_pins:
+            res |= self.masks[self.index[package_pin]]
+        return res
+
+    def package_pin_for(self, mega_pin: int) -> Optional[str]:
+        if mega_pin in self.mega_pins:
+            return self.package_pins[self.mega_pins.index(mega_pin)]
+        return None
+
+    def to_dict(self) -> Dict:
+        return {
+            "version": _CACHE_VERSION,
+            "name": self.name,
+            "package_pins": list(self.package_pins),
+            "mega_pins": list(self.mega_pins),
+            "instances": [instance.value for instance in self.instances],
+            "tl866_bits": list(self.tl866_bits),
+            "masks": list(self.masks),
+            "all_mask": self.all_mask,
+            "instance_masks": list(self.instance_masks),
+            # Pairs, as JSON object keys can't be ints
+            "index": list(self.index.items()),
+        }
+
+    @classmethod
+    def from_dict(cls, compiled: Dict) -> "Adapter":
+        """Loads what to_dict() returned without rebuilding any table"""
+        instances = list(Tl866Instance)
+        adapter = cls.__new__(cls)
+        adapter.name = compiled["name"]
+        adapter.package_pins = tuple(compiled["package_pins"])
+        adapter.mega_pins = tuple(compiled["mega_pins"])
+        adapter.npins = len(adapter.package_pins)
+        adapter.instances = tuple(instances[v - 1] for v in compiled["instances"])
+        adapter.tl866_bits = tuple(compiled["tl866_bits"])
+        adapter.masks = tuple(compiled["masks"])
+        adapter.all_mask = compiled["all_mask"]
+        adapter.instance_masks = tuple(compiled["instance_masks"])
+        adapter.index = {key: i for key, i in compiled["index"]}
+        return adapter
+
+
+def compile_adapter(name: str, j5: Dict) -> Adapter:
+    pin2gpio = j5["pin2gpio"]
+    if len(pin2gpio) != j5["npins"]:
+        raise Exception(
+            f"{name}: npins is {j5['npins']} but {len(pin2gpio)} pins are mapped"
+        )
+    package_pins = []
+    mega_pins = []
+    seen: Dict[int, str] = {}
+    for package_pin, gpio in pin2gpio.items():
+        mega_pin = int(gpio)
+        if mega_pin not in pin2Tl866_map:
+            raise Exception(f"{name}: pin {package_pin} maps to invalid GPIO {gpio}")
+        if mega_pin in seen:
+            raise Exception(
+                f"{name}: pins {seen[mega_pin]} and {package_pin} both map to {gpio}"
+            )
+        seen[mega_pin] = package_pin
+        package_pins.append(str(package_pin))
+        mega_pins.append(mega_pin)
+    return Adapter(name, package_pins, mega_pins)
+
+
+def load_adapter(path_or_name: str, use_cache: bool = True) -> Adapter:
+    """Loads a .j5 adapter by path, or by name from ADAPTER_DIR"""
+    path = path_or_name
+    if not os.path.exists(path):
+        path = os.path.join(ADAPTER_DIR, path_or_name)
+        if not path.endswith(".j5"):
+            path += ".j5"
+    name = os.path.splitext(os.path.basename(path))[0]
+
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    cache_path = os.path.join(adapter_cache_dir(), f"{name}-{digest}.json")
+    if use_cache:
+        try:
+            with open(cache_path) as f:
+                cached = json.load(f)
+            if cached.get("version") == _CACHE_VERSION:
+                return Adapter.from_dict(cached)
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    adapter = compile_adapter(name, load_j5(path))
+    if use_cache:
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(adapter.to_dict(), f)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # A read only cache just means compiling every time
+            pass
+    return adapter
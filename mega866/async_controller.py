@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+"""
+Awaitable front end to a GpioController, for tools built on an asyncio loop.
+
+    async with AsyncGpioController(GpioController(...)) as controller:
+        await controller.io_w(pins)
+        await asyncio.gather(controller.io_r(earth_pins), controller.io_r(fire_pins))
+
+The otl866 Bitbang calls block on the serial port, so each TL866 gets one
+worker thread and commands are awaited on it. Commands for different TL866s
+overlap, while commands for the same TL866 run in the order they were
+issued. Only the calling coroutine waits, so a UI and a clock loop can share
+one event loop without threads of their own.
+
+The controller's write cache, counters and metrics are shared. Don't drive
+the same GpioController directly while an AsyncGpioController is in use.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from typing import Any, Callable, Dict, List, Tuple
+
+from gpio_controller import (
+    WAIT_MAX_INTERVAL,
+    WAIT_MIN_INTERVAL,
+    Bitbang,
+    GpioController,
+    pin_translator,
+)
+
+
+class AsyncGpioController:
+    def __init__(self, controller: GpioController) -> None:
+        self.controller = controller
+        self._workers: Dict[Bitbang, ThreadPoolExecutor] = {
+            bb: ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=f"tl866-async-{instance.name}"
+            )
+            for instance, bb in zip(controller.instances, controller)
+        }
+        self._device_pins = controller.device_pins()
+
+    async def __aenter__(self) -> "AsyncGpioController":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        for worker in self._workers.values():
+            worker.shutdown()
+        self._workers = {}
+
+    async def _run(
+        self, calls: List[Tuple[Bitbang, Callable, Tuple[Any, ...]]]
+    ) -> List[Any]:
+        loop = asyncio.get_running_loop()
+        # Every call finishes before an error is raised, so nothing is still
+        # running on a worker when the caller moves on
+        results = await asyncio.gather(
+            *(
+                loop.run_in_executor(self._workers[c], function, *args)
+                for c, function, args in calls
+            ),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return list(results)
+
+    async def _run_each(self, method: str, *args: Any) -> List[Any]:
+        return await self._run(
+            [(c, getattr(c, method), args) for c in self.controller]
+        )
+
+    async def _run_cached(
+        self, method: str, val_per_controller: Dict[Bitbang, int]
+    ) -> None:
+        controller = self.controller
+        shadow = controller._shadow
+        calls = []
+        for c, val in val_per_controller.items():
+            if shadow is not None and shadow.get((c, method)) == val:
+                controller.writes_elided += 1
+            else:
+                calls.append((c, getattr(c, method), (val,)))
+                # Claimed up front so a concurrent identical write is elided
+                if shadow is not None:
+                    shadow[(c, method)] = val
+        controller.writes_issued += len(calls)
+        try:
+            await self._run(calls)
+        except BaseException:
+            if shadow is not None:
+                for c, _, _ in calls:
+                    shadow.pop((c, method), None)
+            raise
+
+    async def _run_per_controller(self, method: str, val: int) -> None:
+        await self._run_cached(method, self.controller._get_pins_per_controller(val))
+
+    async def _read(self, val: int) -> int:
+        """io_r of only the TL866s owning pins in val"""
+        owners = self.controller._owners(val)
+        reads = await self._run([(c, c.io_r, ()) for _, c in owners])
+        res = 0
+        for (instance, _), pins in zip(owners, reads):
+            res |= pin_translator.merge(instance, pins)
+        return res
+
+    async def vdd_en(self, enable: bool = True) -> None:
+        await self._run_each("vdd_en")
+
+    async def vdd_volt(self, val: int) -> None:
+        await self._run_cached("vdd_volt", {c: val for c in self.controller})
+
+    async def vdd_pins(self, val: int) -> None:
+        await self._run_per_controller("vdd_pins", val)
+
+    async def vpp_en(self, enable: bool = True) -> None:
+        await self._run_each("vpp_en")
+
+    async def vpp_volt(self, val: int) -> None:
+        await self._run_cached("vpp_volt", {c: val for c in self.controller})
+
+    async def vpp_pins(self, val: int) -> None:
+        await self._run_per_controller("vpp_pins", val)
+
+    async def gnd_pins(self, val: int) -> None:
+        await self._run_per_controller("gnd_pins", val)
+
+    async def io_tri(self, val: int) -> None:
+        await self._run_per_controller("io_tri", val)
+
+    async def io_trir(self) -> int:
+        res = 0
+        reads = await self._run_each("io_trir")
+        for instance, pins in zip(self.controller.instances, reads):
+            res |= pin_translator.merge(instance, pins)
+        return res
+
+    async def io_w(self, val: int) -> None:
+        await self._run_per_controller("io_w", val)
+
+    async def io_r(self, val: int = int("ff" * 5 * 4, base=16)) -> int:
+        # Instances without a device are skipped, like GpioController.io_r()
+        return await self._read(val & self._device_pins)
+
+    async def init(self) -> None:
+        await self._run_each("init")
+        self.controller.invalidate()
+
+    async def wait_for(
+        self, mask: int, value: int, timeout: float = 1.0
+    ) -> Tuple[int, float]:
+        """GpioController.wait_for(), yielding to the loop between polls"""
+        value &= mask
+        start = monotonic()
+        deadline = start + timeout
+        interval = WAIT_MIN_INTERVAL
+        while True:
+            sample = await self._read(mask)
+            now = monotonic()
+            if sample & mask == value:
+                return sample, now - start
+            if now >= deadline:
+                raise Exception(f"timed out after {timeout} s waiting on {mask:#x}")
+            await asyncio.sleep(min(interval, deadline - now))
+            interval = min(interval * 2, WAIT_MAX_INTERVAL)
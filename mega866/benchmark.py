@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+
+"""
+Benchmarks the controller's pure Python hot paths and counts the TL866
+commands per bus cycle of the example flows.
+
+Timings are the best of several runs, in ns per call, with all four TL866s on
+a VirtualBoard so no hardware is needed. Command counts come from the same
+VirtualBoard and are exact. Run it from this directory:
+
+    python3 benchmark.py --output before.json
+    ... change something ...
+    python3 benchmark.py --output after.json
+    python3 compare_benchmarks.py before.json after.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import time
+import timeit
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from gpio_controller import (
+    TL866_ALL_PINS_MASK,
+    GpioController,
+    Tl866Instance,
+    all_earth_pins,
+    all_pins,
+    pin_translator,
+)
+from virtual_tl866 import DutModel, VirtualBoard
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.realpath(__file__)), "examples")
+
+
+def _mask(mega_pins: Any) -> int:
+    res = 0
+    for mega_pin in mega_pins:
+        res |= 1 << (mega_pin - 1)
+    return res
+
+
+FULL_MASK = _mask(all_pins)
+EARTH_MASK = _mask(all_earth_pins)
+
+
+def time_call(function: Callable[[], Any], repeat: int = 5) -> float:
+    """ns per call of function, the best of repeat runs"""
+    timer = timeit.Timer(function)
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat, number)) / number * 1e9
+
+
+def virtual_controller(
+    dut: Optional[DutModel] = None,
+) -> Tuple[VirtualBoard, GpioController]:
+    board = VirtualBoard(dut=dut)
+    controller = GpioController(
+        **{
+            f"{instance.name.lower()}_serial_device": instance.name.lower()
+            for instance in Tl866Instance
+        },
+        backend=board.open,
+    )
+    controller.init()
+    return board, controller
+
+
+def commands_per_cycle(
+    board: VirtualBoard, run: Callable[[], Any], n_cycles: int
+) -> Dict[str, float]:
+    """The commands run() sends per bus cycle, in total and by command"""
+    before = board.command_counts()
+    run()
+    counts = board.command_counts() - before
+    res = {"total": sum(counts.values()) / n_cycles}
+    res.update({name: count / n_cycles for name, count in sorted(counts.items())})
+    return res
+
+
+def _harness_6502(predict: bool) -> Tuple[VirtualBoard, Any]:
+    from examples.example_6502.harness_6502 import (
+        CLOCK_PIN,
+        RESET_PIN,
+        Harness6502,
+        cpu_bus,
+    )
+    from memory import Memory
+    from virtual_6502 import Virtual6502
+
+    memory = Memory()
+    memory.load_hex(os.path.join(EXAMPLES, "example_6502", "prog_6502.hex"))
+    board = VirtualBoard(dut=Virtual6502(cpu_bus, CLOCK_PIN, RESET_PIN))
+    harness = Harness6502(
+        memory.read,
+        memory.write,
+        earth_serial_device="earth",
+        backend=board.open,
+        predict=predict,
+        peek=memory.data.__getitem__,
+    )
+    harness.power_up()
+    # Past the reset sequence, into the program's loop
+    for _ in range(100):
+        harness.clock_cycle()
+    return board, harness
+
+
+def benchmark_masks() -> Dict[str, float]:
+    from examples.example_6502.harness_6502 import always_high_pins
+
+    _, controller = virtual_controller()
+    always_high_int = int(always_high_pins)
+    return {
+        "split full mask": time_call(lambda: pin_translator.split(FULL_MASK)),
+        "split EARTH mask": time_call(lambda: pin_translator.split(EARTH_MASK)),
+        "merge EARTH mask": time_call(
+            lambda: pin_translator.merge(Tl866Instance.EARTH, TL866_ALL_PINS_MASK)
+        ),
+        "_get_pins_per_controller full mask": time_call(
+            lambda: controller._get_pins_per_controller(FULL_MASK)
+        ),
+        "_get_pins_per_controller EARTH mask": time_call(
+            lambda: controller._get_pins_per_controller(EARTH_MASK)
+        ),
+        "_get_pins_per_controller 6502 always_high_pins": time_call(
+            lambda: controller._get_pins_per_controller(always_high_pins)
+        ),
+        "_get_pins_per_controller 6502 always_high_pins as int": time_call(
+            lambda: controller._get_pins_per_controller(always_high_int)
+        ),
+        "io_r full mask": time_call(lambda: controller.io_r(FULL_MASK)),
+        "io_r EARTH mask": time_call(lambda: controller.io_r(EARTH_MASK)),
+    }
+
+
+def benchmark_6502_decoding() -> Dict[str, float]:
+    from examples.example_6502.harness_6502 import (
+        bus_pins,
+        get_address_pins,
+        get_data_pins_from_byte,
+        pins,
+    )
+
+    sample = int(bus_pins)
+    return {
+        "6502 pins() of the control pins": time_call(
+            lambda: pins(3, 7, 49, 55, 57, 61)
+        ),
+        "6502 get_address_pins": time_call(lambda: get_address_pins(sample)),
+        "6502 get_data_pins_from_byte": time_call(
+            lambda: get_data_pins_from_byte(0xA5)
+        ),
+    }
+
+
+def benchmark_flows(n_cycles: int) -> Tuple[Dict[str, float], Dict[str, Any]]:
+    timings: Dict[str, float] = {}
+    counts: Dict[str, Any] = {}
+    for predict in (False, True):
+        name = "6502 clock_cycle" + (" predicted" if predict else "")
+        board, harness = _harness_6502(predict)
+        timings[name] = time_call(harness.clock_cycle)
+        board, harness = _harness_6502(predict)
+
+        def run() -> None:
+            for _ in range(n_cycles):
+                harness.clock_cycle()
+
+        counts[name] = commands_per_cycle(board, run, n_cycles)
+
+    from examples.example_80186.example_80186 import do_bus_cycles
+
+    board, controller = virtual_controller()
+    with contextlib.redirect_stdout(io.StringIO()):
+        counts["80186 do_bus_cycles"] = commands_per_cycle(
+            board, lambda: do_bus_cycles(controller, n_cycles=n_cycles), n_cycles
+        )
+    return timings, counts
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=os.path.dirname(os.path.realpath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(n_cycles: int = 1000) -> Dict[str, Any]:
+    timings = benchmark_masks()
+    timings.update(benchmark_6502_decoding())
+    flow_timings, counts = benchmark_flows(n_cycles)
+    timings.update(flow_timings)
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "ns_per_call": timings,
+        "commands_per_cycle": counts,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the controller hot paths")
+    parser.add_argument("--output", help="write the results here as JSON")
+    parser.add_argument(
+        "--cycles",
+        type=int,
+        default=1000,
+        help="bus cycles to count commands over",
+    )
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.cycles)
+    for name, ns in results["ns_per_call"].items():
+        print(f"{name:<55} {ns:>12.1f} ns")
+    for name, counts in results["commands_per_cycle"].items():
+        by_command = ", ".join(
+            f"{command} {count:.2f}"
+            for command, count in counts.items()
+            if command != "total"
+        )
+        print(f"{name:<55} {counts['total']:>12.2f} commands/cycle ({by_command})")
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
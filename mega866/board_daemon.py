@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+
+"""
+A long running owner of the TL866 connections, shared over a Unix socket.
+
+Opening four TL866s, init() and power sequencing take seconds. The daemon does
+that once and keeps the GpioController, so scripts attach in milliseconds with
+RemoteGpioController, which has the same methods:
+
+    python3 board_daemon.py --earth /dev/serial/by-id/...
+
+    controller = RemoteGpioController()
+    controller.io_w(pins)
+    with controller.transaction() as t:
+        t.io_w(pins)
+        t.io_r()
+    print(t.results)
+
+Several clients may share one board. Each request is a batch of commands the
+daemon runs back to back without interleaving other clients' commands.
+
+Wire format, all little endian: a request is a u32 length followed by
+commands, each an opcode byte and its argument, a 20 byte mega pin mask, a u8
+or an f64 delay in seconds. A reply is a u32 length, a status byte and either
+one 20 byte mask per read command or a UTF-8 error message.
+"""
+
+import argparse
+import os
+import socket
+import socketserver
+import struct
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple
+
+from gpio_controller import (
+    MEGA866_HIGHEST_PIN_NUMBER,
+    MEGA866_MASK_BYTES,
+    GpioController,
+    Tl866Instance,
+    open_bitbang,
+)
+
+_LENGTH = struct.Struct("<I")
+_DELAY = struct.Struct("<d")
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+# opcode -> (command, argument kind). "m" is a mega pin mask, "B" a byte, "d" a
+# delay in seconds and "" no argument.
+COMMANDS: Dict[int, Tuple[str, str]] = {
+    0x01: ("init", ""),
+    0x02: ("invalidate", ""),
+    0x03: ("resync", ""),
+    0x04: ("device_pins", ""),
+    0x10: ("vdd_en", "B"),
+    0x11: ("vdd_volt", "B"),
+    0x12: ("vdd_pins", "m"),
+    0x20: ("vpp_en", "B"),
+    0x21: ("vpp_volt", "B"),
+    0x22: ("vpp_pins", "m"),
+    0x30: ("gnd_pins", "m"),
+    0x40: ("io_tri", "m"),
+    0x41: ("io_trir", ""),
+    0x42: ("io_w", "m"),
+    0x43: ("io_r", "m"),
+    0x44: ("delay", "d"),
+}
+OPCODES: Dict[str, int] = {command: op for op, (command, _) in COMMANDS.items()}
+# Commands the daemon runs through a GpioController.transaction()
+TRANSACTION_COMMANDS = frozenset(("io_tri", "io_w", "io_r", "delay"))
+
+ALL_PINS = (1 << (MEGA866_MASK_BYTES * 8)) - 1
+
+
+def default_socket_path() -> str:
+    if "MEGA866_SOCKET" in os.environ:
+        return os.environ["MEGA866_SOCKET"]
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR", "/tmp")
+    return os.path.join(runtime_dir, f"mega866-{os.getuid()}.sock")
+
+
+def encode_command(command: str, arg: Any = None) -> bytes:
+    op = OPCODES[command]
+    kind = COMMANDS[op][1]
+    if kind == "m":
+        if arg >> MEGA866_HIGHEST_PIN_NUMBER:
+            raise Exception(f"Pin {arg.bit_length()} is not valid")
+        return bytes((op,)) + arg.to_bytes(MEGA866_MASK_BYTES, "little")
+    if kind == "B":
+        return bytes((op, arg))
+    if kind == "d":
+        return bytes((op,)) + _DELAY.pack(arg)
+    return bytes((op,))
+
+
+def decode_commands(payload: bytes) -> List[Tuple[str, Any]]:
+    commands = []
+    offset = 0
+    while offset < len(payload):
+        op = payload[offset]
+        offset += 1
+        if op not in COMMANDS:
+            raise Exception(f"unknown opcode {op:#04x}")
+        command, kind = COMMANDS[op]
+        if kind == "m":
+            arg: Any = int.from_bytes(
+                payload[offset : offset + MEGA866_MASK_BYTES], "little"
+            )
+            offset += MEGA866_MASK_BYTES
+        elif kind == "B":
+            arg = payload[offset]
+            offset += 1
+        elif kind == "d":
+            (arg,) = _DELAY.unpack_from(payload, offset)
+            offset += _DELAY.size
+        else:
+            arg = None
+        commands.append((command, arg))
+    if offset != len(payload):
+        raise Exception("truncated request")
+    return commands
+
+
+def _recv_exact(sock: socket.socket, n: int) -> Optional[bytes]:
+    """Returns exactly n bytes, or None if the peer closed before sending any"""
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            if buf:
+                raise Exception("connection closed mid frame")
+            return None
+        buf += chunk
+    return bytes(buf)
+
+
+def _recv_frame(sock: socket.socket) -> Optional[bytes]:
+    header = _recv_exact(sock, _LENGTH.size)
+    if header is None:
+        return None
+    (length,) = _LENGTH.unpack(header)
+    if not length:
+        return b""
+    payload = _recv_exact(sock, length)
+    if payload is None:
+        raise Exception("connection closed mid frame")
+    return payload
+
+
+def _send_frame(sock: socket.socket, payload: bytes) -> None:
+    sock.sendall(_LENGTH.pack(len(payload)) + payload)
+
+
+class BoardDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, controller: GpioController, path: str) -> None:
+        if os.path.exists(path):
+            os.unlink(path)
+        self.controller = controller
+        self.path = path
+        # One batch at a time reaches the controller
+        self.lock = Lock()
+        super().__init__(path, _BatchHandler)
+
+    def server_close(self) -> None:
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def run_batch(self, commands: List[Tuple[str, Any]]) -> List[int]:
+        """
+        Runs commands in order and returns the read results. Runs of
+        io_tri/io_w/io_r/delay go through one transaction, so they get the
+        controller's write elision and concurrent flush. The transaction keeps
+        them in order across TL866s, so a client may write one and read
+        another in the same batch.
+        """
+        controller = self.controller
+        results: List[int] = []
+        with self.lock:
+            transaction = None
+            for command, arg in commands:
+                if command in TRANSACTION_COMMANDS:
+                    if transaction is None:
+                        transaction = controller.transaction()
+                    getattr(transaction, command)(arg)
+                    continue
+                if transaction is not None:
+                    results.extend(transaction.flush())
+                    transaction = None
+                if command in ("io_trir", "device_pins"):
+                    results.append(getattr(controller, command)())
+                elif command in ("vdd_en", "vpp_en"):
+                    getattr(controller, command)(bool(arg))
+                elif arg is None:
+                    getattr(controller, command)()
+                else:
+                    getattr(controller, command)(arg)
+            if transaction is not None:
+                results.extend(transaction.flush())
+        return results
+
+
+class _BatchHandler(socketserver.BaseRequestHandler):
+    server: BoardDaemon
+
+    def handle(self) -> None:
+        while True:
+            payload = _recv_frame(self.request)
+            if payload is None:
+                return
+            try:
+                results = self.server.run_batch(decode_commands(payload))
+            except Exception as e:
+                _send_frame(self.request, bytes((STATUS_ERROR,)) + str(e).encode())
+                continue
+            reply = bytearray((STATUS_OK,))
+            for result in results:
+                reply += result.to_bytes(MEGA866_MASK_BYTES, "little")
+            _send_frame(self.request, bytes(reply))
+
+
+class RemoteGpioController:
+    """GpioController look-alike that talks to a BoardDaemon"""
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path if path is not None else default_socket_path()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(self.path)
+
+    def __enter__(self) -> "RemoteGpioController":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._sock.close()
+
+    def run_batch(self, request: bytes) -> List[int]:
+        """Sends encoded commands and returns the masks the reads produced"""
+        _send_frame(self._sock, request)
+        reply = _recv_frame(self._sock)
+        if reply is None:
+            raise Exception(f"{self.path} closed the connection")
+        if reply[0] != STATUS_OK:
+            raise Exception(reply[1:].decode(errors="replace"))
+        return [
+            int.from_bytes(reply[i : i + MEGA866_MASK_BYTES], "little")
+            for i in range(1, len(reply), MEGA866_MASK_BYTES)
+        ]
+
+    def _call(self, command: str, arg: Any = None) -> List[int]:
+        return self.run_batch(encode_command(command, arg))
+
+    def vdd_en(self, enable: bool = True) -> None:
+        self._call("vdd_en", int(enable))
+
+    def vdd_volt(self, val: int) -> None:
+        self._call("vdd_volt", val)
+
+    def vdd_pins(self, val: int) -> None:
+        self._call("vdd_pins", val)
+
+    def vpp_en(self, enable: bool = True) -> None:
+        self._call("vpp_en", int(enable))
+
+    def vpp_volt(self, val: int) -> None:
+        self._call("vpp_volt", val)
+
+    def vpp_pins(self, val: int) -> None:
+        self._call("vpp_pins", val)
+
+    def gnd_pins(self, val: int) -> None:
+        self._call("gnd_pins", val)
+
+    def io_tri(self, val: int = ALL_PINS) -> None:
+        self._call("io_tri", val)
+
+    def io_trir(self, val: int = ALL_PINS) -> int:
+        return self._call("io_trir")[0]
+
+    def io_w(self, val: int) -> None:
+        self._call("io_w", val)
+
+    def io_r(self, val: int = ALL_PINS) -> int:
+        return self._call("io_r", val)[0]
+
+    def init(self) -> None:
+        self._call("init")
+
+    def invalidate(self) -> None:
+        self._call("invalidate")
+
+    def resync(self) -> None:
+        self._call("resync")
+
+    def device_pins(self) -> int:
+        return self._call("device_pins")[0]
+
+    def transaction(self) -> "RemoteTransaction":
+        return RemoteTransaction(self)
+
+
+class RemoteTransaction:
+    """Transaction look-alike, flush() sends the whole queue as one request"""
+
+    def __init__(self, controller: RemoteGpioController) -> None:
+        self._controller = controller
+        self._request = bytearray()
+        self._n_reads = 0
+        self.results: List[int] = []
+
+    def __enter__(self) -> "RemoteTransaction":
+        return self
+
+    def __exit__(self, exc_type: Any, *exc_info: Any) -> None:
+        if exc_type is None:
+            self.flush()
+
+    def io_tri(self, val: int = ALL_PINS) -> None:
+        self._request += encode_command("io_tri", val)
+
+    def io_w(self, val: int) -> None:
+        self._request += encode_command("io_w", val)
+
+    def io_r(self, val: int = ALL_PINS) -> int:
+        """Queues a read and returns its index in the list flush() returns"""
+        self._request += encode_command("io_r", val)
+        self._n_reads += 1
+        return self._n_reads - 1
+
+    def delay(self, seconds: float) -> None:
+        self._request += encode_command("delay", seconds)
+
+    def flush(self) -> List[int]:
+        request = bytes(self._request)
+        self._request = bytearray()
+        self._n_reads = 0
+        self.results = self._controller.run_batch(request) if request else []
+        return self.results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Hold the Mega866 TL866 connections and serve them on a Unix socket"
+    )
+    for instance in Tl866Instance:
+        parser.add_argument(
+            f"--{instance.name.lower()}",
+            metavar="DEVICE",
+            help=f"serial device of the {instance.name} TL866",
+        )
+    parser.add_argument(
+        "--socket", default=default_socket_path(), help="Unix socket to listen on"
+    )
+    parser.add_argument(
+        "--concurrent",
+        action="store_true",
+        help="run commands to different TL866s in parallel",
+    )
+    parser.add_argument(
+        "--simulate",
+        action="store_true",
+        help="serve a VirtualBoard instead of real hardware",
+    )
+    args = parser.parse_args()
+
+    backend = open_bitbang
+    if args.simulate:
+        from virtual_tl866 import VirtualBoard
+
+        backend = VirtualBoard().open
+        # Without any devices given, simulate all four TL866s
+        names = [instance.name.lower() for instance in Tl866Instance]
+        if all(getattr(args, name) is None for name in names):
+            for name in names:
+                setattr(args, name, name)
+
+    controller = GpioController(
+        water_serial_device=args.water,
+        earth_serial_device=args.earth,
+        fire_serial_device=args.fire,
+        wind_serial_device=args.wind,
+        concurrent=args.concurrent,
+        backend=backend,
+    )
+    controller.init()
+    with controller, BoardDaemon(controller, args.socket) as daemon:
+        print(f"Serving {len(controller.bitbangers)} TL866(s) on {args.socket}")
+        try:
+            daemon.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
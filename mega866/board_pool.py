@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+
+"""
+Runs jobs on several Mega866 boards at once, one worker process per board.
+
+A board is up to four serial devices, one per TL866. Each worker opens its
+board and takes the next job off a shared queue whenever it is idle, so jobs go
+to whichever board is free and adding boards adds throughput. Results come back
+to the parent with the job's command latency metrics:
+
+    with BoardPool(load_boards("boards.json")) as pool:
+        pool.submit("vectors", path="count.vec", adapter="zsm-ic-pga68_r1")
+        pool.submit("sweep", adapter="zsm-ic-pga68_r1")
+        for result in pool.results():
+            print(result.board, result.ok, result.result)
+
+Job kinds are "vectors" (a vector file, see vectors.py), "sweep" (see
+continuity.py) and "call", which runs function="module:name" as
+name(controller, **kwargs) for anything else, e.g. firmware runs. Every job
+starts from controller.init() and its result must be picklable.
+
+The boards file is JSON, board name -> TL866 name -> serial device:
+
+    {"bench1": {"earth": "/dev/ttyACM0", "fire": "/dev/ttyACM1"}}
+"""
+
+import argparse
+import importlib
+import json
+import multiprocessing
+import queue
+import time
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+from gpio_controller import GpioController, Tl866Instance, open_bitbang
+
+
+class BoardSpec(NamedTuple):
+    name: str
+    water: Optional[str] = None
+    earth: Optional[str] = None
+    fire: Optional[str] = None
+    wind: Optional[str] = None
+
+
+class Job(NamedTuple):
+    job_id: int
+    kind: str
+    kwargs: Dict[str, Any]
+
+
+class JobResult(NamedTuple):
+    job_id: int
+    kind: str
+    board: str
+    ok: bool
+    result: Any
+    error: Optional[str]
+    elapsed_s: float
+    # metrics.Metrics.snapshot() covering only this job
+    metrics: Optional[Dict[str, Any]]
+
+
+def load_boards(path: str) -> List[BoardSpec]:
+    with open(path) as f:
+        boards = json.load(f)
+    return [BoardSpec(name, **devices) for name, devices in boards.items()]
+
+
+def simulated_boards(n: int) -> List[BoardSpec]:
+    """n boards of four virtual TL866s, for BoardPool(simulate=True)"""
+    names = [instance.name.lower() for instance in Tl866Instance]
+    return [BoardSpec(f"sim{i}", *names) for i in range(n)]
+
+
+def _vectors_job(
+    controller: GpioController,
+    path: str,
+    adapter: Optional[str] = None,
+    batch_size: int = 256,
+    max_mismatches: int = 10,
+    settle: float = 0.0,
+) -> Dict[str, Any]:
+    from adapter import load_adapter
+    from vectors import read_vectors, run_vectors
+
+    report = run_vectors(
+        controller,
+        read_vectors(path, load_adapter(adapter) if adapter is not None else None),
+        batch_size=batch_size,
+        max_mismatches=max_mismatches,
+        settle=settle,
+    )
+    return {
+        "vectors": report.vectors,
+        "mismatches": report.mismatches,
+        "first_mismatches": [m._asdict() for m in report.first_mismatches],
+        "elapsed_s": report.elapsed_s,
+        "vectors_per_second": report.vectors_per_second,
+    }
+
+
+def _sweep_job(
+    controller: GpioController,
+    adapter: Optional[str] = None,
+    nets: Sequence[Sequence[Any]] = (),
+    settle: float = 0.0,
+    repeats: int = 2,
+) -> Dict[str, Any]:
+    from adapter import load_adapter
+    from continuity import sweep
+
+    return sweep(
+        controller,
+        load_adapter(adapter) if adapter is not None else None,
+        nets,
+        settle=settle,
+        repeats=repeats,
+    )
+
+
+def _call_job(controller: GpioController, function: str, **kwargs: Any) -> Any:
+    return _load(function)(controller, **kwargs)
+
+
+JOB_KINDS = {
+    "vectors": _vectors_job,
+    "sweep": _sweep_job,
+    "call": _call_job,
+}
+
+
+def _load(name: str) -> Any:
+    module_name, _, attr = name.partition(":")
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def _worker(
+    board: BoardSpec,
+    simulate: bool,
+    dut: Optional[str],
+    latency: float,
+    jobs: "multiprocessing.Queue[Optional[Job]]",
+    messages: "multiprocessing.Queue[Any]",
+) -> None:
+    from metrics import Metrics
+
+    metrics = Metrics()
+    if simulate:
+        from virtual_tl866 import VirtualBoard
+
+        backend = VirtualBoard(
+            latency=latency, dut=_load(dut)() if dut is not None else None
+        ).open
+    else:
+        backend = open_bitbang
+    try:
+        controller = GpioController(
+            water_serial_device=board.water,
+            earth_serial_device=board.earth,
+            fire_serial_device=board.fire,
+            wind_serial_device=board.wind,
+            concurrent=True,
+            backend=backend,
+            metrics=metrics,
+        )
+    except Exception as e:
+        messages.put(("failed", board.name, str(e)))
+        return
+
+    with controller:
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            messages.put(("started", board.name, job.job_id))
+            start = time.monotonic()
+            try:
+                controller.init()
+                metrics.reset()
+                result = JOB_KINDS[job.kind](controller, **job.kwargs)
+                ok, error = True, None
+            except Exception as e:
+                result, ok, error = None, False, f"{type(e).__name__}: {e}"
+            messages.put(
+                (
+                    "result",
+                    JobResult(
+                        job.job_id,
+                        job.kind,
+                        board.name,
+                        ok,
+                        result,
+                        error,
+                        time.monotonic() - start,
+                        metrics.snapshot(),
+                    ),
+                )
+            )
+
+
+class BoardPool:
+    def __init__(
+        self,
+        boards: Sequence[BoardSpec],
+        simulate: bool = False,
+        dut: Optional[str] = None,
+        latency: float = 0.0,
+    ) -> None:
+        """
+        Starts one worker process per board. With simulate each board is a
+        VirtualBoard, the device names only say which TL866s it has, with
+        latency per command and a DUT model, dut="module:name" of a DutModel
+        class.
+        """
+        if len({board.name for board in boards}) != len(boards):
+            raise Exception("board names must be unique")
+        # Spawned, not forked, so a worker shares no open devices or module
+        # state with the parent or the other boards
+        context = multiprocessing.get_context("spawn")
+        self._jobs: "multiprocessing.Queue[Optional[Job]]" = context.Queue()
+        self._messages: "multiprocessing.Queue[Any]" = context.Queue()
+        self._workers = {
+            board.name: context.Process(
+                target=_worker,
+                args=(board, simulate, dut, latency, self._jobs, self._messages),
+                name=f"mega866-{board.name}",
+                daemon=True,
+            )
+            for board in boards
+        }
+        for worker in self._workers.values():
+            worker.start()
+        self._next_id = 0
+        self._outstanding: Dict[int, Job] = {}
+        # board -> the job it is running
+        self._running: Dict[str, int] = {}
+        self.failed_boards: Dict[str, str] = {}
+
+    def __enter__(self) -> "BoardPool":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        for _ in self._workers:
+            self._jobs.put(None)
+        for worker in self._workers.values():
+            worker.join()
+        self._workers = {}
+
+    def submit(self, kind: str, **kwargs: Any) -> int:
+        """Queues a job for the next idle board, returns its job_id"""
+        if kind not in JOB_KINDS:
+            raise Exception(f"unknown job kind {kind}")
+        job = Job(self._next_id, kind, kwargs)
+        self._next_id += 1
+        self._outstanding[job.job_id] = job
+        self._jobs.put(job)
+        return job.job_id
+
+    def results(self) -> Iterator[JobResult]:
+        """Yields results as jobs finish, until every submitted job is done"""
+        while self._outstanding:
+            try:
+                message = self._messages.get(timeout=0.5)
+            except queue.Empty:
+                yield from self._reap()
+                continue
+            if message[0] == "started":
+                self._running[message[1]] = message[2]
+            elif message[0] == "failed":
+                self.failed_boards[message[1]] = message[2]
+            else:
+                result = message[1]
+                self._running.pop(result.board, None)
+                del self._outstanding[result.job_id]
+                yield result
+
+    def _reap(self) -> Iterator[JobResult]:
+        # A worker that died mid job takes the job with it
+        for name, worker in self._workers.items():
+            if worker.is_alive():
+                continue
+            job_id = self._running.pop(name, None)
+            if job_id is not None and job_id in self._outstanding:
+                job = self._outstanding.pop(job_id)
+                yield JobResult(
+                    job_id,
+                    job.kind,
+                    name,
+                    False,
+                    None,
+                    f"worker exited with code {worker.exitcode}",
+                    0.0,
+                    None,
+                )
+        if self._outstanding and not any(
+            worker.is_alive() for worker in self._workers.values()
+        ):
+            raise Exception(
+                f"no boards left to run {len(self._outstanding)} job(s): "
+                f"{self.failed_boards}"
+            )
+
+    def run(self, jobs: Sequence[Dict[str, Any]]) -> List[JobResult]:
+        """
+        Submits jobs, each a dict of "kind" and the job's arguments, and
+        returns their results in the same order
+        """
+        job_ids = [self.submit(**job) for job in jobs]
+        by_id = {result.job_id: result for result in self.results()}
+        return [by_id[job_id] for job_id in job_ids]
+
+
+def print_summary(results: Sequence[JobResult], elapsed_s: float) -> None:
+    busy: Dict[str, float] = {}
+    counts: Dict[str, int] = {}
+    for result in results:
+        busy[result.board] = busy.get(result.board, 0.0) + result.elapsed_s
+        counts[result.board] = counts.get(result.board, 0) + 1
+    failed = sum(1 for result in results if not result.ok)
+    print(f"{len(results)} jobs, {failed} failed, in {elapsed_s:.2f} s")
+    for board in sorted(busy):
+        print(
+            f"  {board:<12} {counts[board]:>5} jobs, busy {busy[board]:.2f} s "
+            f"({busy[board] / elapsed_s if elapsed_s else 0.0:.0%})"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run jobs across Mega866 boards")
+    parser.add_argument(
+        "jobs", help='JSON file with a list of jobs, e.g. {"kind": "sweep"}'
+    )
+    parser.add_argument("--boards", help="JSON file of the boards' serial devices")
+    parser.add_argument(
+        "--simulate",
+        type=int,
+        metavar="N",
+        help="run on N VirtualBoards instead of real hardware",
+    )
+    parser.add_argument(
+        "--results", help="write the results here, one JSON object per line"
+    )
+    args = parser.parse_args()
+
+    if args.simulate is not None:
+        boards = simulated_boards(args.simulate)
+    elif args.boards is not None:
+        boards = load_boards(args.boards)
+    else:
+        parser.error("give --boards or --simulate")
+    with open(args.jobs) as f:
+        jobs = json.load(f)
+
+    start = time.monotonic()
+    with BoardPool(boards, simulate=args.simulate is not None) as pool:
+        results = pool.run(jobs)
+        elapsed_s = time.monotonic() - start
+        for name, error in pool.failed_boards.items():
+            print(f"{name} failed to open: {error}")
+    if args.results is not None:
+        with open(args.results, "w") as f:
+            for result in results:
+                f.write(json.dumps(result._asdict()) + "\n")
+    for result in results:
+        if not result.ok:
+            print(f"job {result.job_id} ({result.kind}) on {result.board}: {result.error}")
+    print_summary(results, elapsed_s)
+
+
+if __name__ == "__main__":
+    main()
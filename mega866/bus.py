@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+"""
+Bus definitions: named groups of mega pins compiled into lookup table codecs.
+
+A group lists its mega pins from the least to the most significant bit, e.g.
+an 8 bit data bus is 8 pins long. Encoding a value and decoding a 160 bit
+io_r() sample both cost one table lookup per byte rather than one test per pin.
+
+Definitions can be loaded from a .j5 file in the same style as the adapters in
+mega866/adapt:
+
+{
+    "groups": {
+        "data": ["011", "013", "015", "017", "019", "021", "077", "079"],
+        "rw": ["065"],
+    }
+}
+"""
+
+import json
+import re
+from typing import Dict, Iterable, List, Tuple, Union
+
+from gpio_controller import MEGA866_MASK_BYTES, pin2Tl866_map
+
+PinName = Union[int, str]
+
+
+def load_j5(path: str) -> Dict:
+    """Loads the JSON5 subset the .j5 files use: // comments and trailing commas"""
+    with open(path) as f:
+        text = f.read()
+    text = re.sub(r"^\s*//.*$", "", text, flags=re.MULTILINE)
+    text = re.sub(r",(\s*[}\]])", r"\1", text)
+    return json.loads(text)
+
+
+class SignalGroup:
+    def __init__(self, name: str, pins: Iterable[PinName]) -> None:
+        self.name = name
+        self.pins: Tuple[int, ...] = tuple(int(p) for p in pins)
+        self.width = len(self.pins)
+        self.mask = 0
+        for p in self.pins:
+            if p not in pin2Tl866_map:
+                raise Exception(f"{name}: pin {p} is not valid")
+            if self.mask & (1 << (p - 1)):
+                raise Exception(f"{name}: pin {p} listed twice")
+            self.mask |= 1 << (p - 1)
+
+        # _encode_tables[value_byte_index][byte] -> mega pin mask
+        self._encode_tables: List[List[int]] = []
+        for byte_index in range(0, self.width, 8):
+            byte_pins = self.pins[byte_index : byte_index + 8]
+            table = [0]
+            for value in range(1, 1 << len(byte_pins)):
+                low_bit = (value & -value).bit_length() - 1
+                mega_pin = byte_pins[low_bit]
+                table.append(table[value & (value - 1)] | (1 << (mega_pin - 1)))
+            self._encode_tables.append(table)
+
+        # _decode_tables: (sample_byte_index, table[byte] -> value), only for the
+        # bytes of a sample that hold pins of this group
+        self._decode_tables: List[Tuple[int, List[int]]] = []
+        for sample_byte_index in range(MEGA866_MASK_BYTES):
+            bit_for_pin = {}
+            for bit, p in enumerate(self.pins):
+                if (p - 1) // 8 == sample_byte_index:
+                    bit_for_pin[(p - 1) % 8] = bit
+            if not bit_for_pin:
+                continue
+            table = [0]
+            for value in range(1, 256):
+                low_bit = (value & -value).bit_length() - 1
+                bit = bit_for_pin.get(low_bit)
+                table.append(
+                    table[value & (value - 1)] | (0 if bit is None else 1 << bit)
+                )
+            self._decode_tables.append((sample_byte_index, table))
+
+    def __repr__(self) -> str:
+        return f"SignalGroup({self.name!r}, {list(self.pins)!r})"
+
+    def encode(self, value: int) -> int:
+        if value >> self.width:
+            raise Exception(f"{self.name}: {value:#x} is wider than {self.width} bits")
+        res = 0
+        for table in self._encode_tables:
+            res |= table[value & 0xFF]
+            value >>= 8
+        return res
+
+    def decode(self, sample: int) -> int:
+        return self.decode_bytes(sample.to_bytes(MEGA866_MASK_BYTES, "little"))
+
+    def decode_bytes(self, sample: bytes) -> int:
+        """Decodes a sample already converted with sample.to_bytes(20, "little")"""
+        res = 0
+        for sample_byte_index, table in self._decode_tables:
+            res |= table[sample[sample_byte_index]]
+        return res
+
+
+class Bus:
+    def __init__(self, groups: Dict[str, Iterable[PinName]]) -> None:
+        self.groups: Dict[str, SignalGroup] = {
+            name: SignalGroup(name, pins) for name, pins in groups.items()
+        }
+        # Groups may share pins, e.g. a multiplexed address/data bus
+        self.mask = 0
+        for group in self.groups.values():
+            self.mask |= group.mask
+
+    @classmethod
+    def load(cls, path: str) -> "Bus":
+        return cls(load_j5(path)["groups"])
+
+    def __getitem__(self, name: str) -> SignalGroup:
+        return self.groups[name]
+
+    def encode(self, **values: int) -> int:
+        res = 0
+        for name, value in values.items():
+            res |= self.groups[name].encode(value)
+        return res
+
+    def decode(self, sample: int) -> Dict[str, int]:
+        raw = sample.to_bytes(MEGA866_MASK_BYTES, "little")
+        return {name: group.decode_bytes(raw) for name, group in self.groups.items()}
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+
+"""
+Compact binary bus traces.
+
+A trace file is a fixed size header followed by fixed width records, one per
+bus cycle, and a block index written on close:
+
+    header | record 0 | record 1 | ... | index
+
+Each index entry covers index_interval records and holds the first cycle number
+and the address range of its block. That way a reader can seek to a cycle or
+skip blocks outside an address range without touching the records. Readers
+mmap the file, so multi-million cycle traces are never loaded whole. A trace
+that was not closed has no index. Its records can still be read and found by
+cycle, because cycle numbers only ever go up.
+"""
+
+import mmap
+import struct
+import time
+from bisect import bisect_right
+from typing import BinaryIO, Iterator, List, NamedTuple, Optional, Tuple
+
+from gpio_controller import MEGA866_MASK_BYTES
+
+TRACE_MAGIC = b"M866TRC\0"
+TRACE_VERSION = 1
+
+# magic, version, record size, index interval, index offset, record count
+_HEADER = struct.Struct("<8sHHIQQ")
+# cycle, timestamp (ns since the epoch), raw io_r sample, address, data, rw
+_RECORD = struct.Struct(f"<QQ{MEGA866_MASK_BYTES}sIHB5x")
+# first cycle, min address, max address
+_INDEX_ENTRY = struct.Struct("<QII")
+
+_CYCLE = struct.Struct("<Q")
+_ADDRESS = struct.Struct("<I")
+_ADDRESS_OFFSET = struct.calcsize(f"<QQ{MEGA866_MASK_BYTES}s")
+
+
+class TraceRecord(NamedTuple):
+    cycle: int
+    timestamp_ns: int
+    sample: int
+    address: int
+    data: int
+    rw: int
+
+
+class TraceWriter:
+    def __init__(
+        self, path: str, index_interval: int = 4096, buffered_records: int = 1024
+    ) -> None:
+        self.path = path
+        self.index_interval = index_interval
+        self._file: Optional[BinaryIO] = open(path, "wb")
+        self._file.write(
+            _HEADER.pack(
+                TRACE_MAGIC, TRACE_VERSION, _RECORD.size, index_interval, 0, 0
+            )
+        )
+        self._buffer = bytearray(_RECORD.size * buffered_records)
+        self._buffered = 0
+        self._count = 0
+        self._last_cycle = -1
+        self._index: List[Tuple[int, int, int]] = []
+
+    def __enter__(self) -> "TraceWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(
+        self,
+        cycle: int,
+        sample: int,
+        address: int,
+        data: int,
+        rw: int,
+        timestamp_ns: Optional[int] = None,
+    ) -> None:
+        if cycle <= self._last_cycle:
+            raise Exception(f"cycle {cycle} is not after cycle {self._last_cycle}")
+        self._last_cycle = cycle
+        if timestamp_ns is None:
+            timestamp_ns = time.time_ns()
+
+        if self._count % self.index_interval == 0:
+            self._index.append((cycle, address, address))
+        else:
+            first_cycle, min_address, max_address = self._index[-1]
+            if address < min_address or address > max_address:
+                self._index[-1] = (
+                    first_cycle,
+                    min(min_address, address),
+                    max(max_address, address),
+                )
+
+        _RECORD.pack_into(
+            self._buffer,
+            self._buffered * _RECORD.size,
+            cycle,
+            timestamp_ns,
+            sample.to_bytes(MEGA866_MASK_BYTES, "little"),
+            address,
+            data,
+            rw,
+        )
+        self._buffered += 1
+        self._count += 1
+        if self._buffered * _RECORD.size == len(self._buffer):
+            self.flush()
+
+    def flush(self) -> None:
+        if self._file is None:
+            return
+        self._file.write(self._buffer[: self._buffered * _RECORD.size])
+        self._buffered = 0
+        self._file.flush()
+
+    def close(self) -> None:
+        if self._file is None:
+            return
+        self.flush()
+        index_offset = self._file.tell()
+        for entry in self._index:
+            self._file.write(_INDEX_ENTRY.pack(*entry))
+        self._file.seek(0)
+        self._file.write(
+            _HEADER.pack(
+                TRACE_MAGIC,
+                TRACE_VERSION,
+                _RECORD.size,
+                self.index_interval,
+                index_offset,
+                self._count,
+            )
+        )
+        self._file.close()
+        self._file = None
+
+
+class TraceReader:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, index_interval, index_offset, count = (
+            _HEADER.unpack_from(self._map, 0)
+        )
+        if magic != TRACE_MAGIC:
+            raise Exception(f"{path} is not a mega866 trace")
+        if version != TRACE_VERSION or record_size != _RECORD.size:
+            raise Exception(f"{path}: unsupported trace version {version}")
+        self.index_interval = index_interval
+
+        if index_offset:
+            self._count = count
+            self._index = [
+                _INDEX_ENTRY.unpack_from(self._map, offset)
+                for offset in range(index_offset, len(self._map), _INDEX_ENTRY.size)
+            ]
+        else:
+            # Not closed cleanly, trust the file size and go without the index
+            self._count = (len(self._map) - _HEADER.size) // _RECORD.size
+            self._index = []
+        self._index_cycles = [entry[0] for entry in self._index]
+
+    def __enter__(self) -> "TraceReader":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._map.close()
+        self._file.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, i: int) -> TraceRecord:
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError(i)
+        return self._unpack(i)
+
+    def _unpack(self, i: int) -> TraceRecord:
+        cycle, timestamp_ns, sample, address, data, rw = _RECORD.unpack_from(
+            self._map, _HEADER.size + i * _RECORD.size
+        )
+        return TraceRecord(
+            cycle, timestamp_ns, int.from_bytes(sample, "little"), address, data, rw
+        )
+
+    def _cycle_at(self, i: int) -> int:
+        return _CYCLE.unpack_from(self._map, _HEADER.size + i * _RECORD.size)[0]
+
+    def _address_at(self, i: int) -> int:
+        return _ADDRESS.unpack_from(
+            self._map, _HEADER.size + i * _RECORD.size + _ADDRESS_OFFSET
+        )[0]
+
+    def find_cycle(self, cycle: int) -> int:
+        """Returns the position of the first record at or after cycle"""
+        lo, hi = 0, self._count
+        if self._index:
+            block = max(bisect_right(self._index_cycles, cycle) - 1, 0)
+            lo = block * self.index_interval
+            hi = min(lo + self.index_interval, self._count)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._cycle_at(mid) < cycle:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def records(
+        self, start: int = 0, stop: Optional[int] = None
+    ) -> Iterator[TraceRecord]:
+        stop = self._count if stop is None else min(stop, self._count)
+        for i in range(start, stop):
+            yield self._unpack(i)
+
+    def from_cycle(self, cycle: int) -> Iterator[TraceRecord]:
+        return self.records(self.find_cycle(cycle))
+
+    def filter_address(self, low: int, high: int) -> Iterator[TraceRecord]:
+        """Yields the records whose address is in [low, high]"""
+        if self._index:
+            blocks = [
+                block
+                for block, (_, min_address, max_address) in enumerate(self._index)
+                if min_address <= high and max_address >= low
+            ]
+        else:
+            n_blocks = (self._count + self.index_interval - 1) // self.index_interval
+            blocks = range(n_blocks)
+        for block in blocks:
+            start = block * self.index_interval
+            for i in range(start, min(start + self.index_interval, self._count)):
+                if low <= self._address_at(i) <= high:
+                    yield self._unpack(i)
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+
+"""
+Records the Bitbang command stream of a session and replays it without hardware.
+
+Recording wraps the GpioController backend, so every command sent to every
+TL866 goes to a compact binary log with its argument, or what io_r/io_trir
+returned, and when it was sent:
+
+    with CommandLog("session.cmd") as log:
+        controller = GpioController(earth_serial_device=..., backend=log.backend())
+        ...
+
+A ReplayBoard is a backend that answers from such a log. Each TL866 gets the
+responses recorded for it, in order, however commands to different TL866s
+interleave. The host side of a session can then be run again offline at full
+speed:
+
+    board = ReplayBoard("session.cmd")
+    controller = GpioController(earth_serial_device="earth", backend=board.open)
+
+By default every command has to be the one recorded. With strict=False only
+reads have to line up, so host code that sends fewer or different writes can
+still be replayed, and board.command_counts() compared to the recording.
+
+The log is a header followed by fixed width records:
+
+    magic | version | record size | start time (ns since the epoch)
+    instance << 6 | command, us since the previous record, argument or result
+"""
+
+import argparse
+import mmap
+import struct
+import time
+from collections import Counter
+from threading import Lock
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+)
+
+from gpio_controller import Bitbang, BitbangProxy, Tl866Instance, open_bitbang
+
+LOG_MAGIC = b"M866CMD\0"
+LOG_VERSION = 1
+
+# magic, version, record size, start time
+_HEADER = struct.Struct("<8sHHQ")
+# instance and command, us since the previous record, argument or result
+_RECORD = struct.Struct("<BIQ")
+
+COMMANDS = (
+    "init",
+    "io_tri",
+    "io_trir",
+    "io_w",
+    "io_r",
+    "vdd_en",
+    "vdd_volt",
+    "vdd_pins",
+    "vpp_en",
+    "vpp_volt",
+    "vpp_pins",
+    "gnd_pins",
+)
+_COMMAND_CODES = {name: code for code, name in enumerate(COMMANDS)}
+# Commands whose result is logged instead of an argument
+_READS = frozenset({"io_r", "io_trir"})
+# The argument logged when none is given
+_DEFAULT_ARGUMENTS = {"vdd_en": 1, "vpp_en": 1}
+
+_MAX_DELTA_US = 0xFFFFFFFF
+
+
+class CommandRecord(NamedTuple):
+    instance: Tl866Instance
+    command: str
+    timestamp_ns: int
+    # The argument, or the result for io_r and io_trir
+    value: int
+
+
+def _argument(command: str, args: Any) -> int:
+    if args:
+        return int(args[0])
+    return _DEFAULT_ARGUMENTS.get(command, 0)
+
+
+class CommandLog:
+    def __init__(self, path: str, buffered_records: int = 4096) -> None:
+        self.path = path
+        self.start_ns = time.time_ns()
+        self._file: Optional[BinaryIO] = open(path, "wb")
+        self._file.write(
+            _HEADER.pack(LOG_MAGIC, LOG_VERSION, _RECORD.size, self.start_ns)
+        )
+        self._buffer = bytearray(_RECORD.size * buffered_records)
+        self._buffered = 0
+        self._count = 0
+        self._last_us = 0
+        # Commands arrive from GpioController's worker threads when concurrent
+        self._lock = Lock()
+
+    def __enter__(self) -> "CommandLog":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def backend(
+        self, backend: Callable[[str, Tl866Instance], Bitbang] = open_bitbang
+    ) -> Callable[[str, Tl866Instance], Bitbang]:
+        """Wraps a GpioController backend so what it opens is recorded here"""
+
+        def open_recorded(device: str, instance: Tl866Instance) -> Bitbang:
+            return RecordingBitbang(backend(device, instance), instance, self)
+
+        return open_recorded
+
+    def append(
+        self, instance: Tl866Instance, command: str, value: int, timestamp_ns: int
+    ) -> None:
+        with self._lock:
+            if self._file is None:
+                raise Exception(f"{self.path} is closed")
+            now_us = (timestamp_ns - self.start_ns) // 1000
+            delta_us = min(max(now_us - self._last_us, 0), _MAX_DELTA_US)
+            self._last_us += delta_us
+            _RECORD.pack_into(
+                self._buffer,
+                self._buffered * _RECORD.size,
+                (instance.value - 1) << 6 | _COMMAND_CODES[command],
+                delta_us,
+                value,
+            )
+            self._buffered += 1
+            self._count += 1
+            if self._buffered * _RECORD.size == len(self._buffer):
+                self._flush()
+
+    def _flush(self) -> None:
+        self._file.write(self._buffer[: self._buffered * _RECORD.size])
+        self._buffered = 0
+        self._file.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is None:
+                return
+            self._flush()
+            self._file.close()
+            self._file = None
+
+
+class RecordingBitbang(BitbangProxy):
+    """Wraps a Bitbang so every command is appended to a CommandLog"""
+
+    def __init__(
+        self, bitbang: Any, instance: Tl866Instance, log: CommandLog
+    ) -> None:
+        super().__init__(bitbang)
+        self._instance = instance
+        self._log = log
+
+    def _wrap(self, name: str, method: Callable) -> Optional[Callable]:
+        if name not in _COMMAND_CODES:
+            return None
+        append = self._log.append
+        instance = self._instance
+
+        if name in _READS:
+
+            def recorded(*args: Any, **kwargs: Any) -> Any:
+                timestamp_ns = time.time_ns()
+                res = method(*args, **kwargs)
+                append(instance, name, res, timestamp_ns)
+                return res
+
+        else:
+
+            def recorded(*args: Any, **kwargs: Any) -> Any:
+                append(instance, name, _argument(name, args), time.time_ns())
+                return method(*args, **kwargs)
+
+        return recorded
+
+
+class CommandLogReader:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, record_size, self.start_ns = _HEADER.unpack_from(self._map, 0)
+        if magic != LOG_MAGIC:
+            raise Exception(f"{path} is not a mega866 command log")
+        if version != LOG_VERSION or record_size != _RECORD.size:
+            raise Exception(f"{path}: unsupported command log version {version}")
+        self._count = (len(self._map) - _HEADER.size) // _RECORD.size
+
+    def __enter__(self) -> "CommandLogReader":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._map.close()
+        self._file.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def records(self) -> Iterator[CommandRecord]:
+        instances = list(Tl866Instance)
+        timestamp_us = 0
+        for offset in range(
+            _HEADER.size, _HEADER.size + self._count * _RECORD.size, _RECORD.size
+        ):
+            code, delta_us, value = _RECORD.unpack_from(self._map, offset)
+            timestamp_us += delta_us
+            yield CommandRecord(
+                instances[code >> 6],
+                COMMANDS[code & 0x3F],
+                self.start_ns + timestamp_us * 1000,
+                value,
+            )
+
+    def command_counts(self) -> Counter:
+        return Counter(record.command for record in self.records())
+
+
+class ReplayTl866:
+    def __init__(
+        self,
+        board: "ReplayBoard",
+        instance: Tl866Instance,
+        records: List[CommandRecord],
+    ) -> None:
+        self.board = board
+        self.instance = instance
+        self.device: Optional[str] = None
+        self._records = records
+        self._next = 0
+        self.commands: Counter = Counter()
+
+    def _replay(self, command: str, value: Optional[int] = None) -> int:
+        self.commands[command] += 1
+        records = self._records
+        i = self._next
+        if not self.board.strict and command not in _READS:
+            # Writes are not checked, but the recorded ones are skipped so the
+            # next read lines up
+            while i < len(records) and records[i].command not in _READS:
+                i += 1
+            self._next = i
+            return 0
+        if not self.board.strict:
+            while i < len(records) and records[i].command != command:
+                i += 1
+        if i >= len(records):
+            raise Exception(
+                f"{self.instance.name}: {command} after the end of the recording"
+            )
+        record = records[i]
+        if record.command != command or (
+            value is not None and record.value != value
+        ):
+            got = command if value is None else f"{command}({value:#x})"
+            raise Exception(
+                f"{self.instance.name} command {i} diverged from the recording: "
+                f"expected {record.command}({record.value:#x}), got {got}"
+            )
+        self._next = i + 1
+        return record.value
+
+    def init(self) -> None:
+        self._replay("init", 0)
+
+    def io_tri(self, val: int) -> None:
+        self._replay("io_tri", val)
+
+    def io_trir(self) -> int:
+        return self._replay("io_trir")
+
+    def io_w(self, val: int) -> None:
+        self._replay("io_w", val)
+
+    def io_r(self) -> int:
+        return self._replay("io_r")
+
+    def vdd_en(self, enable: bool = True) -> None:
+        self._replay("vdd_en", int(enable))
+
+    def vdd_volt(self, val: int) -> None:
+        self._replay("vdd_volt", val)
+
+    def vdd_pins(self, val: int) -> None:
+        self._replay("vdd_pins", val)
+
+    def vpp_en(self, enable: bool = True) -> None:
+        self._replay("vpp_en", int(enable))
+
+    def vpp_volt(self, val: int) -> None:
+        self._replay("vpp_volt", val)
+
+    def vpp_pins(self, val: int) -> None:
+        self._replay("vpp_pins", val)
+
+    def gnd_pins(self, val: int) -> None:
+        self._replay("gnd_pins", val)
+
+    @property
+    def remaining(self) -> int:
+        """Recorded commands not replayed yet"""
+        return len(self._records) - self._next
+
+
+class ReplayBoard:
+    def __init__(self, path: str, strict: bool = True) -> None:
+        self.strict = strict
+        per_instance: Dict[Tl866Instance, List[CommandRecord]] = {
+            instance: [] for instance in Tl866Instance
+        }
+        with CommandLogReader(path) as reader:
+            for record in reader.records():
+                per_instance[record.instance].append(record)
+        self.tl866s = {
+            instance: ReplayTl866(self, instance, records)
+            for instance, records in per_instance.items()
+        }
+
+    def open(self, device: str, instance: Tl866Instance) -> ReplayTl866:
+        """GpioController backend, returns the replayed TL866 for instance"""
+        tl866 = self.tl866s[instance]
+        tl866.device = device
+        return tl866
+
+    def command_counts(self) -> Counter:
+        counts: Counter = Counter()
+        for tl866 in self.tl866s.values():
+            counts.update(tl866.commands)
+        return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Summarise a command log")
+    parser.add_argument("log", help="command log to read")
+    parser.add_argument(
+        "--dump",
+        type=int,
+        metavar="N",
+        default=0,
+        help="also print the first N commands",
+    )
+    args = parser.parse_args()
+
+    with CommandLogReader(args.log) as reader:
+        counts: Counter = Counter()
+        last_ns = reader.start_ns
+        for i, record in enumerate(reader.records()):
+            counts[(record.instance.name, record.command)] += 1
+            last_ns = record.timestamp_ns
+            if i < args.dump:
+                print(
+                    f"{(record.timestamp_ns - reader.start_ns) / 1e6:12.3f} ms "
+                    f"{record.instance.name:<6} {record.command:<9} {record.value:#x}"
+                )
+        elapsed_s = (last_ns - reader.start_ns) / 1e9
+        print(f"{len(reader)} commands over {elapsed_s:.3f} s")
+        for (instance, command), count in sorted(counts.items()):
+            print(f"  {instance:<6} {command:<9} {count:>10}")
+
+
+if __name__ == "__main__":
+    main()
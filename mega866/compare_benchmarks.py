@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+"""
+Compares two benchmark.py result files and flags regressions.
+
+A timing regresses when it is more than --threshold slower. Command counts are
+exact, so any increase is a regression. Exits with 1 if anything regressed.
+"""
+
+import argparse
+import json
+import sys
+from typing import Any, Dict, List
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any], threshold: float) -> List[str]:
+    """Prints the comparison and returns the regressions"""
+    regressions = []
+    print(f"{old.get('revision')} -> {new.get('revision')}")
+    for name, new_ns in new["ns_per_call"].items():
+        old_ns = old["ns_per_call"].get(name)
+        if old_ns is None:
+            print(f"  {name:<55} {new_ns:>12.1f} ns (new)")
+            continue
+        ratio = new_ns / old_ns
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = " SLOWER"
+            regressions.append(f"{name}: {old_ns:.1f} -> {new_ns:.1f} ns")
+        elif ratio < 1 - threshold:
+            flag = " faster"
+        print(f"  {name:<55} {old_ns:>12.1f} -> {new_ns:>12.1f} ns {ratio:6.2f}x{flag}")
+    for name, new_counts in new["commands_per_cycle"].items():
+        old_counts = old["commands_per_cycle"].get(name)
+        if old_counts is None:
+            print(f"  {name:<55} {new_counts['total']:>12.2f} commands/cycle (new)")
+            continue
+        flag = ""
+        if new_counts["total"] > old_counts["total"] + 1e-9:
+            flag = " MORE"
+            regressions.append(
+                f"{name}: {old_counts['total']:.2f} -> "
+                f"{new_counts['total']:.2f} commands/cycle"
+            )
+        elif new_counts["total"] < old_counts["total"] - 1e-9:
+            flag = " fewer"
+        print(
+            f"  {name:<55} {old_counts['total']:>12.2f} -> "
+            f"{new_counts['total']:>12.2f} commands/cycle{flag}"
+        )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare two benchmark.py results")
+    parser.add_argument("old", help="baseline results JSON")
+    parser.add_argument("new", help="results JSON to check")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="fraction a timing may get slower before it counts, default 0.1",
+    )
+    args = parser.parse_args()
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    regressions = compare(old, new, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} regression(s):")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
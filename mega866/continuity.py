@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+
+"""
+Bit-parallel short/open sweep of the Mega866 pins, optionally through an adapter.
+
+Every pin under test gets its index as a binary code. For each code bit k the
+pins with that bit set are driven high, then low, with every other pin
+tri-stated, and the same again for the pins with bit k clear. All four TL866s
+are driven and read at once, so N pins take 4 * ceil(log2 N) write/read
+passes per repeat, 32 for all 160 pins.
+
+A tri-stated pin that reads high while a group is driven high and low while
+it is driven low is connected to a pin of that group. Since codes are unique,
+every connected pair differs in some bit and is seen. The bits a pin follows
+spell out its partner's code, which names the partner when a pin has a single
+unexpected connection. A driven pin that reads back the wrong level is stuck.
+
+Connections that are supposed to be there, e.g. through a shorting plug in the
+adapter socket, are given as nets. A missing one is reported as an open:
+
+    report = sweep(controller, load_adapter("zsm-ic-pga68_r1"), nets=[["01", "02"]])
+    print(json.dumps(report, indent=1))
+"""
+
+import argparse
+import json
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from adapter import Adapter, load_adapter
+from gpio_controller import (
+    MEGA866_HIGHEST_PIN_NUMBER,
+    MEGA866_LOWEST_PIN_NUMBER,
+    GpioController,
+    Tl866Instance,
+)
+
+
+def _mask(mega_pin: int) -> int:
+    return 1 << (mega_pin - 1)
+
+
+class _Sweep:
+    def __init__(
+        self,
+        controller: GpioController,
+        mega_pins: Sequence[int],
+        settle: float,
+        repeats: int,
+    ) -> None:
+        self.controller = controller
+        self.mega_pins = list(mega_pins)
+        self.nbits = max(1, (len(self.mega_pins) - 1).bit_length())
+        self.groups: List[Tuple[int, int]] = []
+        for k in range(self.nbits):
+            with_bit = 0
+            for code, mega_pin in enumerate(self.mega_pins):
+                if code >> k & 1:
+                    with_bit |= _mask(mega_pin)
+            without_bit = 0
+            for mega_pin in self.mega_pins:
+                if not with_bit & _mask(mega_pin):
+                    without_bit |= _mask(mega_pin)
+            self.groups.append((with_bit, without_bit))
+        self.settle = settle
+        self.repeats = repeats
+
+    def run(self) -> List[int]:
+        """
+        Returns the samples, for each bit, group and repeat one high and one
+        low
+        """
+        controller = self.controller
+        device_pins = controller.device_pins()
+        test_mask = 0
+        for mega_pin in self.mega_pins:
+            test_mask |= _mask(mega_pin)
+        if test_mask & ~device_pins:
+            raise Exception("some pins under test have no device")
+
+        steps: List[Tuple[int, Optional[int], bool]] = []
+        for groups in self.groups:
+            for group in groups:
+                for _ in range(self.repeats):
+                    for level in (group, 0):
+                        steps.append((level, device_pins & ~group, True))
+        steps.append((0, device_pins, False))
+        if not self.settle:
+            waveform = controller.compile_waveform(steps, sample_mask=test_mask)
+            return waveform.unpack(controller.play(waveform))
+
+        samples = []
+        for drive, tri, sample in steps:
+            with controller.transaction() as t:
+                t.io_w(drive)
+                t.io_tri(tri)
+                t.delay(self.settle)
+                if sample:
+                    t.io_r(test_mask)
+            samples.extend(t.results)
+        return samples
+
+    def analyse(
+        self, samples: List[int]
+    ) -> Tuple[Dict[int, List[int]], Dict[int, Tuple[int, int]]]:
+        """
+        Returns the stuck pins, index -> [levels read wrong], and for every pin
+        the bits it followed the with_bit and without_bit groups in.
+        """
+        stuck: Dict[int, List[int]] = {}
+        follows: Dict[int, Tuple[int, int]] = {}
+        pairs = [
+            (samples[i], samples[i + 1]) for i in range(0, len(samples), 2)
+        ]
+        for index, mega_pin in enumerate(self.mega_pins):
+            bit = _mask(mega_pin)
+            followed = [0, 0]
+            for k, groups in enumerate(self.groups):
+                for g, group in enumerate(groups):
+                    first = (2 * k + g) * self.repeats
+                    group_pairs = pairs[first : first + self.repeats]
+                    if group & bit:
+                        if not all(high & bit for high, _ in group_pairs):
+                            stuck.setdefault(index, []).append(0)
+                        if any(low & bit for _, low in group_pairs):
+                            stuck.setdefault(index, []).append(1)
+                    elif all(
+                        high & bit and not low & bit for high, low in group_pairs
+                    ):
+                        followed[g] |= 1 << k
+            follows[index] = (followed[0], followed[1])
+        return stuck, follows
+
+    def expected_follows(self, index: int, partners: Iterable[int]) -> Tuple[int, int]:
+        """The bits a pin connected to partners is seen following"""
+        with_bit = without_bit = 0
+        for partner in partners:
+            differ = index ^ partner
+            with_bit |= differ & partner
+            without_bit |= differ & index
+        return with_bit, without_bit
+
+
+def sweep(
+    controller: GpioController,
+    adapter: Optional[Adapter] = None,
+    nets: Iterable[Iterable[Any]] = (),
+    mega_pins: Optional[Sequence[int]] = None,
+    settle: float = 0.0,
+    repeats: int = 2,
+) -> Dict[str, Any]:
+    """
+    Sweeps the adapter's pins, or mega_pins, or else every pin with a device,
+    and returns the fault report as a JSON serialisable dict. nets are groups
+    of pins that should be connected, package pins with an adapter and mega
+    pins otherwise. settle, if given, is a delay before every read, at the
+    cost of playing the passes one by one. A pin only counts as following a
+    group if it does so in all repeats, which keeps floating pins that happen
+    to toggle from looking shorted.
+    """
+    if mega_pins is None:
+        if adapter is not None:
+            mega_pins = adapter.mega_pins
+        else:
+            device_pins = controller.device_pins()
+            mega_pins = [
+                p
+                for p in range(MEGA866_LOWEST_PIN_NUMBER, MEGA866_HIGHEST_PIN_NUMBER + 1)
+                if device_pins & _mask(p)
+            ]
+
+    def mega_pin_for(name: Any) -> int:
+        if adapter is None:
+            return int(name)
+        return adapter[int(name) if str(name).isdigit() else name]
+
+    def describe(index: int) -> Dict[str, Any]:
+        mega_pin = mega_pins[index]
+        res: Dict[str, Any] = {"mega_pin": mega_pin}
+        if adapter is not None:
+            res["package_pin"] = adapter.package_pin_for(mega_pin)
+        return res
+
+    index_of = {mega_pin: i for i, mega_pin in enumerate(mega_pins)}
+    partners: Dict[int, Set[int]] = {i: set() for i in range(len(mega_pins))}
+    for net in nets:
+        indices = [index_of[mega_pin_for(name)] for name in net]
+        for i in indices:
+            partners[i].update(j for j in indices if j != i)
+
+    start = time.monotonic()
+    runner = _Sweep(controller, mega_pins, settle, repeats)
+    samples = runner.run()
+    stuck, follows = runner.analyse(samples)
+
+    faults: List[Dict[str, Any]] = []
+    for index, levels in sorted(stuck.items()):
+        faults.append(
+            {
+                "type": "stuck",
+                "pin": describe(index),
+                "levels_read": sorted(set(levels)),
+            }
+        )
+
+    reported: Set[Tuple[int, ...]] = set()
+    for index in range(len(mega_pins)):
+        if index in stuck:
+            continue
+        with_bit, without_bit = follows[index]
+        for partner in sorted(partners[index]):
+            want = runner.expected_follows(index, [partner])
+            if want[0] & ~with_bit or want[1] & ~without_bit:
+                pair = tuple(sorted((index, partner)))
+                if pair not in reported:
+                    reported.add(pair)
+                    faults.append(
+                        {"type": "open", "pins": [describe(i) for i in pair]}
+                    )
+
+        expected = runner.expected_follows(index, partners[index])
+        extra = (with_bit & ~expected[0], without_bit & ~expected[1])
+        if not extra[0] and not extra[1]:
+            continue
+        partner = None
+        if not partners[index]:
+            # A single short: the followed bits are where the partner's code
+            # differs from ours. With more pins on the net the codes merge,
+            # which shows up as the decoded partner not following us back.
+            code = (index | with_bit) & ~without_bit
+            if code < len(mega_pins) and code != index and code not in stuck:
+                back = runner.expected_follows(code, [index])
+                if back[0] & ~follows[code][0] or back[1] & ~follows[code][1]:
+                    code = None
+                partner = code
+        if partner is not None:
+            pair = tuple(sorted((index, partner)))
+            if pair not in reported:
+                reported.add(pair)
+                faults.append({"type": "short", "pins": [describe(i) for i in pair]})
+        elif (index,) not in reported:
+            reported.add((index,))
+            faults.append(
+                {
+                    "type": "short",
+                    "pins": [describe(index)],
+                    "syndrome": {"with_bit": extra[0], "without_bit": extra[1]},
+                }
+            )
+
+    return {
+        "adapter": adapter.name if adapter is not None else None,
+        "pins_tested": len(mega_pins),
+        "passes": len(samples),
+        "elapsed_s": time.monotonic() - start,
+        "ok": not faults,
+        "faults": faults,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Check pins for shorts and opens")
+    for instance in Tl866Instance:
+        parser.add_argument(
+            f"--{instance.name.lower()}",
+            metavar="DEVICE",
+            help=f"serial device of the {instance.name} TL866",
+        )
+    parser.add_argument("--adapter", help="sweep this adapter's pins")
+    parser.add_argument(
+        "--nets",
+        help="JSON file with a list of pin lists that should be connected",
+    )
+    parser.add_argument(
+        "--settle", type=float, default=0.0, help="seconds to wait before each read"
+    )
+    args = parser.parse_args()
+
+    adapter = load_adapter(args.adapter) if args.adapter is not None else None
+    nets = []
+    if args.nets is not None:
+        with open(args.nets) as f:
+            nets = json.load(f)
+    with GpioController(
+        water_serial_device=args.water,
+        earth_serial_device=args.earth,
+        fire_serial_device=args.fire,
+        wind_serial_device=args.wind,
+        concurrent=True,
+    ) as controller:
+        controller.init()
+        report = sweep(controller, adapter, nets, settle=args.settle)
+        controller.io_tri(controller.device_pins())
+    print(json.dumps(report, indent=1))
+
+
+if __name__ == "__main__":
+    main()
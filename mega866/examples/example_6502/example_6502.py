@@ -1,9 +1,16 @@
-from gpio_controller import GpioController, all_earth_pins
-from time import sleep
-from intelhex import IntelHex
-import sys
+from .harness_6502 import EARTH_SERIAL_DEVICE, CLOCK_PIN, RESET_PIN, READ, Harness6502, cpu_bus
+from gpio_controller import open_bitbang
+from bus_trace import TraceWriter
+from command_log import CommandLog, ReplayBoard
+from virtual_tl866 import VirtualBoard
+from virtual_6502 import Virtual6502
+from metrics import Metrics
+from memory import Memory
+from time import monotonic
+import atexit
 import os
-from threading import Thread, Event
+import json
+from collections import deque
 from prompt_toolkit.application import Application
 from prompt_toolkit.buffer import Buffer
 from prompt_toolkit.key_binding import KeyBindings
@@ -12,321 +19,300 @@ from prompt_toolkit.layout.controls import BufferControl, FormattedTextControl
 from prompt_toolkit.layout.layout import Layout
 from prompt_toolkit.document import Document
 
-bus_activity_buffer = Buffer(read_only=True)
-io_output_buffer = Buffer(read_only=True)
-
-
-def get_left_window_title_text():
-    return [
-        ("class:title", "Address - Data - r/w"),
-    ]
-
-left_window = HSplit(
-    [
-        # The titlebar.
-        Window(
-            height=len(get_left_window_title_text()),
-            content=FormattedTextControl(get_left_window_title_text),
-            align=WindowAlign.CENTER,
-        ),
-        # Horizontal separator.
-        Window(height=1, char="-", style="class:line"),
-        # The 'body', like defined above.
-        Window(BufferControl(buffer=bus_activity_buffer), wrap_lines=True)
-    ]
-)
-
-def get_right_window_title_text():
-    return [
-        ("class:title", "Console Output"),
-    ]
-
-right_window = HSplit(
-    [
-        # The titlebar.
-        Window(
-            height=len(get_right_window_title_text()),
-            content=FormattedTextControl(get_right_window_title_text),
-            align=WindowAlign.CENTER,
-        ),
-        # Horizontal separator.
-        Window(height=1, char="-", style="class:line"),
-        # The 'body', like defined above.
-        Window(BufferControl(buffer=io_output_buffer), wrap_lines=True)
-    ]
-)
-
-
-body = VSplit(
-    [
-        left_window,
-        # A vertical line in the middle. We explicitly specify the width, to make
-        # sure that the layout engine will not try to divide the whole width by
-        # three for all these windows.
-        Window(width=1, char="|", style="class:line"),
-        # Display the Result buffer on the right.
-        right_window,
-    ]
-)
-
-def get_titlebar_text():
-    return [
-        ("class:title", " 6502 Thingy\n"),
-        ("class:title", " Press [Ctrl-C] to quit\n"),
-        ("class:title", " Press [Enter] for one clock cycle\n"),
-        ("class:title", " Press CTRL-R to run the clock freely (Press [Enter] to re-enter single-step mode)\n"),
-    ]
-
-
-root_container = HSplit(
-    [
-        # The titlebar.
-        Window(
-            height=len(get_titlebar_text()),
-            content=FormattedTextControl(get_titlebar_text),
-            align=WindowAlign.CENTER,
-        ),
-        # Horizontal separator.
-        Window(height=1, char="-", style="class:line"),
-        # The 'body', like defined above.
-        body,
-    ]
-)
-
-kb = KeyBindings()
-
-@kb.add("c-c", eager=True)
-def _(event):
-    stop_event.set()
-    try:
-        free_run_thread.join()
-    except:
-        pass
-    event.app.exit()
-
-def clock_loop():
-    while stop_event.is_set() is False:
-            clock_cycle_and_display()
-
-free_run_thread = Thread(target=clock_loop)
-stop_event = Event()
-
-@kb.add("c-r", eager=True)
-def _(event):
-    global free_run_thread
-    stop_event.clear()
-    if free_run_thread.is_alive() is False:
-        free_run_thread = Thread(target=clock_loop)
-        free_run_thread.start()
-
-@kb.add("enter", eager=True)
-def _(event):
-    if free_run_thread.is_alive():
-        stop_event.set()
-    else:
-        clock_cycle_and_display()
-
-# 3. Creating an `Application` instance
-#    ----------------------------------
-
-# This glues everything together.
-
-application = Application(
-    layout=Layout(root_container, focused_element=left_window),
-    key_bindings=kb,
-    full_screen=True,
-)
-
+# The clock loop only appends to these bounded ring buffers. The UI copies them
+# into its buffers at most FRAME_RATE times a second, so free-running keeps a
+# constant speed and memory footprint however long it runs. Both run on the
+# same asyncio loop, so no locking is needed.
+FRAME_RATE = 10
+BUS_ACTIVITY_LINES = 1000
+IO_OUTPUT_CHARS = 4096
 
-def run():
-    # Run the interface. (This runs the event loop until Ctrl-Q is pressed.)
-    application.run()
+bus_activity_ring = deque(maxlen=BUS_ACTIVITY_LINES)
+io_output_ring = deque(maxlen=IO_OUTPUT_CHARS)
+cycles_per_second = 0.0
+_last_rate_sample = (monotonic(), 0)
+_last_drawn_cycle = -1
 
+OUT_PORT = 0x6000
 
+# Created by setup(), so importing this module opens nothing
+memory = None
+harness = None
 
-def pin(x):
-    return 1 << (x - 1)
 
+def out_port_write(address, data):
+    if address == OUT_PORT:
+        io_output_ring.append(chr(data))
+    else:
+        memory.data[address] = data
 
-def pins(*pin_list):
-    res = 0
-    for p in pin_list:
-        res |= pin(p)
-    return res
 
+def handle_write(address, data):
+    memory.write(address, data)
 
-def get_address_pins(input_pins):
-    addr = 0
-    for k, v in address_pins.items():
-        if input_pins & (1 << (k - 1)):
-            addr |= 1 << v
-    return addr
 
+def handle_read(address):
+    return memory.read(address)
 
-def get_data_pins(input_pins):
-    addr = 0
-    for k, v in data_pins.items():
-        if input_pins & (1 << (k - 1)):
-            addr |= 1 << v
-    return addr
 
+def setup():
+    global memory, harness
+    # Set MEGA866_RAM_IMAGE to a file name to keep the 64 KiB in a memory mapped
+    # file, so RAM contents survive between runs
+    memory = Memory(image_path=os.environ.get("MEGA866_RAM_IMAGE"))
+    memory.load_hex(os.path.join(os.path.realpath(os.path.dirname(__file__)), 'prog_6502.hex'))
+    memory.map_io(OUT_PORT, OUT_PORT, write=out_port_write)
 
-def get_rw_pin(input_pins):
-    if (input_pins & pin(RW_PIN)) > 0:
-        return 1
+    # Set MEGA866_SIMULATE=1 to run against a virtual TL866 with a modelled 6502
+    # instead of real hardware
+    if os.environ.get("MEGA866_SIMULATE") == "1":
+        backend = VirtualBoard(dut=Virtual6502(cpu_bus, CLOCK_PIN, RESET_PIN)).open
     else:
-        return 0
-
-# NOTE: pin 45 needs to be conencted to ground manually using a jumper wire or the like.
-
-# We assume one attached tl866 and we call it the "earth" controller
-c = GpioController(
-    earth_serial_device="/dev/serial/by-id/usb-ProgHQ_Open-TL866_Programmer_33144A91666856D18E6084EC-if00"
-)
-
-tristate_pins = set(all_earth_pins)
-
-# The letter 'B' at the end of a pin name means "bar", i.e., negated, active low
-
-CLOCK_PIN = 59
-RW_PIN = 65
-RESET_PIN = 49
-
-# Control pins
-tristate_pins.remove(
-    3
-)  # IRQB: Interrupt request bar. Keep high to not trigger an interrupt.
-tristate_pins.remove(
-    7
-)  # NMIB: Non-maskable interrupt bar. Keep high to not trigger an interrupt.
-tristate_pins.remove(49)  # RESB: Reset bar. Keep high to not reset the CPU.
-tristate_pins.remove(
-    55
-)  # RDY:  Ready. Keep to high to allow to CPU to operate normally.
-tristate_pins.remove(
-    57
-)  # SOB:  Set overflow bar. Datasheet says it's not recommended to do anything with this pin other than tie it high.
-tristate_pins.remove(
-    59
-)  # PHI2: Clock Input. The WDC W65C02S is a fully static design, so we can pulse the clock as slowly as we wish. May go up to 17MHz.
-tristate_pins.remove(
-    61
-)  # BE:   Bus enable. Keep high to allow the CPU to put anything on the data and address bus.
-
-# Data pins
-data_pins = {11: 0, 13: 1, 15: 2, 17: 3, 19: 4, 21: 5, 77: 6, 79: 7}
-data_pins_rev = {}
-for k, v in data_pins.items():
-    data_pins_rev[v] = k
-
-def set_data_pins_high_z():
-    global tristate_pins
-    tristate_pins |= set(data_pins.keys())
-    c.io_tri(pins(*tristate_pins))
-
-def set_data_pins_rw():
-    global tristate_pins
-    tristate_pins -= set(data_pins.keys())
-    c.io_tri(pins(*tristate_pins))
-
-def get_data_pins_from_byte(b):
-    pins = []
-    for i in range(0, 8):
-        if (1 << i) & b:
-            pins.append(data_pins_rev[i])
-    return pins
-
-set_data_pins_high_z()
-
-# Address pins
-address_pins = {
-    69: 0,
-    71: 1,
-    73: 2,
-    75: 3,
-    23: 4,
-    25: 5,
-    27: 6,
-    31: 7,
-    35: 8,
-    39: 9,
-    43: 10,
-    47: 11,
-    41: 12,
-    37: 13,
-    33: 14,
-    29: 15,
-}
-
-memory = {}
-
-ih = IntelHex(os.path.join(os.path.realpath(os.path.dirname(__file__)), 'prog_6502.hex'))
-
-for addr in ih.addresses():
-    memory[addr] = ih[addr]
-
-OUT_PORT = 0x6000
-WRITE = 0
-READ = 1
-
-def handle_write(address, data):
-    if address == OUT_PORT:
+        backend = open_bitbang
+
+    # Set MEGA866_RECORD to a file name to log every TL866 command of the run,
+    # and MEGA866_REPLAY to such a file to run against the log instead of
+    # hardware, see command_log.py
+    replay_file = os.environ.get("MEGA866_REPLAY")
+    if replay_file is not None:
+        backend = ReplayBoard(replay_file).open
+    record_file = os.environ.get("MEGA866_RECORD")
+    if record_file is not None:
+        command_log = CommandLog(record_file)
+        atexit.register(command_log.close)
+        backend = command_log.backend(backend)
+
+    # Set MEGA866_METRICS to a file name to have per command latency histograms
+    # and cycles/s written there as JSON every 10 seconds
+    metrics_file = os.environ.get("MEGA866_METRICS")
+
+    def write_metrics(snapshot):
+        with open(metrics_file, "w") as f:
+            json.dump(snapshot, f, indent=1)
+
+    metrics = (
+        Metrics(summary_interval=10, on_summary=write_metrics)
+        if metrics_file is not None
+        else None
+    )
+
+    # Set MEGA866_TRACE to a file name to record every bus cycle, see
+    # bus_trace.TraceReader
+    trace_file = os.environ.get("MEGA866_TRACE")
+
+    # Set MEGA866_PREDICT=1 to stage the next read's byte with the rising clock
+    # edge where the bus trace makes the address predictable
+    predict = os.environ.get("MEGA866_PREDICT") == "1"
+
+    # The TL866 is opened and the 6502 powered up on the first clock cycle
+    harness = Harness6502(
+        handle_read,
+        handle_write,
+        earth_serial_device=EARTH_SERIAL_DEVICE,
+        backend=backend,
+        metrics=metrics,
+        trace_writer=TraceWriter(trace_file) if trace_file is not None else None,
+        predict=predict,
+        peek=lambda address: memory.data[address],
+    )
+    return harness
+
+
+def format_cycle(address, data, rw):
+    return f"{address:#06x} {data:#04x} {'r' if rw == READ else 'w'}\n"
+
+
+async def clock_cycle_and_display_async():
+    bus_activity_ring.append(format_cycle(*await harness.clock_cycle_async()))
+
+
+def cycle_count():
+    return harness.cycle_count if harness is not None else 0
+
+
+def prediction_text():
+    if harness is None or harness.predictor is None:
+        return ""
+    return f", {harness.prediction_hit_rate:.0%} of {harness.predicted_reads} predicted reads hit"
+
+
+def build_application():
+    bus_activity_buffer = Buffer(read_only=True)
+    io_output_buffer = Buffer(read_only=True)
+
+    def get_left_window_title_text():
+        return [
+            ("class:title", "Address - Data - r/w"),
+        ]
+
+    left_window = HSplit(
+        [
+            # The titlebar.
+            Window(
+                height=len(get_left_window_title_text()),
+                content=FormattedTextControl(get_left_window_title_text),
+                align=WindowAlign.CENTER,
+            ),
+            # Horizontal separator.
+            Window(height=1, char="-", style="class:line"),
+            # The 'body', like defined above.
+            Window(BufferControl(buffer=bus_activity_buffer), wrap_lines=True)
+        ]
+    )
+
+    def get_right_window_title_text():
+        return [
+            ("class:title", "Console Output"),
+        ]
+
+    right_window = HSplit(
+        [
+            # The titlebar.
+            Window(
+                height=len(get_right_window_title_text()),
+                content=FormattedTextControl(get_right_window_title_text),
+                align=WindowAlign.CENTER,
+            ),
+            # Horizontal separator.
+            Window(height=1, char="-", style="class:line"),
+            # The 'body', like defined above.
+            Window(BufferControl(buffer=io_output_buffer), wrap_lines=True)
+        ]
+    )
+
+    body = VSplit(
+        [
+            left_window,
+            # A vertical line in the middle. We explicitly specify the width, to make
+            # sure that the layout engine will not try to divide the whole width by
+            # three for all these windows.
+            Window(width=1, char="|", style="class:line"),
+            # Display the Result buffer on the right.
+            right_window,
+        ]
+    )
+
+    def get_titlebar_text():
+        return [
+            ("class:title", " 6502 Thingy\n"),
+            ("class:title", " Press [Ctrl-C] to quit\n"),
+            ("class:title", " Press [Enter] for one clock cycle\n"),
+            ("class:title", " Press CTRL-R to run the clock freely (Press [Enter] to re-enter single-step mode)\n"),
+            ("class:title", f" Cycle {cycle_count()}, {cycles_per_second:.1f} cycles/s{prediction_text()}\n"),
+        ]
+
+    root_container = HSplit(
+        [
+            # The titlebar.
+            Window(
+                height=len(get_titlebar_text()),
+                content=FormattedTextControl(get_titlebar_text),
+                align=WindowAlign.CENTER,
+            ),
+            # Horizontal separator.
+            Window(height=1, char="-", style="class:line"),
+            # The 'body', like defined above.
+            body,
+        ]
+    )
+
+    kb = KeyBindings()
+    # Clocking runs as tasks on the application's event loop, one cycle at a
+    # time, so the UI stays responsive without a separate thread
+    clocking = False
+    free_running = False
+    clock_task = None
+    quitting = False
+
+    async def free_run():
+        nonlocal clocking
+        clocking = True
+        try:
+            while free_running:
+                await clock_cycle_and_display_async()
+        finally:
+            clocking = False
+
+    async def single_step(app):
+        nonlocal clocking
+        clocking = True
+        try:
+            await clock_cycle_and_display_async()
+        finally:
+            clocking = False
+        app.invalidate()
+
+    async def quit(app):
+        # exit() cancels the background tasks, so let the cycle in flight
+        # finish first instead of abandoning it half way
+        try:
+            if clock_task is not None:
+                await clock_task
+        finally:
+            app.exit()
+
+    @kb.add("c-c", eager=True)
+    def _(event):
+        nonlocal free_running, quitting
+        free_running = False
+        if not quitting:
+            quitting = True
+            event.app.create_background_task(quit(event.app))
+
+    @kb.add("c-r", eager=True)
+    def _(event):
+        nonlocal free_running, clock_task
+        if not clocking and not quitting:
+            free_running = True
+            clock_task = event.app.create_background_task(free_run())
+
+    @kb.add("enter", eager=True)
+    def _(event):
+        nonlocal free_running, clock_task
+        if free_running:
+            free_running = False
+        elif not clocking and not quitting:
+            clock_task = event.app.create_background_task(single_step(event.app))
+
+    def redraw_from_ring_buffers(app):
+        global cycles_per_second, _last_rate_sample, _last_drawn_cycle
+        now = monotonic()
+        count = cycle_count()
+        last_time, last_count = _last_rate_sample
+        if now - last_time >= 0.5:
+            cycles_per_second = (count - last_count) / (now - last_time)
+            _last_rate_sample = (now, count)
+
+        if count == _last_drawn_cycle:
+            return
+        _last_drawn_cycle = count
+        bus_text = "".join(bus_activity_ring)
+        io_text = "".join(io_output_ring)
+        bus_activity_buffer.set_document(
+            Document(bus_text, cursor_position=len(bus_text)), bypass_readonly=True
+        )
         io_output_buffer.set_document(
-        io_output_buffer.document.insert_after(chr(data)), bypass_readonly=True)
-        io_output_buffer.auto_down()
-    else:
-        memory[address] = data
+            Document(io_text, cursor_position=len(io_text)), bypass_readonly=True
+        )
 
-def handle_read(address):
-    return memory.get(address, 0)
-
-c.init()
-c.io_tri(pins(*tristate_pins))
-
-always_high_pins = pins(3, 7, 49, 55, 57, 61)
-
-c.vdd_volt(1)  # 3.5V
-c.vdd_pins(pins(67))  # VDD
-c.vdd_en()
-
-c.io_w(0)  # This should reset the 6502
-sleep(0.001)
-# First rising edge starts reset sequence
-c.io_w(always_high_pins | pin(CLOCK_PIN))
-sleep(0.001)
-c.io_w(always_high_pins)
-
-def clock_cycle():
-    set_data_pins_high_z()
-    sleep(0.0000003)
-    input_pins = c.io_r()
-    address = get_address_pins(input_pins)
-    rw = get_rw_pin(input_pins)
-    data = 0
-    if rw == READ:
-        set_data_pins_rw()
-        data = handle_read(address)
-        c.io_w(always_high_pins | pins(*get_data_pins_from_byte(data)) | pin(CLOCK_PIN))
-        sleep(0.0000003)
-        c.io_w(always_high_pins | pins(*get_data_pins_from_byte(data)))
-    else:
-        c.io_w(always_high_pins | pin(CLOCK_PIN))
-        sleep(0.0000003)
-        input_pins = c.io_r()
-        data = get_data_pins(input_pins)
-        handle_write(address, data)
-        c.io_w(always_high_pins)
-        sleep(0.0000003)
+    # This glues everything together.
+    return Application(
+        layout=Layout(root_container, focused_element=left_window),
+        key_bindings=kb,
+        full_screen=True,
+        refresh_interval=1 / FRAME_RATE,
+        before_render=redraw_from_ring_buffers,
+    )
 
-    return f"{address:#06x} {data:#04x} {'r' if rw == 1 else 'w'}\n"
 
-def clock_cycle_and_display():
-    bus_str = clock_cycle()
-    bus_activity_buffer.set_document(
-    bus_activity_buffer.document.insert_after(bus_str), bypass_readonly=True)
-    bus_activity_buffer.auto_down()
+def run():
+    setup()
+    try:
+        # Run the interface. (This runs the event loop until Ctrl-C is pressed.)
+        build_application().run()
+    finally:
+        harness.close()
 
 
 if __name__ == "__main__":
     run()
-
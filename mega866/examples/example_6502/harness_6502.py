@@ -0,0 +1,372 @@
+"""
+The 6502 bus harness without any UI.
+
+Importing this module only builds pin tables. The TL866 is opened, initialised
+and the 6502 powered up the first time the harness is clocked, so tools that
+only need the pin assignments or the bus decoders start without touching USB.
+"""
+
+from gpio_controller import GpioController, all_earth_pins, open_bitbang
+from bus import Bus
+from .predict_6502 import Predictor6502
+from pinmask import PinMask
+from time import sleep
+
+EARTH_SERIAL_DEVICE = "/dev/serial/by-id/usb-ProgHQ_Open-TL866_Programmer_33144A91666856D18E6084EC-if00"
+
+
+def pin(x):
+    return 1 << (x - 1)
+
+
+def pins(*pin_list):
+    res = 0
+    for p in pin_list:
+        res |= pin(p)
+    return res
+
+
+# NOTE: pin 45 needs to be conencted to ground manually using a jumper wire or the like.
+
+# The letter 'B' at the end of a pin name means "bar", i.e., negated, active low
+
+CLOCK_PIN = 59
+RW_PIN = 65
+RESET_PIN = 49
+
+control_pins = {
+    3,  # IRQB: Interrupt request bar. Keep high to not trigger an interrupt.
+    7,  # NMIB: Non-maskable interrupt bar. Keep high to not trigger an interrupt.
+    49,  # RESB: Reset bar. Keep high to not reset the CPU.
+    55,  # RDY:  Ready. Keep to high to allow to CPU to operate normally.
+    57,  # SOB:  Set overflow bar. Datasheet says it's not recommended to do anything with this pin other than tie it high.
+    59,  # PHI2: Clock Input. The WDC W65C02S is a fully static design, so we can pulse the clock as slowly as we wish. May go up to 17MHz.
+    61,  # BE:   Bus enable. Keep high to allow the CPU to put anything on the data and address bus.
+}
+
+always_high_pins = PinMask.from_pins(3, 7, 49, 55, 57, 61)
+clock_high_pins = always_high_pins | pin(CLOCK_PIN)
+
+# Data pins
+data_pins = {11: 0, 13: 1, 15: 2, 17: 3, 19: 4, 21: 5, 77: 6, 79: 7}
+
+# Address pins
+address_pins = {
+    69: 0,
+    71: 1,
+    73: 2,
+    75: 3,
+    23: 4,
+    25: 5,
+    27: 6,
+    31: 7,
+    35: 8,
+    39: 9,
+    43: 10,
+    47: 11,
+    41: 12,
+    37: 13,
+    33: 14,
+    29: 15,
+}
+
+cpu_bus = Bus(
+    {
+        "address": sorted(address_pins, key=address_pins.get),
+        "data": sorted(data_pins, key=data_pins.get),
+        "rw": [RW_PIN],
+    }
+)
+
+bus_pins = PinMask(cpu_bus.mask)
+
+# Everything but the control pins is an input while the data bus is released
+data_high_z_mask = PinMask.from_pins(*(set(all_earth_pins) - control_pins))
+data_rw_mask = data_high_z_mask.difference(cpu_bus["data"].mask)
+
+# What to drive for each byte the 6502 reads, with PHI2 high and then low, so
+# a read cycle builds no masks
+read_clock_high = [clock_high_pins | cpu_bus["data"].encode(b) for b in range(256)]
+read_clock_low = [always_high_pins | cpu_bus["data"].encode(b) for b in range(256)]
+
+WRITE = 0
+READ = 1
+
+
+def get_address_pins(input_pins):
+    return cpu_bus["address"].decode(input_pins)
+
+
+def get_data_pins(input_pins):
+    return cpu_bus["data"].decode(input_pins)
+
+
+def get_rw_pin(input_pins):
+    if (input_pins & pin(RW_PIN)) > 0:
+        return 1
+    else:
+        return 0
+
+
+def get_data_pins_from_byte(b):
+    return cpu_bus["data"].encode(b)
+
+
+class Harness6502:
+    def __init__(
+        self,
+        handle_read,
+        handle_write,
+        earth_serial_device=EARTH_SERIAL_DEVICE,
+        backend=open_bitbang,
+        metrics=None,
+        trace_writer=None,
+        predict=False,
+        peek=None,
+    ):
+        """
+        handle_read(address) returns the byte the 6502 reads and
+        handle_write(address, data) takes the byte it writes. Nothing is opened
+        until the first clock_cycle() or an explicit power_up().
+
+        With predict the harness guesses the next read address from the bus
+        trace and drives that byte with the rising clock edge, saving a round
+        trip per correctly guessed read. peek(address) gives the byte to drive
+        without side effects, handle_read() is still called for the actual
+        read and its byte is driven if different.
+        """
+        self.handle_read = handle_read
+        self.handle_write = handle_write
+        self.earth_serial_device = earth_serial_device
+        self.backend = backend
+        self.metrics = metrics
+        self.trace_writer = trace_writer
+        self.predictor = Predictor6502() if predict else None
+        self.peek = peek if peek is not None else handle_read
+        self.cycle_count = 0
+        # The io_r sample of the last cycle, with its address and R/W
+        self.last_sample = 0
+        self.predicted_reads = 0
+        self.prediction_hits = 0
+        # Predicted a read, but the 6502 read somewhere else or wrote
+        self.read_mispredictions = 0
+        self.write_mispredictions = 0
+        # io_w values still to send to finish the last cycle. A predicted read
+        # cycle leaves PHI2 high and is finished by the next one.
+        self._pending_writes = []
+        self._controller = None
+        self._async_controller = None
+
+    @property
+    def controller(self):
+        if self._controller is None:
+            self.power_up()
+        return self._controller
+
+    @property
+    def async_controller(self):
+        if self._async_controller is None:
+            # asyncio is only imported by the harness users that clock with it
+            from async_controller import AsyncGpioController
+
+            self._async_controller = AsyncGpioController(self.controller)
+        return self._async_controller
+
+    def power_up(self):
+        # We assume one attached tl866 and we call it the "earth" controller
+        c = GpioController(
+            earth_serial_device=self.earth_serial_device,
+            backend=self.backend,
+            metrics=self.metrics,
+        )
+        self._controller = c
+
+        c.init()
+        c.io_tri(data_high_z_mask)
+
+        c.vdd_volt(1)  # 3.5V
+        c.vdd_pins(pins(67))  # VDD
+        c.vdd_en()
+
+        c.io_w(0)  # This should reset the 6502
+        sleep(0.001)
+        # First rising edge starts reset sequence
+        c.io_w(clock_high_pins)
+        sleep(0.001)
+        c.io_w(always_high_pins)
+
+    @property
+    def prediction_hit_rate(self):
+        if not self.predicted_reads:
+            return 0.0
+        return self.prediction_hits / self.predicted_reads
+
+    def finish_cycle(self):
+        """Ends a cycle a predicted read left with PHI2 high"""
+        if self._pending_writes:
+            with self.controller.transaction() as t:
+                self._send_pending(t)
+
+    def _send_pending(self, t):
+        for val in self._pending_writes:
+            t.io_w(val)
+        self._pending_writes = []
+
+    def close(self):
+        # Shutting the async workers down waits for a command still in flight
+        # on them, which has to be done before the TL866s are used from here
+        if self._async_controller is not None:
+            self._async_controller.close()
+            self._async_controller = None
+        if self._controller is not None:
+            self.finish_cycle()
+        if self.trace_writer is not None:
+            self.trace_writer.close()
+            self.trace_writer = None
+        if self._controller is not None:
+            self._controller.close()
+            self._controller = None
+
+    def clock_cycle(self):
+        """Runs one PHI2 period, returns (address, data, rw)"""
+        t = self.controller.transaction()
+        self._send_pending(t)
+        if self.predictor is not None:
+            predicted = self.predictor.predict()
+            if predicted is not None:
+                return self._predicted_read_cycle(t, predicted)
+        t.io_tri(data_high_z_mask)
+        t.delay(0.0000003)
+        t.io_r(bus_pins)
+        input_pins, = t.flush()
+        address = get_address_pins(input_pins)
+        rw = get_rw_pin(input_pins)
+        data = 0
+        if rw == READ:
+            t.io_tri(data_rw_mask)
+            data = self.handle_read(address)
+            t.io_w(read_clock_high[data])
+            t.delay(0.0000003)
+            t.io_w(read_clock_low[data])
+            t.flush()
+        else:
+            t.io_w(clock_high_pins)
+            t.delay(0.0000003)
+            t.io_r(bus_pins)
+            input_pins, = t.flush()
+            data = get_data_pins(input_pins)
+            self.handle_write(address, data)
+            t.io_w(always_high_pins)
+            t.delay(0.0000003)
+            t.flush()
+        return self._end_cycle(input_pins, address, data, rw)
+
+    def _predicted_read_cycle(self, t, predicted):
+        """
+        Drives the byte at predicted with PHI2 high and samples the address in
+        the same round trip. The 6502 only latches read data when PHI2 falls,
+        so a wrong byte can still be replaced, and the falling edge is left to
+        go out with the next cycle.
+        """
+        self.predicted_reads += 1
+        staged = self.peek(predicted)
+        t.io_tri(data_rw_mask)
+        t.io_w(read_clock_high[staged])
+        t.delay(0.0000003)
+        t.io_r(bus_pins)
+        input_pins, = t.flush()
+        address = get_address_pins(input_pins)
+        rw = get_rw_pin(input_pins)
+        if rw == READ:
+            if address == predicted:
+                self.prediction_hits += 1
+            else:
+                self.read_mispredictions += 1
+            data = self.handle_read(address)
+            if data != staged:
+                self._pending_writes.append(read_clock_high[data])
+            self._pending_writes.append(read_clock_low[data])
+        else:
+            # The 6502 is driving the data bus too, let go of it right away
+            self.write_mispredictions += 1
+            t.io_tri(data_high_z_mask)
+            t.delay(0.0000003)
+            t.io_r(bus_pins)
+            input_pins, = t.flush()
+            data = get_data_pins(input_pins)
+            self.handle_write(address, data)
+            t.io_w(always_high_pins)
+            t.delay(0.0000003)
+            t.flush()
+        return self._end_cycle(input_pins, address, data, rw)
+
+    async def clock_cycle_async(self):
+        """
+        clock_cycle() on the asyncio loop. Every command is awaited before the
+        next one is sent, which takes longer than the 300 ns the 6502 needs,
+        so there are no explicit delays.
+        """
+        c = self.async_controller
+        for val in self._pending_writes:
+            await c.io_w(val)
+        self._pending_writes = []
+        if self.predictor is not None:
+            predicted = self.predictor.predict()
+            if predicted is not None:
+                return await self._predicted_read_cycle_async(predicted)
+        await c.io_tri(data_high_z_mask)
+        input_pins = await c.io_r(bus_pins)
+        address = get_address_pins(input_pins)
+        rw = get_rw_pin(input_pins)
+        data = 0
+        if rw == READ:
+            await c.io_tri(data_rw_mask)
+            data = self.handle_read(address)
+            await c.io_w(read_clock_high[data])
+            await c.io_w(read_clock_low[data])
+        else:
+            await c.io_w(clock_high_pins)
+            input_pins = await c.io_r(bus_pins)
+            data = get_data_pins(input_pins)
+            self.handle_write(address, data)
+            await c.io_w(always_high_pins)
+        return self._end_cycle(input_pins, address, data, rw)
+
+    async def _predicted_read_cycle_async(self, predicted):
+        """_predicted_read_cycle() on the asyncio loop"""
+        c = self.async_controller
+        self.predicted_reads += 1
+        staged = self.peek(predicted)
+        await c.io_tri(data_rw_mask)
+        await c.io_w(read_clock_high[staged])
+        input_pins = await c.io_r(bus_pins)
+        address = get_address_pins(input_pins)
+        rw = get_rw_pin(input_pins)
+        if rw == READ:
+            if address == predicted:
+                self.prediction_hits += 1
+            else:
+                self.read_mispredictions += 1
+            data = self.handle_read(address)
+            if data != staged:
+                self._pending_writes.append(read_clock_high[data])
+            self._pending_writes.append(read_clock_low[data])
+        else:
+            self.write_mispredictions += 1
+            await c.io_tri(data_high_z_mask)
+            input_pins = await c.io_r(bus_pins)
+            data = get_data_pins(input_pins)
+            self.handle_write(address, data)
+            await c.io_w(always_high_pins)
+        return self._end_cycle(input_pins, address, data, rw)
+
+    def _end_cycle(self, input_pins, address, data, rw):
+        self.last_sample = input_pins
+        if self.predictor is not None:
+            self.predictor.observe(address, data, rw)
+        if self.trace_writer is not None:
+            self.trace_writer.append(self.cycle_count, input_pins, address, data, rw)
+        self.cycle_count += 1
+        if self.metrics is not None:
+            self.metrics.cycle()
+        return address, data, rw
@@ -0,0 +1,177 @@
+"""
+Predicts the 6502's next read from the bus trace, for Harness6502(predict=True).
+
+This is not an emulator. It only knows how 65C02 instructions start. After an
+opcode fetch at A, the next cycle always reads A+1. Some instructions are known
+further:
+
+- absolute addressing reads A+2 next
+- two cycle instructions fetch the next opcode next
+- a branch reads A+2 whether it is taken or not
+- JMP fetches its target next
+
+Otherwise the predictor only keeps the addresses the next opcode fetch can be
+at, e.g. the fall through and the target of a branch, and takes the first read
+of one of them as the next opcode fetch. If the cycle after a supposed opcode
+fetch is not a read of A+1, the guess is dropped.
+"""
+
+from typing import List, Optional, Tuple
+
+READ = 1
+
+# More cycles than any instruction takes. Longer than this without finding the
+# next opcode fetch and the predictor starts over as after a reset. Instructions
+# that jump through a pointer wait for it however long it takes.
+_MAX_CYCLES = 8
+
+
+def _length(opcode: int) -> int:
+    low = opcode & 0xF
+    if opcode == 0x20 or low >= 0xC or (low == 0x9 and opcode & 0x10):
+        return 3
+    if opcode in (0x40, 0x60) or low in (0x3, 0x8, 0xA, 0xB):
+        return 1
+    return 2
+
+
+_LENGTHS = [_length(opcode) for opcode in range(256)]
+_BRANCHES = frozenset(range(0x10, 0x100, 0x20)) | {0x80}
+# BBR and BBS, the offset is their second operand
+_BIT_BRANCHES = frozenset(range(0x0F, 0x100, 0x10))
+# Where execution continues is read from memory: BRK, RTI, RTS, JMP (a),
+# JMP (a,x), WAI and STP
+_INDIRECT = frozenset({0x00, 0x40, 0x60, 0x6C, 0x7C, 0xCB, 0xDB})
+# The one cycle NOPs, the next opcode is fetched right after
+_ONE_CYCLE = frozenset(
+    op for op in range(256) if op & 0xF in (0x3, 0xB) and op not in _INDIRECT
+)
+# Two cycles, the second reads A+1 and the next opcode is fetched from A+1.
+# Not the stack pushes and pulls.
+_IMPLIED = frozenset(
+    op for op in range(256) if op & 0xF in (0x8, 0xA)
+) - {0x08, 0x28, 0x48, 0x68, 0x5A, 0x7A, 0xDA, 0xFA}
+# Two cycles, the next opcode is fetched from A+2. Not ADC/SBC, which take a
+# cycle more in decimal mode.
+_IMMEDIATE = frozenset(
+    {0x09, 0x29, 0x49, 0x89, 0xA9, 0xC9, 0xA0, 0xA2, 0xC0, 0xE0}
+    | {0x02, 0x22, 0x42, 0x62, 0x82, 0xC2, 0xE2}
+)
+# The third cycle reads A+2
+_ABSOLUTE = frozenset(
+    op for op in range(256) if _LENGTHS[op] == 3 and op != 0x20
+) - _BIT_BRANCHES
+
+
+def _relative(address: int, offset: int) -> int:
+    return (address + offset - (0x100 if offset & 0x80 else 0)) & 0xFFFF
+
+
+class _Instruction:
+    def __init__(self, address: int, opcode: int) -> None:
+        self.address = address
+        self.opcode = opcode
+        self.operands: List[Optional[int]] = [None, None]
+        # Cycles since the opcode fetch
+        self.cycles = 0
+        # The last two consecutive bytes read, where RTS, RTI, BRK and JMP (a)
+        # take the new PC from
+        self.pointer: Optional[int] = None
+
+    def expected(self) -> Tuple[Optional[int], bool]:
+        """The address the next cycle reads if known, and if it is an opcode fetch"""
+        address, opcode, cycles = self.address, self.opcode, self.cycles
+        if cycles == 0:
+            return (address + 1) & 0xFFFF, opcode in _ONE_CYCLE
+        if cycles == 1:
+            if opcode in _ABSOLUTE:
+                return (address + 2) & 0xFFFF, False
+            if opcode in _IMMEDIATE or opcode in _BRANCHES:
+                return (address + 2) & 0xFFFF, True
+            if opcode in _IMPLIED:
+                return (address + 1) & 0xFFFF, True
+        elif cycles == 2 and opcode == 0x4C and None not in self.operands:
+            return self.operands[0] | self.operands[1] << 8, True
+        return None, False
+
+    def read(
+        self, address: int, data: int, previous: Optional[Tuple[int, int]]
+    ) -> None:
+        for i in (0, 1):
+            if self.operands[i] is None and address == (self.address + 1 + i) & 0xFFFF:
+                self.operands[i] = data
+        if self.cycles >= 3 and previous is not None and previous[0] + 1 == address:
+            self.pointer = previous[1] | data << 8
+
+    def is_next_opcode(self, address: int) -> bool:
+        start, opcode = self.address, self.opcode
+        if opcode in _BRANCHES or opcode in _BIT_BRANCHES:
+            length = _LENGTHS[opcode]
+            fall_through = (start + length) & 0xFFFF
+            offset = self.operands[length - 2]
+            return address == fall_through or (
+                offset is not None and address == _relative(fall_through, offset)
+            )
+        if opcode in (0x20, 0x4C):
+            return None not in self.operands and address == (
+                self.operands[0] | self.operands[1] << 8
+            )
+        if opcode in _INDIRECT:
+            if self.pointer is None:
+                return False
+            # RTS pulls the address of its last operand byte
+            return address == (self.pointer + (opcode == 0x60)) & 0xFFFF
+        return address == (start + _LENGTHS[opcode]) & 0xFFFF
+
+
+def _unsynced() -> _Instruction:
+    # Like the end of BRK, the next opcode is wherever a pointer read says
+    instruction = _Instruction(0, 0x00)
+    instruction.cycles = 2
+    return instruction
+
+
+class Predictor6502:
+    def __init__(self) -> None:
+        self.reset()
+
+    def reset(self) -> None:
+        self._instruction = _unsynced()
+        self._previous = self._instruction
+        self._last_read: Optional[Tuple[int, int]] = None
+        self._next: Tuple[Optional[int], bool] = (None, False)
+
+    def predict(self) -> Optional[int]:
+        """The address the next cycle reads, if the predictor is sure it is a read"""
+        return self._next[0]
+
+    def observe(self, address: int, data: int, rw: int) -> None:
+        """Follows one bus cycle"""
+        expected, is_opcode = self._next
+        instruction = self._instruction
+        if rw == READ and address == expected and is_opcode:
+            self._fetch(address, data)
+        else:
+            if instruction.cycles == 0 and (
+                rw != READ or address != (instruction.address + 1) & 0xFFFF
+            ):
+                # What was read at instruction.address was not an opcode
+                instruction = self._instruction = self._previous
+            instruction.cycles += 1
+            if rw == READ:
+                if address != expected and instruction.is_next_opcode(address):
+                    self._fetch(address, data)
+                else:
+                    instruction.read(address, data, self._last_read)
+            if (
+                self._instruction.cycles > _MAX_CYCLES
+                and self._instruction.opcode not in _INDIRECT
+            ):
+                self._instruction = self._previous = _unsynced()
+        if rw == READ:
+            self._last_read = (address, data)
+        self._next = self._instruction.expected()
+
+    def _fetch(self, address: int, data: int) -> None:
+        self._previous = self._instruction
+        self._instruction = _Instruction(address, data)
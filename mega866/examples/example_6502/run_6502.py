@@ -0,0 +1,260 @@
+"""
+Runs the 6502 without the UI until a condition hits, then prints a summary.
+
+    python3 -m examples.example_6502.run_6502 --simulate --output 'world!\\n'
+    python3 -m examples.example_6502.run_6502 --break 0x8010 --cycles 1000000
+
+Address and R/W conditions are compiled once into mask/compare pairs over the
+raw io_r sample and grouped by mask, so a cycle costs one dict lookup per
+distinct mask however many breakpoints there are. Data is compared with the
+byte the harness handled, the one driven for a read or sampled for a write.
+"""
+
+import argparse
+import codecs
+import os
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from gpio_controller import open_bitbang
+from memory import Memory
+from .harness_6502 import (
+    CLOCK_PIN,
+    EARTH_SERIAL_DEVICE,
+    READ,
+    RESET_PIN,
+    WRITE,
+    Harness6502,
+    cpu_bus,
+)
+
+OUT_PORT = 0x6000
+
+
+class Condition(NamedTuple):
+    name: str
+    mask: int
+    value: int
+    # Also required, if not None
+    data: Optional[int] = None
+
+
+def access_condition(
+    address: int, rw: Optional[int] = None, data: Optional[int] = None
+) -> Condition:
+    """The 6502 reading (rw=READ), writing (rw=WRITE) or accessing address"""
+    kind = {READ: "read of", WRITE: "write to", None: "access to"}[rw]
+    name = f"{kind} {address:#06x}"
+    if data is not None:
+        name += f" with {data:#04x}"
+    mask = cpu_bus["address"].mask
+    value = cpu_bus["address"].encode(address)
+    if rw is not None:
+        mask |= cpu_bus["rw"].mask
+        value |= cpu_bus["rw"].encode(rw)
+    return Condition(name, mask, value, data)
+
+
+def compile_conditions(
+    conditions: List[Condition],
+) -> List[Tuple[int, Dict[int, List[Condition]]]]:
+    """Groups conditions by mask, mask -> masked sample -> conditions"""
+    by_mask: Dict[int, Dict[int, List[Condition]]] = {}
+    for condition in conditions:
+        by_mask.setdefault(condition.mask, {}).setdefault(
+            condition.value, []
+        ).append(condition)
+    return list(by_mask.items())
+
+
+def _first_hit(conditions: List[Condition], data: int) -> Optional[str]:
+    for condition in conditions:
+        if condition.data is None or condition.data == data:
+            return condition.name
+    return None
+
+
+class RunResult(NamedTuple):
+    reason: str
+    cycles: int
+    elapsed_s: float
+    # (address, data, rw) of the last cycle
+    last_cycle: Optional[Tuple[int, int, int]]
+
+    @property
+    def cycles_per_second(self) -> float:
+        return self.cycles / self.elapsed_s if self.elapsed_s else 0.0
+
+
+class Runner:
+    def __init__(
+        self,
+        harness: Harness6502,
+        conditions: List[Condition] = (),
+        max_cycles: Optional[int] = None,
+    ) -> None:
+        self.harness = harness
+        self.compiled = compile_conditions(list(conditions))
+        self.max_cycles = max_cycles
+        self.output = bytearray()
+        self.output_pattern: Optional[bytes] = None
+        self._output_hit = False
+
+    def output_byte(self, data: int) -> None:
+        """Takes a byte the program wrote to OUT_PORT, see stop_on_output()"""
+        self.output.append(data)
+        if self.output_pattern is not None and self.output.endswith(
+            self.output_pattern
+        ):
+            self._output_hit = True
+
+    def stop_on_output(self, pattern: bytes) -> None:
+        """Stops once what the program wrote to OUT_PORT ends with pattern"""
+        self.output_pattern = pattern
+
+    def run(self) -> RunResult:
+        clock_cycle = self.harness.clock_cycle
+        harness = self.harness
+        compiled = self.compiled
+        max_cycles = self.max_cycles
+        cycles = 0
+        last_cycle = None
+        reason = "interrupted"
+        start = time.monotonic()
+        try:
+            while cycles != max_cycles:
+                last_cycle = clock_cycle()
+                cycles += 1
+                sample = harness.last_sample
+                hit = None
+                for mask, table in compiled:
+                    hits = table.get(sample & mask)
+                    if hits is not None:
+                        hit = _first_hit(hits, last_cycle[1])
+                        if hit is not None:
+                            break
+                if hit is not None:
+                    reason = hit
+                    break
+                if self._output_hit:
+                    reason = f"output {self.output_pattern!r}"
+                    break
+            else:
+                reason = f"{max_cycles} cycles"
+        except KeyboardInterrupt:
+            pass
+        return RunResult(reason, cycles, time.monotonic() - start, last_cycle)
+
+
+def _address_and_data(text: str) -> Tuple[int, Optional[int]]:
+    address, _, data = text.partition("=")
+    return int(address, 0), int(data, 0) if data else None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Run the 6502 headless until a condition hits"
+    )
+    parser.add_argument(
+        "--break",
+        dest="breakpoints",
+        action="append",
+        default=[],
+        metavar="ADDRESS",
+        help="stop when the 6502 reads ADDRESS, e.g. an instruction there",
+    )
+    for rw, flag in ((None, "watch"), (READ, "watch-read"), (WRITE, "watch-write")):
+        parser.add_argument(
+            f"--{flag}",
+            action="append",
+            default=[],
+            metavar="ADDRESS[=DATA]",
+            help=f"stop on a {flag[6:] or 'read or write'} at ADDRESS, "
+            "optionally only of DATA",
+        )
+    parser.add_argument("--cycles", type=int, help="stop after this many cycles")
+    parser.add_argument(
+        "--output",
+        help="stop once the program's output ends with this, \\n etc. work",
+    )
+    parser.add_argument(
+        "--hex",
+        default=os.path.join(
+            os.path.dirname(os.path.realpath(__file__)), "prog_6502.hex"
+        ),
+        help="program to load, Intel HEX",
+    )
+    parser.add_argument("--earth", default=EARTH_SERIAL_DEVICE, metavar="DEVICE")
+    parser.add_argument(
+        "--simulate",
+        action="store_true",
+        help="run a modelled 6502 on a VirtualBoard",
+    )
+    parser.add_argument(
+        "--predict",
+        action="store_true",
+        help="stage predicted read data, see predict_6502.py",
+    )
+    args = parser.parse_args()
+
+    conditions = [
+        access_condition(int(address, 0), READ) for address in args.breakpoints
+    ]
+    watches = ((None, args.watch), (READ, args.watch_read), (WRITE, args.watch_write))
+    for rw, texts in watches:
+        for text in texts:
+            address, data = _address_and_data(text)
+            conditions.append(access_condition(address, rw, data))
+
+    memory = Memory()
+    memory.load_hex(args.hex)
+    if args.simulate:
+        from virtual_tl866 import VirtualBoard
+        from virtual_6502 import Virtual6502
+
+        backend = VirtualBoard(dut=Virtual6502(cpu_bus, CLOCK_PIN, RESET_PIN)).open
+    else:
+        backend = open_bitbang
+    harness = Harness6502(
+        memory.read,
+        memory.write,
+        earth_serial_device=args.earth,
+        backend=backend,
+        predict=args.predict,
+        peek=memory.data.__getitem__,
+    )
+    runner = Runner(harness, conditions, args.cycles)
+
+    def out_port_write(address, data):
+        if address == OUT_PORT:
+            runner.output_byte(data)
+        else:
+            memory.data[address] = data
+
+    memory.map_io(OUT_PORT, OUT_PORT, write=out_port_write)
+    if args.output is not None:
+        runner.stop_on_output(codecs.decode(args.output, "unicode_escape").encode())
+
+    harness.power_up()
+    try:
+        result = runner.run()
+    finally:
+        harness.close()
+
+    print(f"Stopped on {result.reason} after {result.cycles} cycles")
+    if result.last_cycle is not None:
+        address, data, rw = result.last_cycle
+        print(f"Last cycle: {address:#06x} {data:#04x} {'r' if rw == READ else 'w'}")
+    print(f"{result.elapsed_s:.3f} s, {result.cycles_per_second:.1f} cycles/s")
+    if harness.predictor is not None:
+        print(
+            f"{harness.prediction_hit_rate:.1%} of {harness.predicted_reads} "
+            "predicted reads hit"
+        )
+    if runner.output:
+        tail = bytes(runner.output[-64:])
+        print(f"Output, {len(runner.output)} bytes, ends {tail!r}")
+
+
+if __name__ == "__main__":
+    main()
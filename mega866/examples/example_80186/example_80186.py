@@ -1,5 +1,10 @@
 from gpio_controller import GpioController, all_pins
-from time import sleep
+from bus import Bus
+from metrics import Metrics, print_summary
+from adapter import load_adapter
+from continuity import sweep
+from time import monotonic, sleep
+import json
 
 # We are using the PGA132 adapter
 # We are using the PGA68
@@ -14,76 +19,8 @@ def pins(*pin_list):
         res |= pin(p)
     return res
 
-plccpin2socketpin = [
-        33,
-        31,
-        35,
-        37,
-        39,
-        41,
-        43,
-        45,
-        47,
-        48,
-        46,
-        44,
-        42,
-        40,
-        38,
-        36,
-        34,
-        32,
-        30,
-        28,
-        26,
-        24,
-        22,
-        20,
-        18,
-        16,
-        14,
-        68,
-        12,
-        10,
-        66,
-        8,
-        64,
-        6,
-        62,
-        4,
-        60,
-        2,
-        58,
-        56,
-        54,
-        52,
-        50,
-        49,
-        51,
-        53,
-        55,
-        57,
-        1,
-        59,
-        3,
-        61,
-        5,
-        63,
-        7,
-        65,
-        9,
-        11,
-        67,
-        13,
-        15,
-        17,
-        19,
-        21,
-        23,
-        25,
-        27,
-        29,
-]
+pga68 = load_adapter("zsm-ic-pga68_r1")
+plccpin2socketpin = list(pga68.mega_pins)
 
 # A/D = address/data
 # The address and data lines are multiplexed
@@ -143,6 +80,14 @@ S1 = 5
 S2 = 63
 LOCK = 57
 
+cpu_bus = Bus(
+    {
+        "address": address_data_pins,
+        "data": address_data_pins[:16],
+        "status": [S0, S1, S2],
+    }
+)
+
 tristate_pins = set(all_pins)
 
 # These pins should always be driven
@@ -156,18 +101,48 @@ def display_pins(read_pins):
         name = p[0]
         bit = 1 if (pin(p[1]) & read_pins) > 0 else 0
         print(f"{name:<10}: {bit}")
-
-def do_bus_cycles(controller):
-    for _ in range(10):
-        controller.io_w(pins(*always_high_pins))
-        sleep(0.001)
-        controller.io_w(pins(*always_high_pins) | pin(X1))
-        sleep(0.001)
-        display_pins(controller.io_r())
-
+    fields = cpu_bus.decode(read_pins)
+    print(f"{'A/D':<10}: {fields['address']:#07x}")
+    print(f"{'S2-S0':<10}: {fields['status']:03b}")
+
+def do_bus_cycles(controller, metrics=None, n_cycles=10):
+    # One X1 period, sampling the bus after each rising edge. It is compiled
+    # once and played n_cycles times as a single burst.
+    clock_cycle = controller.compile_waveform(
+        [
+            (pins(*always_high_pins), None, False),
+            (pins(*always_high_pins) | pin(X1), None, True),
+        ]
+    )
+    samples = clock_cycle.unpack(controller.play(clock_cycle, repeat=n_cycles))
+    for read_pins in samples:
+        display_pins(read_pins)
+    if metrics is not None:
+        metrics.cycle(n_cycles)
+
+
+def clock_until_passive(controller, max_cycles=64):
+    # S2-S0 read 111, passive, once the CPU is out of reset and between bus
+    # cycles. It only gets there with X1 running, so clock it while polling.
+    status_pins = pins(S0, S1, S2)
+    clock_cycle = controller.compile_waveform(
+        [
+            (pins(*always_high_pins), None, False),
+            (pins(*always_high_pins) | pin(X1), None, True),
+        ],
+        status_pins,
+    )
+    # One burst, like do_bus_cycles(), so only the first period re-sends the
+    # outputs
+    samples = clock_cycle.unpack(controller.play(clock_cycle, repeat=max_cycles))
+    for cycle, read_pins in enumerate(samples, 1):
+        if read_pins & status_pins == status_pins:
+            return cycle
+    raise Exception(f"status lines not passive after {max_cycles} X1 periods")
 
 def main():
-    controller = GpioController(earth_serial_device="/dev/serial/by-id/usb-ProgHQ_Open-TL866_Programmer_BB7DE095C3656D924B371EC8-if00", water_serial_device="/dev/serial/by-id/usb-ProgHQ_Open-TL866_Programmer_92DD659470E765C58847A4DA-if00", fire_serial_device="/dev/serial/by-id/usb-ProgHQ_Open-TL866_Programmer_000000000000000000000000-if00", wind_serial_device="/dev/serial/by-id/usb-ProgHQ_Open-TL866_Programmer_33144A91666856D18E6084EC-if00")
+    metrics = Metrics()
+    controller = GpioController(earth_serial_device="/dev/serial/by-id/usb-ProgHQ_Open-TL866_Programmer_BB7DE095C3656D924B371EC8-if00", water_serial_device="/dev/serial/by-id/usb-ProgHQ_Open-TL866_Programmer_92DD659470E765C58847A4DA-if00", fire_serial_device="/dev/serial/by-id/usb-ProgHQ_Open-TL866_Programmer_000000000000000000000000-if00", wind_serial_device="/dev/serial/by-id/usb-ProgHQ_Open-TL866_Programmer_33144A91666856D18E6084EC-if00", concurrent=True, metrics=metrics)
 
     controller.init()
     controller.io_tri(pins(*tristate_pins))
@@ -179,21 +154,22 @@ def main():
     sleep(0.001)
     always_high_pins.append(RES)
     controller.io_w(pins(*always_high_pins))
-    sleep(0.001)
+    start = monotonic()
+    cycles = clock_until_passive(controller)
+    elapsed = monotonic() - start
+    print(f"Status lines passive after {cycles} X1 periods, {elapsed * 1e3:.2f} ms")
 
-    do_bus_cycles(controller)
+    do_bus_cycles(controller, metrics)
+    print_summary(metrics.snapshot())
 
 def test():
-    import pdb
-    controller = GpioController(earth_serial_device="/dev/serial/by-id/usb-ProgHQ_Open-TL866_Programmer_BB7DE095C3656D924B371EC8-if00", water_serial_device="/dev/serial/by-id/usb-ProgHQ_Open-TL866_Programmer_92DD659470E765C58847A4DA-if00", fire_serial_device="/dev/serial/by-id/usb-ProgHQ_Open-TL866_Programmer_000000000000000000000000-if00", wind_serial_device="/dev/serial/by-id/usb-ProgHQ_Open-TL866_Programmer_33144A91666856D18E6084EC-if00")
+    # Checks the PGA68 adapter for shorts and stuck pins, with the socket empty
+    controller = GpioController(earth_serial_device="/dev/serial/by-id/usb-ProgHQ_Open-TL866_Programmer_BB7DE095C3656D924B371EC8-if00", water_serial_device="/dev/serial/by-id/usb-ProgHQ_Open-TL866_Programmer_92DD659470E765C58847A4DA-if00", fire_serial_device="/dev/serial/by-id/usb-ProgHQ_Open-TL866_Programmer_000000000000000000000000-if00", wind_serial_device="/dev/serial/by-id/usb-ProgHQ_Open-TL866_Programmer_33144A91666856D18E6084EC-if00", concurrent=True)
 
     controller.init()
-    controller.io_tri(0)
-
-    pdb.set_trace()
-    for i, p in enumerate(plccpin2socketpin):
-        print(f"i: {i:2}, p: {p:3}")
-        controller.io_w(pin(p))
+    report = sweep(controller, pga68)
+    controller.io_tri()
+    print(json.dumps(report, indent=1))
 
 if __name__ == "__main__":
     #main()
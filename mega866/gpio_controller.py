@@ -1,8 +1,24 @@
 #!/usr/bin/env python3
 
 from enum import Enum
-from typing import Dict, Iterator, List, Optional
-from otl866.bitbang import Bitbang  # type: ignore
+from time import monotonic, sleep
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+if TYPE_CHECKING:
+    from metrics import Metrics
+
+# otl866 is only imported when a real device is opened, see open_bitbang()
+Bitbang = Any
 
 TL866_LOWEST_PIN_NUMBER: int = 1
 TL866_HIGHEST_PIN_NUMBER: int = 40
@@ -10,6 +26,10 @@ TL866_HIGHEST_PIN_NUMBER: int = 40
 MEGA866_HIGHEST_PIN_NUMBER: int = 160
 MEGA866_LOWEST_PIN_NUMBER: int = 1
 
+TL866_MASK_BYTES: int = TL866_HIGHEST_PIN_NUMBER // 8
+MEGA866_MASK_BYTES: int = MEGA866_HIGHEST_PIN_NUMBER // 8
+TL866_ALL_PINS_MASK: int = (1 << TL866_HIGHEST_PIN_NUMBER) - 1
+
 
 class Tl866Instance(Enum):
     WATER = 1  # J9
@@ -21,7 +41,6 @@ class Tl866Instance(Enum):
 class Tl866Pin:
     def __init__(self, instance: Tl866Instance, pin_on_tl866_instance: int):
         self.instance = instance
-        self.bitbanger = None
         if not pin_on_tl866_instance in range(
             TL866_LOWEST_PIN_NUMBER, TL866_HIGHEST_PIN_NUMBER + 1
         ):
@@ -32,210 +51,205 @@ class Tl866Pin:
             self.pin = pin_on_tl866_instance
 
 
-pin2Tl866_map: Dict[int, Tl866Pin] = {}
+# Mega pin wired to each pin of each TL866, indexed by TL866 pin number (index
+# 0 is unused). This is the Mega866 schematic as constant data, everything else
+# is derived from it.
+# fmt: off
 Tl866Pin2megaPin_map: Dict[Tl866Instance, List[int]] = {
-    Tl866Instance.WATER: [0] * (TL866_HIGHEST_PIN_NUMBER + 1),
-    Tl866Instance.EARTH: [0] * (TL866_HIGHEST_PIN_NUMBER + 1),
-    Tl866Instance.FIRE: [0] * (TL866_HIGHEST_PIN_NUMBER + 1),
-    Tl866Instance.WIND: [0] * (TL866_HIGHEST_PIN_NUMBER + 1),
+    Tl866Instance.WATER: [
+        0,
+        158, 154, 96, 94, 92, 90, 88, 140, 138, 136,
+        134, 130, 126, 122, 118, 114, 110, 106, 102, 98,
+        100, 104, 108, 112, 116, 120, 124, 128, 132, 82,
+        84, 86, 142, 144, 146, 148, 150, 152, 156, 160,
+    ],
+    Tl866Instance.EARTH: [
+        0,
+        51, 55, 1, 3, 5, 7, 9, 67, 69, 71,
+        73, 75, 23, 25, 27, 31, 35, 39, 43, 47,
+        45, 41, 37, 33, 29, 79, 77, 21, 19, 17,
+        15, 13, 11, 65, 63, 61, 59, 57, 53, 49,
+    ],
+    Tl866Instance.FIRE: [
+        0,
+        48, 44, 40, 36, 32, 28, 26, 24, 76, 74,
+        72, 70, 68, 10, 8, 6, 4, 2, 56, 52,
+        50, 54, 58, 60, 62, 64, 66, 12, 14, 16,
+        18, 20, 22, 78, 80, 30, 34, 38, 42, 46,
+    ],
+    Tl866Instance.WIND: [
+        0,
+        97, 101, 105, 109, 113, 117, 121, 125, 129, 133,
+        135, 137, 139, 87, 89, 91, 93, 95, 153, 157,
+        159, 155, 151, 149, 147, 145, 143, 141, 85, 83,
+        81, 131, 127, 123, 119, 115, 111, 107, 103, 99,
+    ],
+}
+# fmt: on
+
+pin2Tl866_map: Dict[int, Tl866Pin] = {
+    mega_pin: Tl866Pin(instance, tl866_pin)
+    for instance, mega_pins in Tl866Pin2megaPin_map.items()
+    for tl866_pin, mega_pin in enumerate(mega_pins)
+    if tl866_pin
 }
+if len(pin2Tl866_map) != MEGA866_HIGHEST_PIN_NUMBER:
+    raise Exception("Pin already in map!")
+
+all_water_pins = frozenset(Tl866Pin2megaPin_map[Tl866Instance.WATER][1:])
+all_earth_pins = frozenset(Tl866Pin2megaPin_map[Tl866Instance.EARTH][1:])
+all_fire_pins = frozenset(Tl866Pin2megaPin_map[Tl866Instance.FIRE][1:])
+all_wind_pins = frozenset(Tl866Pin2megaPin_map[Tl866Instance.WIND][1:])
+all_pins = frozenset(pin2Tl866_map)
+
+# Tl866Instance in value order, so _INSTANCES[instance.value - 1] is instance
+_INSTANCES: Tuple[Tl866Instance, ...] = tuple(Tl866Instance)
+
+
+class PinTranslator:
+    """
+    Translates between mega pin masks and per instance TL866 masks using byte
+    indexed lookup tables, so a translation costs one table lookup per non
+    zero byte instead of one dict lookup per set bit.
+
+    Per instance masks are returned as a tuple indexed by
+    ``Tl866Instance.value - 1``.
+    """
+
+    def __init__(
+        self,
+        mega_pin_map: Dict[int, Tl866Pin],
+        tl866_pin_map: Dict[Tl866Instance, List[int]],
+    ) -> None:
+        self._mega_pin_map = mega_pin_map
+        self._tl866_pin_map = tl866_pin_map
+
+    def __getattr__(self, name: str) -> Any:
+        # The tables are built on first use, so importing gpio_controller stays
+        # cheap for tools that only need the pin maps
+        if name in ("_split_tables", "_merge_tables"):
+            self._build_tables(self._mega_pin_map, self._tl866_pin_map)
+            return self.__dict__[name]
+        raise AttributeError(name)
+
+    def _build_tables(
+        self,
+        mega_pin_map: Dict[int, Tl866Pin],
+        tl866_pin_map: Dict[Tl866Instance, List[int]],
+    ) -> None:
+        n_instances = len(Tl866Instance)
+        # _split_tables[byte_index][byte_value] -> per instance masks
+        self._split_tables: List[List[Tuple[int, ...]]] = []
+        for byte_index in range(MEGA866_MASK_BYTES):
+            table = [(0,) * n_instances]
+            for value in range(1, 256):
+                low_bit = (value & -value).bit_length() - 1
+                mega_pin = byte_index * 8 + low_bit + 1
+                if mega_pin not in mega_pin_map:
+                    raise Exception(f"Pin {mega_pin} is not valid")
+                tl866_pin = mega_pin_map[mega_pin]
+                masks = list(table[value & (value - 1)])
+                masks[tl866_pin.instance.value - 1] |= 1 << (tl866_pin.pin - 1)
+                table.append(tuple(masks))
+            self._split_tables.append(table)
+
+        # _merge_tables[instance_index][byte_index][byte_value] -> mega pin mask
+        self._merge_tables: List[List[List[int]]] = []
+        for instance in Tl866Instance:
+            instance_tables = []
+            for byte_index in range(TL866_MASK_BYTES):
+                table = [0]
+                for value in range(1, 256):
+                    low_bit = (value & -value).bit_length() - 1
+                    mega_pin = tl866_pin_map[instance][byte_index * 8 + low_bit + 1]
+                    table.append(table[value & (value - 1)] | (1 << (mega_pin - 1)))
+                instance_tables.append(table)
+            self._merge_tables.append(instance_tables)
+
+    def split(self, val: int) -> Tuple[int, ...]:
+        if val >> MEGA866_HIGHEST_PIN_NUMBER:
+            raise Exception(f"Pin {val.bit_length()} is not valid")
+        masks = [0] * len(Tl866Instance)
+        for table, byte in zip(
+            self._split_tables, val.to_bytes(MEGA866_MASK_BYTES, "little")
+        ):
+            if byte:
+                for i, mask in enumerate(table[byte]):
+                    masks[i] |= mask
+        return tuple(masks)
+
+    def merge(self, instance: Tl866Instance, val: int) -> int:
+        res = 0
+        for table, byte in zip(
+            self._merge_tables[instance.value - 1],
+            (val & TL866_ALL_PINS_MASK).to_bytes(TL866_MASK_BYTES, "little"),
+        ):
+            if byte:
+                res |= table[byte]
+        return res
+
 
+pin_translator = PinTranslator(pin2Tl866_map, Tl866Pin2megaPin_map)
+
+
+def split_mask(val: int) -> Tuple[int, ...]:
+    """pin_translator.split(), using the slices a PinMask already carries"""
+    masks = getattr(val, "instance_masks", None)
+    return masks if masks is not None else pin_translator.split(val)
+
+
+class BitbangProxy:
+    """
+    Base for wrappers around a Bitbang. Attributes pass through to it, and each
+    public method is replaced by what _wrap() returns for it, cached so
+    __getattr__ only runs once per method.
+    """
+
+    def __init__(self, bitbang: Bitbang) -> None:
+        self._bitbang = bitbang
+
+    def _wrap(self, name: str, method: Callable) -> Optional[Callable]:
+        """Returns the wrapper for method, or None to call it directly"""
+        return None
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._bitbang, name)
+        if not callable(attr) or name.startswith("_"):
+            return attr
+        wrapped = self._wrap(name, attr)
+        if wrapped is None:
+            return attr
+        setattr(self, name, wrapped)
+        return wrapped
+
+
+def open_bitbang(device: str, instance: Tl866Instance) -> Bitbang:
+    """The default GpioController backend, a real TL866 on a serial device"""
+    try:
+        from otl866.bitbang import Bitbang  # type: ignore
+    except ImportError:
+        raise Exception(f"otl866 is required to open {device}")
+    return Bitbang(device=device)
+
+
+# Commands GpioController.resync() replays, power and outputs before tri-state
+_RESYNC_ORDER = (
+    "vdd_volt",
+    "vpp_volt",
+    "vdd_pins",
+    "vpp_pins",
+    "gnd_pins",
+    "io_w",
+    "io_tri",
+)
+
+
+# wait_for() polls back to back WAIT_SPIN_POLLS times, then sleeps between polls
+# starting at WAIT_MIN_INTERVAL and doubling up to WAIT_MAX_INTERVAL seconds
+WAIT_SPIN_POLLS = 4
+WAIT_MIN_INTERVAL = 0.00005
+WAIT_MAX_INTERVAL = 0.005
 
-def _add_mapping_entry(
-    mega_pin: int, tl866_instance: Tl866Instance, tl866_pin: int
-) -> None:
-    if mega_pin in pin2Tl866_map:
-        raise Exception("Pin already in map!")
-    else:
-        pin2Tl866_map[mega_pin] = Tl866Pin(tl866_instance, tl866_pin)
-        Tl866Pin2megaPin_map[tl866_instance][tl866_pin] = mega_pin
-
-
-_add_mapping_entry(51, Tl866Instance.EARTH, 1)
-_add_mapping_entry(55, Tl866Instance.EARTH, 2)
-_add_mapping_entry(1, Tl866Instance.EARTH, 3)
-_add_mapping_entry(3, Tl866Instance.EARTH, 4)
-_add_mapping_entry(5, Tl866Instance.EARTH, 5)
-_add_mapping_entry(7, Tl866Instance.EARTH, 6)
-_add_mapping_entry(9, Tl866Instance.EARTH, 7)
-_add_mapping_entry(67, Tl866Instance.EARTH, 8)
-_add_mapping_entry(69, Tl866Instance.EARTH, 9)
-_add_mapping_entry(71, Tl866Instance.EARTH, 10)
-_add_mapping_entry(73, Tl866Instance.EARTH, 11)
-_add_mapping_entry(75, Tl866Instance.EARTH, 12)
-_add_mapping_entry(23, Tl866Instance.EARTH, 13)
-_add_mapping_entry(25, Tl866Instance.EARTH, 14)
-_add_mapping_entry(27, Tl866Instance.EARTH, 15)
-_add_mapping_entry(31, Tl866Instance.EARTH, 16)
-_add_mapping_entry(35, Tl866Instance.EARTH, 17)
-_add_mapping_entry(39, Tl866Instance.EARTH, 18)
-_add_mapping_entry(43, Tl866Instance.EARTH, 19)
-_add_mapping_entry(47, Tl866Instance.EARTH, 20)
-_add_mapping_entry(45, Tl866Instance.EARTH, 21)
-_add_mapping_entry(41, Tl866Instance.EARTH, 22)
-_add_mapping_entry(37, Tl866Instance.EARTH, 23)
-_add_mapping_entry(33, Tl866Instance.EARTH, 24)
-_add_mapping_entry(29, Tl866Instance.EARTH, 25)
-_add_mapping_entry(79, Tl866Instance.EARTH, 26)
-_add_mapping_entry(77, Tl866Instance.EARTH, 27)
-_add_mapping_entry(21, Tl866Instance.EARTH, 28)
-_add_mapping_entry(19, Tl866Instance.EARTH, 29)
-_add_mapping_entry(17, Tl866Instance.EARTH, 30)
-_add_mapping_entry(15, Tl866Instance.EARTH, 31)
-_add_mapping_entry(13, Tl866Instance.EARTH, 32)
-_add_mapping_entry(11, Tl866Instance.EARTH, 33)
-_add_mapping_entry(65, Tl866Instance.EARTH, 34)
-_add_mapping_entry(63, Tl866Instance.EARTH, 35)
-_add_mapping_entry(61, Tl866Instance.EARTH, 36)
-_add_mapping_entry(59, Tl866Instance.EARTH, 37)
-_add_mapping_entry(57, Tl866Instance.EARTH, 38)
-_add_mapping_entry(53, Tl866Instance.EARTH, 39)
-_add_mapping_entry(49, Tl866Instance.EARTH, 40)
-_add_mapping_entry(97, Tl866Instance.WIND, 1)
-_add_mapping_entry(101, Tl866Instance.WIND, 2)
-_add_mapping_entry(105, Tl866Instance.WIND, 3)
-_add_mapping_entry(109, Tl866Instance.WIND, 4)
-_add_mapping_entry(113, Tl866Instance.WIND, 5)
-_add_mapping_entry(117, Tl866Instance.WIND, 6)
-_add_mapping_entry(121, Tl866Instance.WIND, 7)
-_add_mapping_entry(125, Tl866Instance.WIND, 8)
-_add_mapping_entry(129, Tl866Instance.WIND, 9)
-_add_mapping_entry(133, Tl866Instance.WIND, 10)
-_add_mapping_entry(135, Tl866Instance.WIND, 11)
-_add_mapping_entry(137, Tl866Instance.WIND, 12)
-_add_mapping_entry(139, Tl866Instance.WIND, 13)
-_add_mapping_entry(87, Tl866Instance.WIND, 14)
-_add_mapping_entry(89, Tl866Instance.WIND, 15)
-_add_mapping_entry(91, Tl866Instance.WIND, 16)
-_add_mapping_entry(93, Tl866Instance.WIND, 17)
-_add_mapping_entry(95, Tl866Instance.WIND, 18)
-_add_mapping_entry(153, Tl866Instance.WIND, 19)
-_add_mapping_entry(157, Tl866Instance.WIND, 20)
-_add_mapping_entry(159, Tl866Instance.WIND, 21)
-_add_mapping_entry(155, Tl866Instance.WIND, 22)
-_add_mapping_entry(151, Tl866Instance.WIND, 23)
-_add_mapping_entry(149, Tl866Instance.WIND, 24)
-_add_mapping_entry(147, Tl866Instance.WIND, 25)
-_add_mapping_entry(145, Tl866Instance.WIND, 26)
-_add_mapping_entry(143, Tl866Instance.WIND, 27)
-_add_mapping_entry(141, Tl866Instance.WIND, 28)
-_add_mapping_entry(85, Tl866Instance.WIND, 29)
-_add_mapping_entry(83, Tl866Instance.WIND, 30)
-_add_mapping_entry(81, Tl866Instance.WIND, 31)
-_add_mapping_entry(131, Tl866Instance.WIND, 32)
-_add_mapping_entry(127, Tl866Instance.WIND, 33)
-_add_mapping_entry(123, Tl866Instance.WIND, 34)
-_add_mapping_entry(119, Tl866Instance.WIND, 35)
-_add_mapping_entry(115, Tl866Instance.WIND, 36)
-_add_mapping_entry(111, Tl866Instance.WIND, 37)
-_add_mapping_entry(107, Tl866Instance.WIND, 38)
-_add_mapping_entry(103, Tl866Instance.WIND, 39)
-_add_mapping_entry(99, Tl866Instance.WIND, 40)
-_add_mapping_entry(48, Tl866Instance.FIRE, 1)
-_add_mapping_entry(44, Tl866Instance.FIRE, 2)
-_add_mapping_entry(40, Tl866Instance.FIRE, 3)
-_add_mapping_entry(36, Tl866Instance.FIRE, 4)
-_add_mapping_entry(32, Tl866Instance.FIRE, 5)
-_add_mapping_entry(28, Tl866Instance.FIRE, 6)
-_add_mapping_entry(26, Tl866Instance.FIRE, 7)
-_add_mapping_entry(24, Tl866Instance.FIRE, 8)
-_add_mapping_entry(76, Tl866Instance.FIRE, 9)
-_add_mapping_entry(74, Tl866Instance.FIRE, 10)
-_add_mapping_entry(72, Tl866Instance.FIRE, 11)
-_add_mapping_entry(70, Tl866Instance.FIRE, 12)
-_add_mapping_entry(68, Tl866Instance.FIRE, 13)
-_add_mapping_entry(10, Tl866Instance.FIRE, 14)
-_add_mapping_entry(8, Tl866Instance.FIRE, 15)
-_add_mapping_entry(6, Tl866Instance.FIRE, 16)
-_add_mapping_entry(4, Tl866Instance.FIRE, 17)
-_add_mapping_entry(2, Tl866Instance.FIRE, 18)
-_add_mapping_entry(56, Tl866Instance.FIRE, 19)
-_add_mapping_entry(52, Tl866Instance.FIRE, 20)
-_add_mapping_entry(50, Tl866Instance.FIRE, 21)
-_add_mapping_entry(54, Tl866Instance.FIRE, 22)
-_add_mapping_entry(58, Tl866Instance.FIRE, 23)
-_add_mapping_entry(60, Tl866Instance.FIRE, 24)
-_add_mapping_entry(62, Tl866Instance.FIRE, 25)
-_add_mapping_entry(64, Tl866Instance.FIRE, 26)
-_add_mapping_entry(66, Tl866Instance.FIRE, 27)
-_add_mapping_entry(12, Tl866Instance.FIRE, 28)
-_add_mapping_entry(14, Tl866Instance.FIRE, 29)
-_add_mapping_entry(16, Tl866Instance.FIRE, 30)
-_add_mapping_entry(18, Tl866Instance.FIRE, 31)
-_add_mapping_entry(20, Tl866Instance.FIRE, 32)
-_add_mapping_entry(22, Tl866Instance.FIRE, 33)
-_add_mapping_entry(78, Tl866Instance.FIRE, 34)
-_add_mapping_entry(80, Tl866Instance.FIRE, 35)
-_add_mapping_entry(30, Tl866Instance.FIRE, 36)
-_add_mapping_entry(34, Tl866Instance.FIRE, 37)
-_add_mapping_entry(38, Tl866Instance.FIRE, 38)
-_add_mapping_entry(42, Tl866Instance.FIRE, 39)
-_add_mapping_entry(46, Tl866Instance.FIRE, 40)
-_add_mapping_entry(158, Tl866Instance.WATER, 1)
-_add_mapping_entry(154, Tl866Instance.WATER, 2)
-_add_mapping_entry(96, Tl866Instance.WATER, 3)
-_add_mapping_entry(94, Tl866Instance.WATER, 4)
-_add_mapping_entry(92, Tl866Instance.WATER, 5)
-_add_mapping_entry(90, Tl866Instance.WATER, 6)
-_add_mapping_entry(88, Tl866Instance.WATER, 7)
-_add_mapping_entry(140, Tl866Instance.WATER, 8)
-_add_mapping_entry(138, Tl866Instance.WATER, 9)
-_add_mapping_entry(136, Tl866Instance.WATER, 10)
-_add_mapping_entry(134, Tl866Instance.WATER, 11)
-_add_mapping_entry(130, Tl866Instance.WATER, 12)
-_add_mapping_entry(126, Tl866Instance.WATER, 13)
-_add_mapping_entry(122, Tl866Instance.WATER, 14)
-_add_mapping_entry(118, Tl866Instance.WATER, 15)
-_add_mapping_entry(114, Tl866Instance.WATER, 16)
-_add_mapping_entry(110, Tl866Instance.WATER, 17)
-_add_mapping_entry(106, Tl866Instance.WATER, 18)
-_add_mapping_entry(102, Tl866Instance.WATER, 19)
-_add_mapping_entry(98, Tl866Instance.WATER, 20)
-_add_mapping_entry(100, Tl866Instance.WATER, 21)
-_add_mapping_entry(104, Tl866Instance.WATER, 22)
-_add_mapping_entry(108, Tl866Instance.WATER, 23)
-_add_mapping_entry(112, Tl866Instance.WATER, 24)
-_add_mapping_entry(116, Tl866Instance.WATER, 25)
-_add_mapping_entry(120, Tl866Instance.WATER, 26)
-_add_mapping_entry(124, Tl866Instance.WATER, 27)
-_add_mapping_entry(128, Tl866Instance.WATER, 28)
-_add_mapping_entry(132, Tl866Instance.WATER, 29)
-_add_mapping_entry(82, Tl866Instance.WATER, 30)
-_add_mapping_entry(84, Tl866Instance.WATER, 31)
-_add_mapping_entry(86, Tl866Instance.WATER, 32)
-_add_mapping_entry(142, Tl866Instance.WATER, 33)
-_add_mapping_entry(144, Tl866Instance.WATER, 34)
-_add_mapping_entry(146, Tl866Instance.WATER, 35)
-_add_mapping_entry(148, Tl866Instance.WATER, 36)
-_add_mapping_entry(150, Tl866Instance.WATER, 37)
-_add_mapping_entry(152, Tl866Instance.WATER, 38)
-_add_mapping_entry(156, Tl866Instance.WATER, 39)
-_add_mapping_entry(160, Tl866Instance.WATER, 40)
-
-all_earth_pins = []
-all_water_pins = []
-all_fire_pins = []
-all_wind_pins = []
-all_pins = []
-
-for k, v in pin2Tl866_map.items():
-    all_pins.append(k)
-    if v.instance == Tl866Instance.EARTH:
-        all_earth_pins.append(k)
-    elif v.instance == Tl866Instance.WATER:
-        all_water_pins.append(k)
-    elif v.instance == Tl866Instance.FIRE:
-        all_fire_pins.append(k)
-    elif v.instance == Tl866Instance.WIND:
-        all_wind_pins.append(k)
-    else:
-        raise Exception("WTF")
-
-all_earth_pins = frozenset(all_earth_pins)
-all_water_pins = frozenset(all_water_pins)
-all_fire_pins = frozenset(all_fire_pins)
-all_wind_pins = frozenset(all_wind_pins)
-all_pins = frozenset(all_pins)
 
 class GpioController:
     def __init__(
@@ -244,100 +258,603 @@ class GpioController:
         earth_serial_device: Optional[str] = None,
         fire_serial_device: Optional[str] = None,
         wind_serial_device: Optional[str] = None,
+        concurrent: bool = False,
+        cache_writes: bool = True,
+        backend: Callable[[str, Tl866Instance], Bitbang] = open_bitbang,
+        metrics: Optional["Metrics"] = None,
     ) -> None:
         self.bitbangers: List[Bitbang] = []
+        # One persistent worker thread per TL866 when running concurrently, so
+        # commands to different instances overlap instead of queueing. They are
+        # ThreadPoolExecutors, concurrent.futures is only imported for them.
+        self._workers: Optional[Dict[Bitbang, Any]] = None
+        # Last value sent per (controller, command), used to skip commands that
+        # would not change anything on that TL866
+        self._shadow: Optional[Dict[Tuple[Bitbang, str], int]] = (
+            {} if cache_writes else None
+        )
+        self.writes_issued = 0
+        self.writes_elided = 0
+        # The pin maps are shared and never change, which TL866 is which device
+        # is only known here, so several controllers can coexist in a process.
+        # instances is aligned with bitbangers, _by_index is indexed by
+        # Tl866Instance.value - 1 and None where no device was given.
+        self.instances: List[Tl866Instance] = []
+        self._by_index: List[Optional[Bitbang]] = [None] * len(_INSTANCES)
 
         def add_device(self, device: Optional[str], instance: Tl866Instance):
             if device is not None:
-                bb = Bitbang(device=device)
-                bb.instance = instance
-                bb.Tl866Pin2megaPin = Tl866Pin2megaPin_map[instance]
+                bb = backend(device, instance)
+                if metrics is not None:
+                    from metrics import InstrumentedBitbang
+
+                    bb = InstrumentedBitbang(bb, instance.name, metrics)
                 self.bitbangers.append(bb)
-                for value in pin2Tl866_map.values():
-                    if value.instance == instance:
-                        value.bitbanger = bb
+                self.instances.append(instance)
+                self._by_index[instance.value - 1] = bb
 
         add_device(self, water_serial_device, Tl866Instance.WATER)
         add_device(self, earth_serial_device, Tl866Instance.EARTH)
         add_device(self, fire_serial_device, Tl866Instance.FIRE)
         add_device(self, wind_serial_device, Tl866Instance.WIND)
 
+        if concurrent:
+            from concurrent.futures import ThreadPoolExecutor
+
+            self._workers = {
+                bb: ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix=f"tl866-{instance.name}"
+                )
+                for instance, bb in zip(self.instances, self.bitbangers)
+            }
+
     def __iter__(self) -> Iterator[Bitbang]:
         return iter(self.bitbangers)
 
+    def __enter__(self) -> "GpioController":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        if self._workers is not None:
+            for worker in self._workers.values():
+                worker.shutdown()
+            self._workers = None
+
+    def _run(
+        self, calls: List[Tuple[Bitbang, Callable, Tuple[Any, ...]]]
+    ) -> List[Any]:
+        """
+        Runs (controller, function, args) calls and returns their results in
+        order. In concurrent mode every call is handed to its controller's
+        worker and this returns once the slowest one has finished, also when
+        one of them raised, so nothing is still running when it returns.
+        """
+        if self._workers is None or len(calls) < 2:
+            return [function(*args) for _, function, args in calls]
+        from concurrent.futures import wait
+
+        futures = [
+            self._workers[c].submit(function, *args) for c, function, args in calls
+        ]
+        wait(futures)
+        return [future.result() for future in futures]
+
+    def _run_each(self, method: str, *args: Any) -> List[Any]:
+        return self._run(
+            [(controller, getattr(controller, method), args) for controller in self]
+        )
+
+    def _run_per_controller(self, method: str, val: int) -> List[Any]:
+        return self._run_cached(method, self._get_pins_per_controller(val))
+
+    def _run_cached(
+        self, method: str, val_per_controller: Dict[Bitbang, int]
+    ) -> List[Any]:
+        shadow = self._shadow
+        calls = []
+        for controller, val in val_per_controller.items():
+            if shadow is not None and shadow.get((controller, method)) == val:
+                self.writes_elided += 1
+            else:
+                calls.append((controller, getattr(controller, method), (val,)))
+        self.writes_issued += len(calls)
+        try:
+            results = self._run(calls)
+        except BaseException:
+            self._forget((controller, method) for controller, _, _ in calls)
+            raise
+        if shadow is not None:
+            for controller, _, (val,) in calls:
+                shadow[(controller, method)] = val
+        return results
+
+    def _forget(self, keys: Iterable[Tuple[Bitbang, str]]) -> None:
+        """
+        Drops the cached values of commands that failed. In concurrent mode the
+        other TL866s may have applied theirs, so what was sent is unknown.
+        """
+        if self._shadow is not None:
+            for key in keys:
+                self._shadow.pop(key, None)
+
+    def invalidate(self) -> None:
+        """Forgets the cached TL866 state so the next command of each kind is sent"""
+        if self._shadow is not None:
+            self._shadow.clear()
+
+    def resync(self) -> None:
+        """Re-sends all cached state, for when the hardware may have drifted"""
+        if self._shadow is None:
+            return
+        shadow = dict(self._shadow)
+        self._shadow.clear()
+        for method in _RESYNC_ORDER:
+            self._run_cached(
+                method,
+                {c: val for (c, m), val in shadow.items() if m == method},
+            )
+
+    def device_pins(self) -> int:
+        """Mask of the mega pins on the TL866s that have a device"""
+        res = 0
+        for instance in self.instances:
+            res |= pin_translator.merge(instance, TL866_ALL_PINS_MASK)
+        return res
+
     def _get_pins_per_controller(self, val: int) -> Dict[Bitbang, int]:
-        pins_per_tl866 = {}
-        for controller in self:
-            pins_per_tl866[controller] = 0
-        for i in range(0, MEGA866_HIGHEST_PIN_NUMBER):
-            if val & (1 << i):
-                if (i + 1) not in pin2Tl866_map:
-                    raise Exception(f"Pin {i + 1} is not valid")
-                elif pin2Tl866_map[i + 1].bitbanger is None:
-                    raise Exception(f"device for pin {i + 1} not given")
-                else:
-                    pins_per_tl866[pin2Tl866_map[i + 1].bitbanger] |= (
-                        1 << pin2Tl866_map[i + 1].pin - 1
-                    )
+        pins_per_tl866 = dict.fromkeys(self.bitbangers, 0)
+        for instance, controller, mask in zip(
+            _INSTANCES, self._by_index, split_mask(val)
+        ):
+            if mask:
+                if controller is None:
+                    _missing_device(instance, mask)
+                pins_per_tl866[controller] = mask
         return pins_per_tl866
 
+    def _owners(
+        self, val: int, skip_missing: bool = False
+    ) -> List[Tuple[Tl866Instance, Bitbang]]:
+        """(instance, controller) of each TL866 owning pins in val"""
+        owners = []
+        for instance, controller, mask in zip(
+            _INSTANCES, self._by_index, split_mask(val)
+        ):
+            if mask:
+                if controller is not None:
+                    owners.append((instance, controller))
+                elif not skip_missing:
+                    _missing_device(instance, mask)
+        return owners
+
+    def _merge_reads(self, reads: List[int]) -> int:
+        res = 0
+        for instance, pins in zip(self.instances, reads):
+            res |= pin_translator.merge(instance, pins)
+        return res
+
     def vdd_en(self, enable: bool = True) -> None:
-        for controller in self:
-            controller.vdd_en()
+        self._run_each("vdd_en")
 
     def vdd_volt(self, val: int) -> None:
-        for controller in self:
-            controller.vdd_volt(val)
+        self._run_cached("vdd_volt", {controller: val for controller in self})
 
     def vdd_pins(self, val: int) -> None:
-        for controller, val in self._get_pins_per_controller(val).items():
-            controller.vdd_pins(val)
+        self._run_per_controller("vdd_pins", val)
 
     def vpp_en(self, enable: bool = True) -> None:
-        for controller in self:
-            controller.vpp_en()
+        self._run_each("vpp_en")
 
     def vpp_volt(self, val: int) -> None:
-        for controller in self:
-            controller.vpp_volt(val)
+        self._run_cached("vpp_volt", {controller: val for controller in self})
 
     def vpp_pins(self, val: int) -> None:
-        for controller, val in self._get_pins_per_controller(val).items():
-            controller.vpp_pins(val)
+        self._run_per_controller("vpp_pins", val)
 
     def gnd_pins(self, val: int) -> None:
-        for controller, val in self._get_pins_per_controller(val).items():
-            controller.gnd_pins(val)
+        self._run_per_controller("gnd_pins", val)
 
     def io_tri(self, val: int = int("ff" * 5 * 4, base=16)):
-        for controller, val in self._get_pins_per_controller(val).items():
-            controller.io_tri(val)
+        self._run_per_controller("io_tri", val)
 
     def io_trir(self, val: int = int("ff" * 5 * 4, base=16)) -> int:
-        res = 0
-        for controller in self:
-            pins = controller.io_trir()
-            for i in range(0, TL866_HIGHEST_PIN_NUMBER):
-                if pins & (1 << i):
-                    res |= 1 << (controller.Tl866Pin2megaPin[i + 1] - 1)
-        return res
+        return self._merge_reads(self._run_each("io_trir"))
 
     def io_w(self, val: int) -> None:
-        for controller, val in self._get_pins_per_controller(val).items():
-            controller.io_w(val)
+        self._run_per_controller("io_w", val)
 
     def io_r(self, val: int = int("ff" * 5 * 4, base=16)) -> int:
-        res = 0
-        for controller in self:
-            pins = controller.io_r()
-            for i in range(0, TL866_HIGHEST_PIN_NUMBER):
-                if pins & (1 << i):
-                    res |= 1 << (controller.Tl866Pin2megaPin[i + 1] - 1)
-        return res
+        return self._merge_reads(self._run_each("io_r"))
 
     def init(self) -> None:
-        for controller in self:
-            controller.init()
+        self._run_each("init")
+        self.invalidate()
+
+    def _poll(
+        self,
+        mask: int,
+        done: Callable[[int], bool],
+        timeout: float,
+        start: Optional[float] = None,
+    ) -> Tuple[int, float]:
+        """
+        Reads the instances owning pins in mask until done(sample & mask), with
+        adaptive backoff. Returns the sample, which only holds pins of those
+        instances, and the seconds since start.
+        """
+        owners = self._owners(mask)
+        calls = [(c, c.io_r, ()) for _, c in owners]
+        if start is None:
+            start = monotonic()
+        deadline = start + timeout
+        interval = WAIT_MIN_INTERVAL
+        polls = 0
+        while True:
+            sample = 0
+            for (instance, _), pins in zip(owners, self._run(calls)):
+                sample |= pin_translator.merge(instance, pins)
+            now = monotonic()
+            if done(sample & mask):
+                return sample, now - start
+            if now >= deadline:
+                raise Exception(f"timed out after {timeout} s waiting on {mask:#x}")
+            polls += 1
+            if polls >= WAIT_SPIN_POLLS:
+                sleep(min(interval, deadline - now))
+                interval = min(interval * 2, WAIT_MAX_INTERVAL)
+
+    def wait_for(
+        self, mask: int, value: int, timeout: float = 1.0
+    ) -> Tuple[int, float]:
+        """
+        Waits until the pins in mask read as value. Returns the matching sample
+        and the seconds it took, raises if timeout passes first.
+        """
+        value &= mask
+        return self._poll(mask, lambda levels: levels == value, timeout)
+
+    def wait_for_change(self, mask: int, timeout: float = 1.0) -> Tuple[int, float]:
+        """Waits until any pin in mask reads different from when it was called"""
+        start = monotonic()
+        initial, _ = self._poll(mask, lambda levels: True, timeout, start)
+        initial &= mask
+        return self._poll(mask, lambda levels: levels != initial, timeout, start)
+
+    def wait_for_rising(self, mask: int, timeout: float = 1.0) -> Tuple[int, float]:
+        """Waits until the pins in mask have all been low and then all high"""
+        start = monotonic()
+        self._poll(mask, lambda levels: levels == 0, timeout, start)
+        return self._poll(mask, lambda levels: levels == mask, timeout, start)
+
+    def wait_for_falling(self, mask: int, timeout: float = 1.0) -> Tuple[int, float]:
+        """Waits until the pins in mask have all been high and then all low"""
+        start = monotonic()
+        self._poll(mask, lambda levels: levels == mask, timeout, start)
+        return self._poll(mask, lambda levels: levels == 0, timeout, start)
+
+    def transaction(self, reorder: bool = False) -> "Transaction":
+        return Transaction(self, reorder)
+
+    def compile_waveform(
+        self,
+        steps: Iterable[Tuple[int, Optional[int], bool]],
+        sample_mask: int = int("ff" * 5 * 4, base=16),
+    ) -> "Waveform":
+        return Waveform(self, steps, sample_mask)
+
+    def play(self, waveform: "Waveform", repeat: int = 1) -> bytearray:
+        """
+        Plays waveform repeat times back to back. Returns the samples packed
+        MEGA866_MASK_BYTES each, little endian, see Waveform.unpack().
+        """
+        if waveform.controller is not self:
+            raise Exception("waveform was compiled for another controller")
+        raw: List[Tuple[int, Tl866Instance, int]] = []
+        run = self._run
+        try:
+            for rep in range(repeat):
+                phases = waveform.first if rep == 0 else waveform.steady
+                base = rep * waveform.n_samples
+                for calls, reads in phases:
+                    results = run(calls)
+                    for position, index, instance in reads:
+                        raw.append((base + index, instance, results[position]))
+        except BaseException:
+            self._forget(waveform.final_state)
+            raise
+
+        samples = [0] * (waveform.n_samples * repeat)
+        for index, instance, value in raw:
+            samples[index] |= pin_translator.merge(instance, value)
+        packed = bytearray()
+        for sample in samples:
+            packed += sample.to_bytes(MEGA866_MASK_BYTES, "little")
+
+        if repeat:
+            self.writes_issued += waveform.first_writes
+            self.writes_issued += waveform.steady_writes * (repeat - 1)
+            if self._shadow is not None:
+                self._shadow.update(waveform.final_state)
+        return packed
+
+
+def _missing_device(instance: Tl866Instance, mask: int) -> None:
+    mega_pin = pin_translator.merge(instance, mask & -mask).bit_length()
+    raise Exception(f"device for pin {mega_pin} not given")
+
+
+def _play_steps(
+    controller: Bitbang, steps: List[Tuple[str, Any]]
+) -> List[Tuple[Any, int]]:
+    reads = []
+    for method, arg in steps:
+        if method == "delay":
+            sleep(arg)
+        elif method == "io_r":
+            reads.append((arg, controller.io_r()))
+        else:
+            getattr(controller, method)(arg)
+    return reads
+
+
+class Transaction:
+    """
+    Queues io_tri/io_w/io_r/delay steps in mega pin space and applies them in
+    one go with flush(), which returns the io_r samples in order.
+
+    A step is dropped for an instance whose slice of the mask is the same as
+    the last value it was sent, either earlier in the transaction or, with
+    cache_writes, by the controller itself. io_r only reads the instances
+    owning pins in its mask.
+
+    Steps take effect in the order they were queued. In concurrent mode the
+    commands of one step go to the TL866s in parallel, and consecutive steps
+    for a single TL866 run back to back on its worker. With reorder each
+    instance's steps run back to back on its own worker, which saves round
+    trips, but ordering between different instances is then only guaranteed
+    at flush boundaries.
+    """
+
+    def __init__(self, controller: GpioController, reorder: bool = False) -> None:
+        self._controller = controller
+        self._reorder = reorder
+        self._steps: List[Tuple[str, Any]] = []
+        self._n_reads = 0
+        self._last_sent: Dict[Tuple[Bitbang, str], int] = {}
+        self.results: List[int] = []
+
+    def __enter__(self) -> "Transaction":
+        return self
+
+    def __exit__(self, exc_type: Any, *exc_info: Any) -> None:
+        if exc_type is None:
+            self.flush()
+
+    def io_tri(self, val: int = int("ff" * 5 * 4, base=16)) -> None:
+        self._steps.append(("io_tri", val))
+
+    def io_w(self, val: int) -> None:
+        self._steps.append(("io_w", val))
+
+    def io_r(self, val: int = int("ff" * 5 * 4, base=16)) -> int:
+        """Queues a read and returns its index in the list flush() returns"""
+        self._steps.append(("io_r", val))
+        self._n_reads += 1
+        return self._n_reads - 1
+
+    def delay(self, seconds: float) -> None:
+        self._steps.append(("delay", seconds))
+
+    def _compile(self) -> List[List[Tuple[Optional[Bitbang], str, Any]]]:
+        """The commands of each step, a delay's controller is None"""
+        steps: List[List[Tuple[Optional[Bitbang], str, Any]]] = []
+        last_sent = self._last_sent
+        read_index = 0
+        for method, val in self._steps:
+            commands: List[Tuple[Optional[Bitbang], str, Any]] = []
+            steps.append(commands)
+            if method == "delay":
+                commands.append((None, method, val))
+                continue
+            if method == "io_r":
+                # Reads just skip instances without a device, like io_r()
+                for instance, controller in self._controller._owners(val, True):
+                    commands.append((controller, method, (read_index, instance)))
+                read_index += 1
+                continue
+            pins_per_tl866 = self._controller._get_pins_per_controller(val)
+            for controller, pins in pins_per_tl866.items():
+                if last_sent.get((controller, method)) != pins:
+                    last_sent[(controller, method)] = pins
+                    commands.append((controller, method, pins))
+                    self._controller.writes_issued += 1
+                else:
+                    self._controller.writes_elided += 1
+        return steps
+
+    def flush(self) -> List[int]:
+        shadow = self._controller._shadow
+        self._last_sent = dict(shadow) if shadow is not None else {}
+        steps = self._compile()
+        results = [0] * self._n_reads
+        self._steps = []
+        self._n_reads = 0
+
+        try:
+            if self._controller._workers is None:
+                reads = self._execute_serial(steps)
+            elif self._reorder:
+                reads = self._execute_reordered(steps)
+            else:
+                reads = self._execute_ordered(steps)
+        except BaseException:
+            self._controller._forget(
+                (controller, method)
+                for commands in steps
+                for controller, method, _ in commands
+                if controller is not None
+            )
+            raise
+        for (index, instance), value in reads:
+            results[index] |= pin_translator.merge(instance, value)
+        if shadow is not None:
+            shadow.update(self._last_sent)
+        self.results = results
+        return results
+
+    # The _execute_*() send the compiled steps and return the reads as
+    # ((sample index, instance), value)
+
+    def _execute_serial(
+        self, steps: List[List[Tuple[Optional[Bitbang], str, Any]]]
+    ) -> List[Tuple[Tuple[int, Tl866Instance], int]]:
+        reads = []
+        for commands in steps:
+            for controller, method, arg in commands:
+                if controller is None:
+                    sleep(arg)
+                elif method == "io_r":
+                    reads.append((arg, controller.io_r()))
+                else:
+                    getattr(controller, method)(arg)
+        return reads
+
+    def _execute_ordered(
+        self, steps: List[List[Tuple[Optional[Bitbang], str, Any]]]
+    ) -> List[Tuple[Tuple[int, Tl866Instance], int]]:
+        # Each phase waits for the one before. Its commands run in parallel, at
+        # most one list per TL866, or for None on the calling thread.
+        phases: List[Dict[Optional[Bitbang], List[Tuple[str, Any]]]] = []
+        for commands in steps:
+            if not commands:
+                continue
+            last = phases[-1] if phases else None
+            controller, method, arg = commands[0]
+            if controller is None:
+                # A delay after a phase runs on its workers, after their
+                # commands, so the next step still starts arg after all of them
+                if last is None:
+                    phases.append({None: [(method, arg)]})
+                else:
+                    for phase_steps in last.values():
+                        phase_steps.append((method, arg))
+            elif (
+                len(commands) == 1
+                and last is not None
+                and list(last) == [controller]
+            ):
+                # Its worker runs the steps of a single TL866 in order anyway
+                last[controller].append((method, arg))
+            else:
+                phases.append({c: [(m, a)] for c, m, a in commands})
+
+        reads = []
+        run = self._controller._run
+        for phase in phases:
+            calls = [(c, _play_steps, (c, cs)) for c, cs in phase.items()]
+            for phase_reads in run(calls):
+                reads.extend(phase_reads)
+        return reads
+
+    def _execute_reordered(
+        self, steps: List[List[Tuple[Optional[Bitbang], str, Any]]]
+    ) -> List[Tuple[Tuple[int, Tl866Instance], int]]:
+        steps_per_tl866: Dict[Bitbang, List[Tuple[str, Any]]] = {
+            controller: [] for controller in self._controller
+        }
+        for commands in steps:
+            for controller, method, arg in commands:
+                targets = steps_per_tl866 if controller is None else [controller]
+                for target in targets:
+                    steps_per_tl866[target].append((method, arg))
+        active = [(c, steps) for c, steps in steps_per_tl866.items() if steps]
+        reads = []
+        for controller_reads in self._controller._run(
+            [(c, _play_steps, (c, steps)) for c, steps in active]
+        ):
+            reads.extend(controller_reads)
+        return reads
+
+
+# The calls of one step that may run in parallel, one per TL866, and for reads
+# (position in the calls, sample index, instance)
+_WaveformPhase = Tuple[
+    List[Tuple[Bitbang, Callable, Tuple[Any, ...]]],
+    List[Tuple[int, int, Tl866Instance]],
+]
+
+
+class Waveform:
+    """
+    (drive, tri, sample) steps in mega pin space compiled once to the commands
+    each TL866 needs, for GpioController.play(). tri may be None to leave it
+    as it is. Each step sets the outputs before the tri-state, and steps with
+    sample set read the pins in sample_mask after both.
+
+    Commands that would resend a TL866's current value are dropped. first is
+    the command list for the first pass, steady the one for every later pass,
+    which starts from the state the previous pass left behind. In concurrent
+    mode the commands of one step go to the TL866s in parallel, but steps stay
+    in order.
+    """
+
+    def __init__(
+        self,
+        controller: GpioController,
+        steps: Iterable[Tuple[int, Optional[int], bool]],
+        sample_mask: int,
+    ) -> None:
+        self.controller = controller
+        self.steps = list(steps)
+        self.n_samples = sum(1 for _, _, sample in self.steps if sample)
+        # (instance, controller) of the TL866s a sample reads
+        self.readers = controller._owners(sample_mask, skip_missing=True)
+        first_state: Dict[Tuple[Bitbang, str], int] = {}
+        self.first, self.first_writes = self._compile(first_state)
+        self.final_state = dict(first_state)
+        self.steady, self.steady_writes = self._compile(first_state)
+
+    def _compile(
+        self, last_sent: Dict[Tuple[Bitbang, str], int]
+    ) -> Tuple[List[_WaveformPhase], int]:
+        phases: List[_WaveformPhase] = []
+        writes = 0
+        sample_index = 0
+        for drive, tri, sample in self.steps:
+            for method, val in (("io_w", drive), ("io_tri", tri)):
+                if val is None:
+                    continue
+                calls = []
+                pins_per_tl866 = self.controller._get_pins_per_controller(val)
+                for controller, pins in pins_per_tl866.items():
+                    if last_sent.get((controller, method)) != pins:
+                        last_sent[(controller, method)] = pins
+                        function = getattr(controller, method)
+                        calls.append((controller, function, (pins,)))
+                if calls:
+                    phases.append((calls, []))
+                    writes += len(calls)
+            if sample:
+                phases.append(
+                    (
+                        [(c, c.io_r, ()) for _, c in self.readers],
+                        [
+                            (i, sample_index, instance)
+                            for i, (instance, _) in enumerate(self.readers)
+                        ],
+                    )
+                )
+                sample_index += 1
+        return phases, writes
+
+    def unpack(self, packed: bytes) -> List[int]:
+        return [
+            int.from_bytes(packed[i : i + MEGA866_MASK_BYTES], "little")
+            for i in range(0, len(packed), MEGA866_MASK_BYTES)
+        ]
 
 
 def debug_print_pins(pins: int):
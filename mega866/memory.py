@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+
+"""
+Flat memory for host emulated address spaces, e.g. a 6502's 64 KiB.
+
+Reads and writes index straight into a bytearray, or into an mmap of an image
+file when the memory should persist between runs. I/O is routed per 256 byte
+page. A page with a handler sends every access in it to that handler, and all
+other pages are plain memory.
+"""
+
+import mmap
+import os
+from typing import Callable, List, Optional, Union
+
+PAGE_SHIFT = 8
+PAGE_SIZE = 1 << PAGE_SHIFT
+
+ReadHandler = Callable[[int], int]
+WriteHandler = Callable[[int, int], None]
+
+
+class Memory:
+    def __init__(
+        self, size: int = 0x10000, image_path: Optional[str] = None
+    ) -> None:
+        """
+        With image_path the memory is an mmap of that file, created or resized
+        to size bytes as needed, so its contents survive the process.
+        """
+        if size % PAGE_SIZE:
+            raise Exception(f"size {size:#x} is not a whole number of pages")
+        self.size = size
+        self._file = None
+        self.data: Union[bytearray, mmap.mmap]
+        if image_path is None:
+            self.data = bytearray(size)
+        else:
+            fd = os.open(image_path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._file = os.fdopen(fd, "r+b")
+            if os.fstat(fd).st_size != size:
+                self._file.truncate(size)
+            self.data = mmap.mmap(fd, size)
+
+        n_pages = size >> PAGE_SHIFT
+        self._read_handlers: List[Optional[ReadHandler]] = [None] * n_pages
+        self._write_handlers: List[Optional[WriteHandler]] = [None] * n_pages
+
+    def close(self) -> None:
+        if self._file is not None:
+            self.data.flush()
+            self.data.close()
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> "Memory":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def map_io(
+        self,
+        start: int,
+        end: int,
+        read: Optional[ReadHandler] = None,
+        write: Optional[WriteHandler] = None,
+    ) -> None:
+        """
+        Routes the pages covering [start, end] to the handlers. The handlers get
+        every access to those pages and can fall back to self.data for
+        addresses they do not care about.
+        """
+        for page in range(start >> PAGE_SHIFT, (end >> PAGE_SHIFT) + 1):
+            if read is not None:
+                self._read_handlers[page] = read
+            if write is not None:
+                self._write_handlers[page] = write
+
+    def unmap_io(self, start: int, end: int) -> None:
+        for page in range(start >> PAGE_SHIFT, (end >> PAGE_SHIFT) + 1):
+            self._read_handlers[page] = None
+            self._write_handlers[page] = None
+
+    def read(self, address: int) -> int:
+        handler = self._read_handlers[address >> PAGE_SHIFT]
+        if handler is None:
+            return self.data[address]
+        return handler(address)
+
+    def write(self, address: int, value: int) -> None:
+        handler = self._write_handlers[address >> PAGE_SHIFT]
+        if handler is None:
+            self.data[address] = value
+        else:
+            handler(address, value)
+
+    def load_binary(self, path: str, offset: int = 0) -> int:
+        """Copies a raw image to offset, returns the number of bytes loaded"""
+        with open(path, "rb") as f:
+            image = f.read()
+        if offset + len(image) > self.size:
+            raise Exception(f"{path} does not fit at {offset:#x}")
+        self.data[offset : offset + len(image)] = image
+        return len(image)
+
+    def load_hex(self, path: str) -> int:
+        """Loads an Intel HEX file, returns the number of data bytes loaded"""
+        loaded = 0
+        base = 0
+        with open(path) as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                record = bytes.fromhex(line[1:]) if line[0] == ":" else b""
+                if len(record) < 5 or len(record) != record[0] + 5:
+                    raise Exception(f"{path}:{line_number}: bad record")
+                if sum(record) & 0xFF:
+                    raise Exception(f"{path}:{line_number}: bad checksum")
+                count, record_type = record[0], record[3]
+                payload = record[4 : 4 + count]
+                if record_type == 0x00:
+                    address = base + (record[1] << 8 | record[2])
+                    if address + count > self.size:
+                        raise Exception(
+                            f"{path}:{line_number}: {address:#x} out of range"
+                        )
+                    self.data[address : address + count] = payload
+                    loaded += count
+                elif record_type == 0x01:
+                    break
+                elif record_type == 0x02:
+                    base = int.from_bytes(payload, "big") << 4
+                elif record_type == 0x04:
+                    base = int.from_bytes(payload, "big") << 16
+        return loaded
+
+    def snapshot(self, path: str) -> None:
+        """Writes the current contents to path as a raw image"""
+        with open(path, "wb") as f:
+            f.write(self.data[:])
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+
+"""
+Opt-in latency and throughput metrics for the TL866 command stream.
+
+Pass a Metrics to GpioController and every Bitbang call it makes is timed
+per instance and per command:
+
+    metrics = Metrics(summary_interval=10, on_summary=print_summary)
+    controller = GpioController(earth_serial_device=..., metrics=metrics)
+    ...
+    metrics.cycle()  # once per bus cycle, for cycles/s
+    print(metrics.to_json())
+
+Without a Metrics the controller talks to the Bitbang objects directly, so the
+disabled case costs nothing.
+"""
+
+import json
+import time
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional
+
+from gpio_controller import BitbangProxy
+
+# Payload bytes each command moves, not counting the serial protocol framing
+COMMAND_PAYLOAD_BYTES: Dict[str, int] = {
+    "io_w": 5,
+    "io_r": 5,
+    "io_tri": 5,
+    "io_trir": 5,
+    "vdd_pins": 5,
+    "vpp_pins": 5,
+    "gnd_pins": 5,
+    "vdd_volt": 1,
+    "vpp_volt": 1,
+    "vdd_en": 1,
+    "vpp_en": 1,
+}
+
+
+def _bucket(ns: int) -> int:
+    # Four buckets per power of two, so percentiles are good to about 25%
+    if ns < 4:
+        return ns
+    shift = ns.bit_length() - 3
+    return (shift << 2) + (ns >> shift)
+
+
+def _bucket_bounds(bucket: int) -> List[int]:
+    """Returns [lowest, highest] ns value that lands in bucket"""
+    if bucket < 4:
+        return [bucket, bucket]
+    shift = (bucket >> 2) - 1
+    mantissa = (bucket & 3) + 4
+    return [mantissa << shift, ((mantissa + 1) << shift) - 1]
+
+
+class LatencyHistogram:
+    def __init__(self) -> None:
+        self.count = 0
+        self.total_ns = 0
+        self.min_ns: Optional[int] = None
+        self.max_ns = 0
+        self.bytes = 0
+        self.buckets: Dict[int, int] = {}
+
+    def record(self, ns: int, n_bytes: int = 0) -> None:
+        self.count += 1
+        self.total_ns += ns
+        self.bytes += n_bytes
+        if self.min_ns is None or ns < self.min_ns:
+            self.min_ns = ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+        bucket = _bucket(ns)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def percentile(self, fraction: float) -> int:
+        """Upper bound, in ns, of the bucket holding the given fraction of calls"""
+        if not self.count:
+            return 0
+        wanted = fraction * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= wanted:
+                return min(_bucket_bounds(bucket)[1], self.max_ns)
+        return self.max_ns
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "bytes": self.bytes,
+            "total_s": self.total_ns / 1e9,
+            "mean_us": self.total_ns / self.count / 1e3 if self.count else 0.0,
+            "min_us": (self.min_ns or 0) / 1e3,
+            "p50_us": self.percentile(0.5) / 1e3,
+            "p99_us": self.percentile(0.99) / 1e3,
+            "max_us": self.max_ns / 1e3,
+            "histogram_ns": [
+                _bucket_bounds(bucket) + [self.buckets[bucket]]
+                for bucket in sorted(self.buckets)
+            ],
+        }
+
+
+class Metrics:
+    def __init__(
+        self,
+        summary_interval: Optional[float] = None,
+        on_summary: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ) -> None:
+        """
+        With summary_interval (seconds) set, on_summary gets a snapshot() about
+        that often, from whichever thread records at the time.
+        """
+        self.summary_interval = summary_interval
+        self.on_summary = on_summary
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.histograms: Dict[str, Dict[str, LatencyHistogram]] = {}
+            self.cycles = 0
+            self._start = time.monotonic()
+            self._window_start = self._start
+            self._window_cycles = 0
+            self._next_summary = (
+                self._start + self.summary_interval
+                if self.summary_interval is not None
+                else None
+            )
+
+    def record(self, instance: str, command: str, ns: int) -> None:
+        with self._lock:
+            per_instance = self.histograms.setdefault(instance, {})
+            histogram = per_instance.get(command)
+            if histogram is None:
+                histogram = per_instance[command] = LatencyHistogram()
+            histogram.record(ns, COMMAND_PAYLOAD_BYTES.get(command, 0))
+        self._maybe_summarize()
+
+    def cycle(self, n: int = 1) -> None:
+        """Counts bus cycles, for the cycles per second figures"""
+        self.cycles += n
+        self._maybe_summarize()
+
+    def _maybe_summarize(self) -> None:
+        if self._next_summary is None or time.monotonic() < self._next_summary:
+            return
+        snapshot = self.snapshot()
+        with self._lock:
+            self._next_summary = time.monotonic() + self.summary_interval
+            self._window_start = time.monotonic()
+            self._window_cycles = self.cycles
+        if self.on_summary is not None:
+            self.on_summary(snapshot)
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._lock:
+            elapsed = now - self._start
+            window = now - self._window_start
+            return {
+                "elapsed_s": elapsed,
+                "cycles": self.cycles,
+                "cycles_per_second": self.cycles / elapsed if elapsed else 0.0,
+                "recent_cycles_per_second": (
+                    (self.cycles - self._window_cycles) / window if window else 0.0
+                ),
+                "instances": {
+                    instance: {
+                        command: histogram.snapshot()
+                        for command, histogram in sorted(commands.items())
+                    }
+                    for instance, commands in sorted(self.histograms.items())
+                },
+            }
+
+    def to_json(self, **kwargs: Any) -> str:
+        return json.dumps(self.snapshot(), **kwargs)
+
+
+def print_summary(snapshot: Dict[str, Any]) -> None:
+    print(
+        f"{snapshot['cycles']} cycles in {snapshot['elapsed_s']:.1f} s, "
+        f"{snapshot['cycles_per_second']:.1f} cycles/s "
+        f"({snapshot['recent_cycles_per_second']:.1f} recently)"
+    )
+    for instance, commands in snapshot["instances"].items():
+        for command, stats in commands.items():
+            print(
+                f"  {instance:<6} {command:<9} {stats['count']:>9} calls "
+                f"p50 {stats['p50_us']:>9.1f} us  p99 {stats['p99_us']:>9.1f} us"
+            )
+
+
+class InstrumentedBitbang(BitbangProxy):
+    """Wraps a Bitbang so every method call is timed into a Metrics"""
+
+    def __init__(self, bitbang: Any, instance: str, metrics: Metrics) -> None:
+        super().__init__(bitbang)
+        self._instance = instance
+        self._metrics = metrics
+
+    def _wrap(self, name: str, method: Callable) -> Optional[Callable]:
+        record = self._metrics.record
+        instance = self._instance
+
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            start = time.perf_counter_ns()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                record(instance, name, time.perf_counter_ns() - start)
+
+        return timed
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+"""
+PinMask: an immutable mega pin mask that carries its per instance slices.
+
+A PinMask is an int, so it works anywhere a mask does, but it splits itself
+into the four 40 bit TL866 masks once, when it is created. GpioController and
+Transaction use those slices directly instead of translating the mask on
+every call, so a constant mask costs nothing per cycle:
+
+    CONTROL = PinMask.from_pins(3, 7, 49)
+    controller.io_w(CONTROL | data)
+
+|, &, ^, ~ and difference() between PinMasks combine the slices directly.
+Mixing in a plain int mask returns a PinMask too, after translating the int
+once. Arithmetic stays plain int arithmetic.
+"""
+
+from typing import Any, Iterator, Tuple
+
+from adapter import Adapter, PackagePin
+from gpio_controller import (
+    MEGA866_HIGHEST_PIN_NUMBER,
+    Tl866Instance,
+    pin2Tl866_map,
+    pin_translator,
+)
+
+_ALL_PINS = (1 << MEGA866_HIGHEST_PIN_NUMBER) - 1
+
+
+class PinMask(int):
+    instance_masks: Tuple[int, ...]
+
+    def __new__(cls, value: int = 0) -> "PinMask":
+        self = super().__new__(cls, value)
+        masks = getattr(value, "instance_masks", None)
+        self.instance_masks = masks if masks is not None else pin_translator.split(value)
+        return self
+
+    @classmethod
+    def _from_slices(cls, value: int, instance_masks: Tuple[int, ...]) -> "PinMask":
+        self = super().__new__(cls, value)
+        self.instance_masks = instance_masks
+        return self
+
+    @classmethod
+    def from_pins(cls, *mega_pins: int) -> "PinMask":
+        value = 0
+        for mega_pin in mega_pins:
+            if mega_pin not in pin2Tl866_map:
+                raise Exception(f"Pin {mega_pin} is not valid")
+            value |= 1 << (mega_pin - 1)
+        return cls(value)
+
+    @classmethod
+    def from_adapter(cls, adapter: Adapter, *package_pins: PackagePin) -> "PinMask":
+        return cls(adapter.pins(*package_pins))
+
+    def __repr__(self) -> str:
+        return f"PinMask.from_pins({', '.join(str(p) for p in self.pins())})"
+
+    def __contains__(self, mega_pin: int) -> bool:
+        return bool(self >> (mega_pin - 1) & 1)
+
+    def __len__(self) -> int:
+        return bin(self).count("1")
+
+    def pins(self) -> Iterator[int]:
+        """The mega pins in the mask, lowest first"""
+        val = int(self)
+        while val:
+            yield (val & -val).bit_length()
+            val &= val - 1
+
+    def for_instance(self, instance: Tl866Instance) -> int:
+        return self.instance_masks[instance.value - 1]
+
+    def _combine(self, other: Any, op: Any) -> Any:
+        if not isinstance(other, int):
+            return NotImplemented
+        other_masks = getattr(other, "instance_masks", None)
+        if other_masks is None:
+            if other < 0 or other >> MEGA866_HIGHEST_PIN_NUMBER:
+                # Plain integer arithmetic, e.g. x & -x, not a mask
+                return op(int(self), int(other))
+            other_masks = pin_translator.split(other)
+        return PinMask._from_slices(
+            op(int(self), int(other)),
+            tuple(op(a, b) for a, b in zip(self.instance_masks, other_masks)),
+        )
+
+    def __or__(self, other: Any) -> "PinMask":
+        return self._combine(other, int.__or__)
+
+    __ror__ = __or__
+
+    def __and__(self, other: Any) -> "PinMask":
+        return self._combine(other, int.__and__)
+
+    __rand__ = __and__
+
+    def __xor__(self, other: Any) -> "PinMask":
+        return self._combine(other, int.__xor__)
+
+    __rxor__ = __xor__
+
+    def difference(self, other: int) -> "PinMask":
+        """The pins in self but not in other"""
+        return self._combine(other, lambda a, b: a & ~b)
+
+    def __invert__(self) -> "PinMask":
+        """The complement within the 160 mega pins"""
+        return PinMask(_ALL_PINS & ~int(self))
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+"""
+A BoardDaemon over a concurrent controller, with batches that write one TL866
+and read another.
+
+Run it from this directory with python3 -m unittest test_board_daemon, or
+directly.
+"""
+
+import os
+import tempfile
+import threading
+import unittest
+
+from board_daemon import BoardDaemon, RemoteGpioController
+from test_transaction import SINK_PIN, SOURCE_PIN, loopback_controller, pin
+
+
+class BoardDaemonTest(unittest.TestCase):
+    def test_write_then_read_other_instance(self) -> None:
+        levels = [i % 2 for i in range(100)]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "mega866.sock")
+            with loopback_controller(concurrent=True) as controller, BoardDaemon(
+                controller, path
+            ) as daemon:
+                thread = threading.Thread(target=daemon.serve_forever, daemon=True)
+                thread.start()
+                try:
+                    with RemoteGpioController(path) as remote:
+                        with remote.transaction() as t:
+                            for level in levels:
+                                t.io_w(pin(SOURCE_PIN) if level else 0)
+                                t.io_r(pin(SINK_PIN))
+                finally:
+                    daemon.shutdown()
+                    thread.join()
+        self.assertEqual([int(bool(r)) for r in t.results], levels)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+
+"""
+BoardPool on simulated boards, with a vector job that drives one TL866 and
+checks another.
+
+Run it from this directory with python3 -m unittest test_board_pool, or
+directly.
+"""
+
+import os
+import tempfile
+import unittest
+
+from board_pool import BoardPool, simulated_boards
+from test_vectors import LOOPBACK_VECTORS
+
+
+class BoardPoolTest(unittest.TestCase):
+    def test_cross_instance_vector_job(self) -> None:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "loopback.vec")
+            with open(path, "w") as f:
+                f.write("\n".join(LOOPBACK_VECTORS) + "\n")
+            with BoardPool(
+                simulated_boards(2),
+                simulate=True,
+                dut="test_transaction:Loopback",
+                latency=0.0002,
+            ) as pool:
+                results = pool.run([{"kind": "vectors", "path": path}] * 4)
+        for result in results:
+            self.assertTrue(result.ok, result.error)
+            self.assertEqual(result.result["vectors"], 200)
+            self.assertEqual(result.result["mismatches"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
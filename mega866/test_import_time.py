@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+
+"""
+Import time budget for the modules tools load only for the pin tables.
+
+Each import runs in a fresh interpreter, so nothing is cached from an earlier
+import, and is timed from inside it, without the interpreter's own start up.
+Run it from this directory with python3 -m unittest test_import_time, or
+directly.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+HERE = os.path.dirname(os.path.realpath(__file__))
+
+# Milliseconds, the best of RUNS imports
+BUDGETS_MS = {
+    "gpio_controller": 50,
+    "examples.example_6502.harness_6502": 100,
+}
+RUNS = 3
+
+# Nothing that opens or drives hardware, nor the heavy optional imports
+FORBIDDEN_MODULES = ("otl866", "asyncio", "concurrent.futures", "prompt_toolkit")
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed_ms = (time.perf_counter() - start) * 1e3
+print(json.dumps({{"ms": elapsed_ms, "modules": sorted(sys.modules)}}))
+"""
+
+
+def import_in_subprocess(module: str) -> dict:
+    res = subprocess.run(
+        [sys.executable, "-c", _PROBE.format(module=module)],
+        cwd=HERE,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(res.stdout)
+
+
+class ImportTimeTest(unittest.TestCase):
+    def test_budgets(self) -> None:
+        for module, budget_ms in BUDGETS_MS.items():
+            with self.subTest(module=module):
+                runs = [import_in_subprocess(module) for _ in range(RUNS)]
+                best_ms = min(run["ms"] for run in runs)
+                self.assertLess(
+                    best_ms, budget_ms, f"importing {module} took {best_ms:.1f} ms"
+                )
+                imported = set(runs[0]["modules"]).intersection(FORBIDDEN_MODULES)
+                self.assertFalse(imported, f"importing {module} imported {imported}")
+
+
+if __name__ == "__main__":
+    unittest.main()
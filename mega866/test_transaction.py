@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+"""
+Transaction step order across TL866s, on a VirtualBoard.
+
+Run it from this directory with python3 -m unittest test_transaction, or
+directly.
+"""
+
+import unittest
+from typing import Tuple
+
+from gpio_controller import GpioController, Tl866Instance, pin2Tl866_map
+from virtual_tl866 import DutModel, VirtualBoard
+
+# Mega pins on different TL866s, wired together by Loopback
+SOURCE_PIN = 1
+SINK_PIN = 2
+
+
+def pin(x: int) -> int:
+    return 1 << (x - 1)
+
+
+class Loopback(DutModel):
+    """Drives SINK_PIN to whatever the host drives on SOURCE_PIN"""
+
+    def update(self, driven: int, levels: int) -> Tuple[int, int]:
+        return pin(SINK_PIN), pin(SINK_PIN) if levels & pin(SOURCE_PIN) else 0
+
+
+def loopback_controller(concurrent: bool) -> GpioController:
+    # The latency gives the other TL866's worker time to overtake
+    board = VirtualBoard(latency=0.0002, dut=Loopback())
+    controller = GpioController(
+        **{
+            f"{instance.name.lower()}_serial_device": instance.name.lower()
+            for instance in Tl866Instance
+        },
+        concurrent=concurrent,
+        backend=board.open,
+    )
+    controller.init()
+    controller.io_tri(~pin(SOURCE_PIN) & controller.device_pins())
+    return controller
+
+
+class TransactionOrderTest(unittest.TestCase):
+    def test_pins_on_different_instances(self) -> None:
+        self.assertNotEqual(
+            pin2Tl866_map[SOURCE_PIN].instance, pin2Tl866_map[SINK_PIN].instance
+        )
+
+    def test_write_then_read_other_instance(self) -> None:
+        levels = [i % 2 for i in range(100)]
+        for concurrent in (False, True):
+            with self.subTest(concurrent=concurrent):
+                with loopback_controller(concurrent) as controller:
+                    t = controller.transaction()
+                    for level in levels:
+                        t.io_w(pin(SOURCE_PIN) if level else 0)
+                        t.io_r(pin(SINK_PIN))
+                    reads = t.flush()
+                self.assertEqual([int(bool(r)) for r in reads], levels)
+
+    def test_delay_between_instances(self) -> None:
+        with loopback_controller(True) as controller:
+            t = controller.transaction()
+            t.io_w(pin(SOURCE_PIN))
+            t.delay(0.0001)
+            t.io_r(pin(SINK_PIN))
+            t.io_w(0)
+            t.delay(0.0001)
+            t.io_r(pin(SINK_PIN))
+            self.assertEqual(t.flush(), [pin(SINK_PIN), 0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+"""
+run_vectors() on a VirtualBoard, with vectors that drive one TL866 and check
+another.
+
+Run it from this directory with python3 -m unittest test_vectors, or directly.
+"""
+
+import unittest
+
+from gpio_controller import GpioController, Tl866Instance
+from test_transaction import SINK_PIN, SOURCE_PIN, Loopback
+from vectors import parse_vectors, run_vectors
+from virtual_tl866 import VirtualBoard
+
+# SOURCE_PIN drives SINK_PIN, on another TL866
+LOOPBACK_VECTORS = [f"pins {SOURCE_PIN} {SINK_PIN}"] + ["0L", "1H"] * 100
+
+
+def run_loopback(concurrent: bool, batch_size: int = 256) -> int:
+    board = VirtualBoard(latency=0.0002, dut=Loopback())
+    with GpioController(
+        **{
+            f"{instance.name.lower()}_serial_device": instance.name.lower()
+            for instance in Tl866Instance
+        },
+        concurrent=concurrent,
+        backend=board.open,
+    ) as controller:
+        controller.init()
+        report = run_vectors(
+            controller, parse_vectors(LOOPBACK_VECTORS), batch_size=batch_size
+        )
+    return report.mismatches
+
+
+class RunVectorsTest(unittest.TestCase):
+    def test_cross_instance_vectors(self) -> None:
+        for concurrent in (False, True):
+            with self.subTest(concurrent=concurrent):
+                self.assertEqual(run_loopback(concurrent), 0)
+
+    def test_cross_instance_vectors_small_batches(self) -> None:
+        self.assertEqual(run_loopback(True, batch_size=7), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
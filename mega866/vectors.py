@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+
+"""
+Streaming functional test vectors.
+
+A vector drives some pins, tri-states the rest and checks the levels read back
+on the pins it cares about. Vector files are read a line at a time and applied
+in fixed size batches, each one controller transaction, so a file of any
+length runs in constant memory.
+
+Two line formats are accepted, and "#" starts a comment:
+
+    # drive tri expect care, as mega pin masks
+    0x1 0xfffffffffe 0x100 0x100
+
+    # A "pins" line switches to one character per listed pin. Pin names are
+    # mega pins, or package pins when the run has an adapter.
+    pins 1 2 3 4
+    01HX
+    10LX
+
+with 0/1 driving a pin low/high, L/H expecting it low/high and X leaving it
+tri-stated and unchecked. In the character format every other pin is
+tri-stated. run_vectors() only tri-states pins of the TL866s the controller
+has.
+
+    report = run_vectors(controller, read_vectors("count.vec", adapter))
+    print_report(report)
+"""
+
+import argparse
+import time
+from itertools import islice
+from typing import Iterable, Iterator, List, NamedTuple, Optional
+
+from adapter import Adapter, load_adapter
+from bus import SignalGroup
+from gpio_controller import MEGA866_HIGHEST_PIN_NUMBER, GpioController, Tl866Instance
+
+_ALL_PINS = (1 << MEGA866_HIGHEST_PIN_NUMBER) - 1
+
+
+class Vector(NamedTuple):
+    drive: int
+    tri: int
+    expect: int
+    care: int
+
+
+class Mismatch(NamedTuple):
+    index: int
+    expected: int
+    got: int
+    # Mega pins whose level differed, where the vector cares
+    pins: int
+
+
+class VectorReport(NamedTuple):
+    vectors: int
+    mismatches: int
+    first_mismatches: List[Mismatch]
+    elapsed_s: float
+
+    @property
+    def vectors_per_second(self) -> float:
+        return self.vectors / self.elapsed_s if self.elapsed_s else 0.0
+
+
+# Character -> "1" for each mask of the character format, everything else -> "0"
+_DRIVEN = str.maketrans("01LHXZ", "110000")
+_HIGH = str.maketrans("01LHXZ", "010100")
+_CARE = str.maketrans("01LHXZ", "001100")
+_VALID_CHARACTERS = frozenset("01LHXZ")
+
+
+class _PatternColumns:
+    """Encodes character format lines, one character per pin"""
+
+    def __init__(self, names: List[str], adapter: Optional[Adapter]) -> None:
+        if adapter is not None:
+            mega_pins = [adapter[int(n) if n.isdigit() else n] for n in names]
+        else:
+            mega_pins = [int(n) for n in names]
+        # The first column is the least significant bit of the reversed line
+        self.group = SignalGroup("pins", mega_pins)
+        self.width = self.group.width
+
+    def encode(self, line: str) -> Vector:
+        if len(line) != self.width or not _VALID_CHARACTERS.issuperset(line):
+            raise Exception(f"expected {self.width} characters of 01LHXZ")
+        bits = line[::-1]
+        driven = self.group.encode(int(bits.translate(_DRIVEN), 2))
+        high = self.group.encode(int(bits.translate(_HIGH), 2))
+        return Vector(
+            drive=high & driven,
+            tri=_ALL_PINS & ~driven,
+            expect=high & ~driven,
+            care=self.group.encode(int(bits.translate(_CARE), 2)),
+        )
+
+
+def parse_vectors(
+    lines: Iterable[str], adapter: Optional[Adapter] = None, name: str = "<vectors>"
+) -> Iterator[Vector]:
+    columns: Optional[_PatternColumns] = None
+    for line_number, line in enumerate(lines, 1):
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        try:
+            fields = line.split()
+            if fields[0] == "pins":
+                columns = _PatternColumns(fields[1:], adapter)
+            elif columns is not None:
+                yield columns.encode("".join(fields))
+            elif len(fields) == 4:
+                yield Vector(*(int(field, 16) for field in fields))
+            else:
+                raise Exception("expected drive, tri, expect and care masks")
+        except Exception as e:
+            raise Exception(f"{name}:{line_number}: {e}")
+
+
+def read_vectors(path: str, adapter: Optional[Adapter] = None) -> Iterator[Vector]:
+    with open(path) as f:
+        yield from parse_vectors(f, adapter, path)
+
+
+def run_vectors(
+    controller: GpioController,
+    vectors: Iterable[Vector],
+    batch_size: int = 256,
+    max_mismatches: int = 10,
+    settle: float = 0.0,
+) -> VectorReport:
+    """
+    Applies vectors in batches of batch_size, each one transaction, and checks
+    every read back against the expected levels. Transactions keep their steps
+    in order across TL866s, also on a concurrent controller, so a vector may
+    drive one TL866 and check another. settle is the delay between
+    applying a vector and reading it back, in seconds. Only the first
+    max_mismatches mismatches are kept, but all are counted. Pins of TL866s
+    the controller has no device for are left out of tri.
+    """
+    device_pins = controller.device_pins()
+    count = 0
+    n_mismatches = 0
+    first_mismatches: List[Mismatch] = []
+    start = time.monotonic()
+    vectors = iter(vectors)
+    while True:
+        batch = list(islice(vectors, batch_size))
+        if not batch:
+            break
+        t = controller.transaction()
+        checked = []
+        for index, vector in enumerate(batch, count):
+            # Output levels first, so a pin never drives its previous value
+            t.io_w(vector.drive)
+            t.io_tri(vector.tri & device_pins)
+            if vector.care:
+                if settle:
+                    t.delay(settle)
+                t.io_r(vector.care)
+                checked.append((index, vector))
+        reads = t.flush()
+        count += len(batch)
+
+        for (index, vector), got in zip(checked, reads):
+            failing = (got ^ vector.expect) & vector.care
+            if failing:
+                n_mismatches += 1
+                if len(first_mismatches) < max_mismatches:
+                    first_mismatches.append(
+                        Mismatch(
+                            index,
+                            vector.expect & vector.care,
+                            got & vector.care,
+                            failing,
+                        )
+                    )
+    return VectorReport(
+        count, n_mismatches, first_mismatches, time.monotonic() - start
+    )
+
+
+def _pin_names(pins: int, adapter: Optional[Adapter]) -> str:
+    names = []
+    while pins:
+        mega_pin = (pins & -pins).bit_length()
+        pins &= pins - 1
+        name = adapter.package_pin_for(mega_pin) if adapter is not None else None
+        names.append(name if name is not None else str(mega_pin))
+    return " ".join(names)
+
+
+def print_report(report: VectorReport, adapter: Optional[Adapter] = None) -> None:
+    print(
+        f"{report.vectors} vectors, {report.mismatches} mismatches in "
+        f"{report.elapsed_s:.2f} s, {report.vectors_per_second:.1f} vectors/s"
+    )
+    for mismatch in report.first_mismatches:
+        print(
+            f"  vector {mismatch.index}: expected {mismatch.expected:#x} got "
+            f"{mismatch.got:#x}, pins {_pin_names(mismatch.pins, adapter)}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Apply a test vector file")
+    parser.add_argument("vectors", help="vector file")
+    for instance in Tl866Instance:
+        parser.add_argument(
+            f"--{instance.name.lower()}",
+            metavar="DEVICE",
+            help=f"serial device of the {instance.name} TL866",
+        )
+    parser.add_argument(
+        "--socket", help="use the board_daemon on this socket instead of devices"
+    )
+    parser.add_argument("--adapter", help="pin names in the file are package pins")
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--max-mismatches", type=int, default=10)
+    parser.add_argument(
+        "--settle", type=float, default=0.0, help="seconds between drive and read"
+    )
+    args = parser.parse_args()
+
+    adapter = load_adapter(args.adapter) if args.adapter is not None else None
+    if args.socket is not None:
+        from board_daemon import RemoteGpioController
+
+        controller = RemoteGpioController(args.socket)
+    else:
+        controller = GpioController(
+            water_serial_device=args.water,
+            earth_serial_device=args.earth,
+            fire_serial_device=args.fire,
+            wind_serial_device=args.wind,
+        )
+        controller.init()
+    with controller:
+        report = run_vectors(
+            controller,
+            read_vectors(args.vectors, adapter),
+            batch_size=args.batch_size,
+            max_mismatches=args.max_mismatches,
+            settle=args.settle,
+        )
+    print_report(report, adapter)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+"""
+A tiny static 6502 bus model for VirtualBoard.
+
+It runs a small subset of the instruction set, enough for simple test programs
+such as examples/example_6502/prog_6502.asm, with one bus cycle per PHI2
+period. Address and R/W are valid while PHI2 is low, write data is driven while
+PHI2 is high, and read data is latched on the falling edge. Memory and I/O are
+left to the host, exactly as with a real chip in the socket.
+"""
+
+from typing import Dict, Generator, Optional, Tuple
+
+from bus import Bus
+from virtual_tl866 import DutModel
+
+WRITE = 0
+READ = 1
+
+# address, rw, data being written
+BusCycle = Tuple[int, int, int]
+
+# opcode -> (operation, addressing mode)
+_OPCODES: Dict[int, Tuple[str, str]] = {
+    0xA9: ("lda", "imm"),
+    0xA5: ("lda", "zp"),
+    0xAD: ("lda", "abs"),
+    0xBD: ("lda", "abs,x"),
+    0xB9: ("lda", "abs,y"),
+    0xA2: ("ldx", "imm"),
+    0xA6: ("ldx", "zp"),
+    0xAE: ("ldx", "abs"),
+    0xA0: ("ldy", "imm"),
+    0xA4: ("ldy", "zp"),
+    0xAC: ("ldy", "abs"),
+    0x85: ("sta", "zp"),
+    0x8D: ("sta", "abs"),
+    0x9D: ("sta", "abs,x"),
+    0x86: ("stx", "zp"),
+    0x8E: ("stx", "abs"),
+    0x84: ("sty", "zp"),
+    0x8C: ("sty", "abs"),
+    0xC9: ("cmp", "imm"),
+    0xC5: ("cmp", "zp"),
+    0xCD: ("cmp", "abs"),
+    0xE0: ("cpx", "imm"),
+    0xC0: ("cpy", "imm"),
+    0xE8: ("inx", "imp"),
+    0xC8: ("iny", "imp"),
+    0xCA: ("dex", "imp"),
+    0x88: ("dey", "imp"),
+    0xAA: ("tax", "imp"),
+    0x8A: ("txa", "imp"),
+    0xEA: ("nop", "imp"),
+    0xF0: ("beq", "rel"),
+    0xD0: ("bne", "rel"),
+    0xB0: ("bcs", "rel"),
+    0x90: ("bcc", "rel"),
+    0x30: ("bmi", "rel"),
+    0x10: ("bpl", "rel"),
+    0x4C: ("jmp", "abs"),
+}
+
+
+class Virtual6502(DutModel):
+    def __init__(self, bus: Bus, clock_pin: int, reset_pin: int) -> None:
+        """bus needs "address", "data" and "rw" groups"""
+        self._address = bus["address"]
+        self._data = bus["data"]
+        self._rw = bus["rw"]
+        self._clock_mask = 1 << (clock_pin - 1)
+        self._reset_mask = 1 << (reset_pin - 1)
+        self.reset()
+
+    def reset(self) -> None:
+        self.a = self.x = self.y = 0
+        self.pc = 0
+        self.n = self.z = self.c = False
+        self.cycles = 0
+        self.unknown_opcodes = 0
+        self._clock = False
+        self._program: Optional[Generator[BusCycle, Optional[int], None]] = None
+        self._cycle: BusCycle = (0xFFFF, READ, 0)
+
+    def update(self, driven: int, levels: int) -> Tuple[int, int]:
+        clock = bool(driven & levels & self._clock_mask)
+        if not driven & levels & self._reset_mask:
+            # Held in reset until RESB goes high
+            self._program = None
+        elif self._program is None:
+            self._program = self._run()
+            self._cycle = next(self._program)
+        elif self._clock and not clock:
+            address, rw, _ = self._cycle
+            data = self._data.decode(levels) if rw == READ else None
+            self._cycle = self._program.send(data)
+            self.cycles += 1
+        self._clock = clock
+
+        address, rw, data = self._cycle
+        outputs = self._address.mask | self._rw.mask
+        out_levels = self._address.encode(address) | self._rw.encode(rw)
+        if rw == WRITE and clock:
+            outputs |= self._data.mask
+            out_levels |= self._data.encode(data)
+        return outputs, out_levels
+
+    def _read(self, address: int) -> Generator[BusCycle, Optional[int], int]:
+        data = yield (address & 0xFFFF, READ, 0)
+        return data or 0
+
+    def _write(
+        self, address: int, data: int
+    ) -> Generator[BusCycle, Optional[int], None]:
+        yield (address & 0xFFFF, WRITE, data & 0xFF)
+
+    def _fetch(self) -> Generator[BusCycle, Optional[int], int]:
+        data = yield from self._read(self.pc)
+        self.pc = (self.pc + 1) & 0xFFFF
+        return data
+
+    def _operand_address(
+        self, mode: str
+    ) -> Generator[BusCycle, Optional[int], int]:
+        if mode == "zp":
+            return (yield from self._fetch())
+        low = yield from self._fetch()
+        high = yield from self._fetch()
+        address = low | high << 8
+        if mode == "abs,x":
+            address += self.x
+        elif mode == "abs,y":
+            address += self.y
+        return address & 0xFFFF
+
+    def _operand(self, mode: str) -> Generator[BusCycle, Optional[int], int]:
+        if mode == "imm":
+            return (yield from self._fetch())
+        address = yield from self._operand_address(mode)
+        return (yield from self._read(address))
+
+    def _set_nz(self, value: int) -> int:
+        value &= 0xFF
+        self.n = bool(value & 0x80)
+        self.z = value == 0
+        return value
+
+    def _run(self) -> Generator[BusCycle, Optional[int], None]:
+        for address in (0x00FF, 0x00FF, 0x01FF, 0x01FE, 0x01FD):
+            yield from self._read(address)
+        low = yield from self._read(0xFFFC)
+        high = yield from self._read(0xFFFD)
+        self.pc = low | high << 8
+
+        while True:
+            opcode = yield from self._fetch()
+            if opcode not in _OPCODES:
+                # Treat anything unknown as a two cycle NOP
+                self.unknown_opcodes += 1
+                yield from self._read(self.pc)
+                continue
+            op, mode = _OPCODES[opcode]
+
+            if op in ("lda", "ldx", "ldy"):
+                value = self._set_nz((yield from self._operand(mode)))
+                setattr(self, op[2], value)
+            elif op in ("cmp", "cpx", "cpy"):
+                register = {"cmp": self.a, "cpx": self.x, "cpy": self.y}[op]
+                value = yield from self._operand(mode)
+                self.c = register >= value
+                self._set_nz(register - value)
+            elif op in ("sta", "stx", "sty"):
+                address = yield from self._operand_address(mode)
+                yield from self._write(address, getattr(self, op[2]))
+            elif mode == "imp":
+                yield from self._read(self.pc)
+                if op in ("inx", "dex"):
+                    self.x = self._set_nz(self.x + (1 if op == "inx" else -1))
+                elif op in ("iny", "dey"):
+                    self.y = self._set_nz(self.y + (1 if op == "iny" else -1))
+                elif op == "tax":
+                    self.x = self._set_nz(self.a)
+                elif op == "txa":
+                    self.a = self._set_nz(self.x)
+            elif mode == "rel":
+                offset = yield from self._fetch()
+                taken = {
+                    "beq": self.z,
+                    "bne": not self.z,
+                    "bcs": self.c,
+                    "bcc": not self.c,
+                    "bmi": self.n,
+                    "bpl": not self.n,
+                }[op]
+                if taken:
+                    yield from self._read(self.pc)
+                    if offset & 0x80:
+                        offset -= 0x100
+                    self.pc = (self.pc + offset) & 0xFFFF
+            elif op == "jmp":
+                self.pc = yield from self._operand_address(mode)
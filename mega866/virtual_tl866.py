@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+"""
+An in-memory Mega866 for running GpioController without hardware.
+
+VirtualBoard stands in for the four TL866s and can be passed to GpioController
+as its backend:
+
+    board = VirtualBoard(latency=0.0005, dut=my_model)
+    controller = GpioController(earth_serial_device="earth", backend=board.open)
+
+Every command can be delayed by a fixed latency to mimic the USB round trip, or
+run at full speed with latency=0. An optional DUT model sees the pins the host
+drives and drives pins of its own, in mega pin space.
+"""
+
+import time
+from collections import Counter
+from threading import Lock
+from typing import Dict, Optional, Tuple
+
+from gpio_controller import (
+    TL866_ALL_PINS_MASK,
+    Tl866Instance,
+    pin_translator,
+)
+
+
+class DutModel:
+    """Behavioural model of whatever is plugged into the board"""
+
+    def reset(self) -> None:
+        pass
+
+    def update(self, driven: int, levels: int) -> Tuple[int, int]:
+        """
+        Called whenever the host changes a pin. driven is the mask of pins the
+        host drives and levels their values. Returns the mask of pins the DUT
+        drives and their values.
+        """
+        return 0, 0
+
+
+class VirtualTl866:
+    """Implements the otl866.bitbang.Bitbang calls GpioController makes"""
+
+    def __init__(
+        self, board: "VirtualBoard", instance: Tl866Instance, device: str
+    ) -> None:
+        self.board = board
+        self.instance = instance
+        self.device = device
+        self.commands: Counter = Counter()
+        self._power_on_state()
+
+    def _command(self, name: str) -> None:
+        self.commands[name] += 1
+        if self.board.latency:
+            time.sleep(self.board.latency)
+
+    def _power_on_state(self) -> None:
+        self.tri = TL866_ALL_PINS_MASK
+        self.out = 0
+        self.vdd_enabled = False
+        self.vdd_voltage = 0
+        self.vdd_pin_mask = 0
+        self.vpp_enabled = False
+        self.vpp_voltage = 0
+        self.vpp_pin_mask = 0
+        self.gnd_pin_mask = 0
+
+    def init(self) -> None:
+        self._command("init")
+        self._power_on_state()
+        self.board.settle()
+
+    def io_tri(self, val: int) -> None:
+        self._command("io_tri")
+        self.tri = val & TL866_ALL_PINS_MASK
+        self.board.settle()
+
+    def io_trir(self) -> int:
+        self._command("io_trir")
+        return self.tri
+
+    def io_w(self, val: int) -> None:
+        self._command("io_w")
+        self.out = val & TL866_ALL_PINS_MASK
+        self.board.settle()
+
+    def io_r(self) -> int:
+        self._command("io_r")
+        return self.board.levels_for(self.instance)
+
+    def vdd_en(self, enable: bool = True) -> None:
+        self._command("vdd_en")
+        self.vdd_enabled = enable
+
+    def vdd_volt(self, val: int) -> None:
+        self._command("vdd_volt")
+        self.vdd_voltage = val
+
+    def vdd_pins(self, val: int) -> None:
+        self._command("vdd_pins")
+        self.vdd_pin_mask = val
+
+    def vpp_en(self, enable: bool = True) -> None:
+        self._command("vpp_en")
+        self.vpp_enabled = enable
+
+    def vpp_volt(self, val: int) -> None:
+        self._command("vpp_volt")
+        self.vpp_voltage = val
+
+    def vpp_pins(self, val: int) -> None:
+        self._command("vpp_pins")
+        self.vpp_pin_mask = val
+
+    def gnd_pins(self, val: int) -> None:
+        self._command("gnd_pins")
+        self.gnd_pin_mask = val
+
+
+class VirtualBoard:
+    def __init__(
+        self,
+        latency: float = 0.0,
+        dut: Optional[DutModel] = None,
+        floating_level: int = 0,
+    ) -> None:
+        """
+        latency is the time every command takes, in seconds. floating_level is
+        what io_r() returns for pins nobody drives, a mega pin mask.
+        """
+        self.latency = latency
+        self.dut = dut if dut is not None else DutModel()
+        self.floating_level = floating_level
+        self.contentions = 0
+        # TL866s may be driven from GpioController's concurrent workers
+        self._lock = Lock()
+        self.tl866s: Dict[Tl866Instance, VirtualTl866] = {}
+        self._levels: Tuple[int, ...] = (0,) * len(Tl866Instance)
+        for instance in Tl866Instance:
+            self.tl866s[instance] = VirtualTl866(self, instance, instance.name)
+        self.dut.reset()
+        self.settle()
+
+    def open(self, device: str, instance: Tl866Instance) -> VirtualTl866:
+        """GpioController backend, returns the virtual TL866 for instance"""
+        tl866 = self.tl866s[instance]
+        tl866.device = device
+        return tl866
+
+    def host_pins(self) -> Tuple[int, int]:
+        """Returns the mega pin mask the host drives and the levels it drives"""
+        driven = 0
+        levels = 0
+        for instance, tl866 in self.tl866s.items():
+            driven |= pin_translator.merge(instance, ~tl866.tri)
+            levels |= pin_translator.merge(instance, tl866.out & ~tl866.tri)
+        return driven, levels
+
+    def settle(self) -> None:
+        with self._lock:
+            host_driven, host_levels = self.host_pins()
+            dut_driven, dut_levels = self.dut.update(host_driven, host_levels)
+            if host_driven & dut_driven:
+                self.contentions += 1
+            levels = (
+                host_levels
+                | (dut_levels & dut_driven & ~host_driven)
+                | (self.floating_level & ~(host_driven | dut_driven))
+            )
+            self._levels = pin_translator.split(levels)
+
+    def levels_for(self, instance: Tl866Instance) -> int:
+        return self._levels[instance.value - 1]
+
+    def command_counts(self) -> Counter:
+        counts: Counter = Counter()
+        for tl866 in self.tl866s.values():
+            counts.update(tl866.commands)
+        return counts